@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 21:00
+# @File  : bench_parsers.py
+# @Author:
+# @Desc  : Markdown大纲解析器的微基准：生成10到10000个章节的大纲（带或不带@描述），
+#          统计parse_markdown_to_slides、parse_markdown_to_slides_advanced和parse_markdown_to_json的耗时和内存分配，
+#          检查三者结果一致，以及耗时是否随章节数线性增长
+
+import copy
+import importlib.util
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+
+import click
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+PROJECT_DIR = os.path.dirname(BACKEND_DIR)
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+# 这几种页面的text在带@描述时由描述生成，比较结果时忽略
+DESCRIBED_TYPES = ("cover", "transition")
+
+
+def load_function(path: str, name: str) -> Callable:
+    """直接从文件加载函数，不导入所在的包（slide_agent包会加载Agent和模型配置）"""
+    module_name = "bench_" + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, name)
+
+
+def load_parsers() -> Dict[str, Callable]:
+    return {
+        "slides": load_function(os.path.join(BACKEND_DIR, "slide_agent", "slide_agent", "utils.py"), "parse_markdown_to_slides"),
+        "advanced": load_function(os.path.join(BACKEND_DIR, "main_api", "advanced_parser.py"), "parse_markdown_to_slides_advanced"),
+        "train_data": load_function(os.path.join(PROJECT_DIR, "utils", "generate_train_data.py"), "parse_markdown_to_json"),
+    }
+
+
+def build_outline(sections: int, descriptions: bool, subsections: int = 2, items: int = 3) -> str:
+    """生成指定章节数的大纲，descriptions为True时在封面、章节和每个项目后面加@描述"""
+    lines = ["# 基准测试大纲"]
+    if descriptions:
+        lines.append("@封面描述")
+    for i in range(1, sections + 1):
+        lines.append("")
+        lines.append(f"## 第{i}章")
+        if descriptions:
+            lines.append(f"@第{i}章的描述")
+        for j in range(1, subsections + 1):
+            lines.append(f"### 第{i}章第{j}节")
+            for k in range(1, items + 1):
+                lines.append(f"- 第{i}章第{j}节要点{k}")
+                if descriptions:
+                    lines.append(f"@第{i}章第{j}节要点{k}的描述")
+    return "\n".join(lines)
+
+
+def normalize(slides: List[dict]) -> List[dict]:
+    """去掉可以由@描述生成的text，剩下的结构三个解析器应该完全一致"""
+    slides = copy.deepcopy(slides)
+    for slide in slides:
+        data = slide.get("data") or {}
+        if slide.get("type") in DESCRIBED_TYPES:
+            data.pop("text", None)
+        elif slide.get("type") == "content":
+            for item in data.get("items", []):
+                item.pop("text", None)
+    return slides
+
+
+def check_equivalence(parsers: Dict[str, Callable], sections: int) -> List[str]:
+    """返回不一致的描述，为空表示一致"""
+    problems = []
+    plain = build_outline(sections, descriptions=False)
+    described = build_outline(sections, descriptions=True)
+    results = {name: parser(plain) for name, parser in parsers.items()}
+    reference = results["advanced"]
+    for name, slides in results.items():
+        if slides != reference:
+            problems.append(f"没有@描述时{name}与advanced的结果不同（{sections}个章节）")
+    for name, parser in parsers.items():
+        slides = parser(described)
+        if normalize(slides) != normalize(reference):
+            problems.append(f"带@描述时{name}的结构与没有@描述时不同（{sections}个章节）")
+        if name != "advanced" and slides != results[name]:
+            # 简单解析器不支持@描述，应该忽略@行
+            problems.append(f"{name}没有忽略@描述行（{sections}个章节）")
+    described_slides = parsers["advanced"](described)
+    if described_slides[0]["data"]["text"] != "封面描述" or described_slides[-2]["data"]["items"][0]["text"] != f"第{sections}章第2节要点1的描述":
+        problems.append(f"advanced没有使用@描述（{sections}个章节）")
+    return problems
+
+
+def measure(parser: Callable, text: str, repeat: int) -> dict:
+    timer = timeit.Timer(lambda: parser(text))
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    parser(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": round(seconds * 1000, 4), "peak_kb": round(peak / 1024, 1)}
+
+
+def run(parsers: Dict[str, Callable], sizes: List[int], repeat: int) -> List[dict]:
+    rows = []
+    for descriptions in (False, True):
+        for sections in sizes:
+            text = build_outline(sections, descriptions)
+            for name, parser in parsers.items():
+                result = measure(parser, text, repeat)
+                result.update({
+                    "parser": name,
+                    "descriptions": descriptions,
+                    "sections": sections,
+                    "us_per_section": round(result["ms"] * 1000 / sections, 3),
+                    "bytes_per_section": round(result["peak_kb"] * 1024 / sections, 1),
+                })
+                rows.append(result)
+    return rows
+
+
+def check_scaling(rows: List[dict], max_growth: float) -> List[str]:
+    """每个章节的耗时和内存从最小规模（至少100个章节，排除固定开销）到最大规模的增长不能超过max_growth倍"""
+    problems = []
+    groups: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        groups.setdefault((row["parser"], row["descriptions"]), []).append(row)
+    for (parser, descriptions), group in groups.items():
+        group = sorted((r for r in group if r["sections"] >= 100), key=lambda r: r["sections"])
+        if len(group) < 2:
+            continue
+        first, last = group[0], group[-1]
+        for metric in ("us_per_section", "bytes_per_section"):
+            if first[metric] and last[metric] / first[metric] > max_growth:
+                problems.append(f"{parser}{'（带@描述）' if descriptions else ''}的{metric}从{first['sections']}个章节的"
+                                f"{first[metric]}增长到{last['sections']}个章节的{last[metric]}，不是线性复杂度")
+    return problems
+
+
+def compare_with_baseline(rows: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    old = {(r["parser"], r["descriptions"], r["sections"]): r for r in baseline}
+    regressions = []
+    for row in rows:
+        base = old.get((row["parser"], row["descriptions"], row["sections"]))
+        # 太快的用例误差大，只比较1毫秒以上的
+        if not base or base["ms"] < 1:
+            continue
+        change = (row["ms"] - base["ms"]) / base["ms"]
+        if change > tolerance:
+            regressions.append(f"{row['parser']} {row['sections']}个章节{'（带@描述）' if row['descriptions'] else ''}: "
+                               f"{base['ms']}ms -> {row['ms']}ms ({change:+.1%})")
+    return regressions
+
+
+def print_rows(rows: List[dict]) -> None:
+    print(f"{'解析器':<12}{'@描述':>6}{'章节数':>8}{'耗时ms':>12}{'us/章节':>10}{'峰值KB':>12}{'B/章节':>10}")
+    for r in rows:
+        print(f"{r['parser']:<12}{'是' if r['descriptions'] else '否':>6}{r['sections']:>8}{r['ms']:>12}"
+              f"{r['us_per_section']:>10}{r['peak_kb']:>12}{r['bytes_per_section']:>10}")
+
+
+@click.command()
+@click.option("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="章节数，逗号分隔")
+@click.option("--repeat", default=3, help="每个用例重复测量的次数，取最小值")
+@click.option("--check", is_flag=True, help="结果不一致或者不是线性复杂度时退出码为1")
+@click.option("--max-growth", default=3.0, help="每个章节的耗时/内存允许增长的倍数")
+@click.option("--output", default="", help="把结果写入JSON文件")
+@click.option("--baseline", default="", help="之前的结果JSON文件，对比是否有性能退化")
+@click.option("--tolerance", default=0.3, help="对比基线时允许的耗时增长比例")
+def main(sizes, repeat, check, max_growth, output, baseline, tolerance):
+    sizes = sorted(int(size) for size in sizes.split(","))
+    parsers = load_parsers()
+
+    problems = []
+    for sections in sizes[:2]:
+        problems.extend(check_equivalence(parsers, sections))
+    if not problems:
+        print("三个解析器的结果一致")
+
+    rows = run(parsers, sizes, repeat)
+    print_rows(rows)
+    problems.extend(check_scaling(rows, max_growth))
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到{output}")
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            problems.extend(compare_with_baseline(rows, json.load(f), tolerance))
+
+    if problems:
+        print("\n发现问题：")
+        for line in problems:
+            print(f"  {line}")
+        if check or baseline:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 20:00
+# @File  : fake_llm.py
+# @Author:
+# @Desc  : 兼容OpenAI接口的模拟LLM，用于压测：可配置首token延迟、生成速度和错误率；大纲模型返回Markdown大纲，其它模型根据prompt中的页面类型返回一页幻灯片JSON
+
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+import click
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 模型名包含这个字符串时返回大纲
+OUTLINE_MODEL_MARK = "outline"
+
+app = FastAPI()
+# 通过命令行参数修改
+settings = {
+    # 首token延迟（秒）
+    "ttft": 0.5,
+    # 每秒生成的token数
+    "tokens_per_sec": 50.0,
+    # 返回500错误的概率
+    "error_rate": 0.0,
+    # 大纲的章节数和每个章节的小节数
+    "sections": 3,
+    "subsections": 2,
+    # 内容页每一项的字数
+    "item_chars": 80,
+}
+stats = {"requests": 0, "errors": 0, "active": 0, "completion_tokens": 0}
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def build_outline(topic: str) -> str:
+    """按配置的章节数生成Markdown大纲，主题不同大纲就不同，避免命中幻灯片缓存"""
+    topic = topic.strip().splitlines()[0][:30] if topic.strip() else "压测主题"
+    lines = [f"# {topic}"]
+    for i in range(1, settings["sections"] + 1):
+        lines.append(f"## {topic}第{i}章")
+        for j in range(1, settings["subsections"] + 1):
+            lines.append(f"### {topic}第{i}章第{j}节")
+            for k in range(1, 4):
+                lines.append(f"- {topic}第{i}章第{j}节要点{k}")
+    return "\n".join(lines)
+
+
+def build_slide(prompt: str) -> str:
+    """从写作prompt中找到这一页的类型和标题，返回同样结构的一页幻灯片JSON"""
+    match = re.search(r"['\"]type['\"]:\s*['\"](\w+)['\"]", prompt)
+    slide_type = match.group(1) if match else "content"
+    title_match = re.search(r"['\"]title['\"]:\s*['\"]([^'\"]*)['\"]", prompt)
+    title = title_match.group(1) if title_match else "标题"
+    text = ("模拟生成的内容" * settings["item_chars"])[:settings["item_chars"]]
+    if slide_type == "content":
+        data = {"title": title, "items": [{"title": f"要点{k}", "text": text} for k in range(1, 4)]}
+    elif slide_type == "contents":
+        data = {"items": [f"章节{k}" for k in range(1, settings["sections"] + 1)]}
+    else:
+        data = {"title": title, "text": text[:32]}
+    return json.dumps({"type": slide_type, "data": data}, ensure_ascii=False)
+
+
+def split_tokens(text: str, size: int = 4) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None, usage=None) -> str:
+    data = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        data["usage"] = usage
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    messages = body.get("messages", [])
+    stats["requests"] += 1
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "fake llm error", "type": "server_error"}})
+
+    if OUTLINE_MODEL_MARK in model:
+        user_texts = [_message_text(m) for m in messages if m.get("role") == "user"]
+        content = build_outline(user_texts[-1] if user_texts else "")
+    else:
+        content = build_slide("\n".join(_message_text(m) for m in messages))
+    tokens = split_tokens(content)
+    prompt_tokens = sum(len(_message_text(m)) for m in messages) // 4
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+             "total_tokens": prompt_tokens + len(tokens)}
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    interval = 1.0 / settings["tokens_per_sec"] if settings["tokens_per_sec"] > 0 else 0
+
+    if body.get("stream"):
+        async def event_stream():
+            stats["active"] += 1
+            try:
+                await asyncio.sleep(settings["ttft"])
+                yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+                for token in tokens:
+                    yield _chunk(completion_id, model, {"content": token})
+                    stats["completion_tokens"] += 1
+                    if interval:
+                        await asyncio.sleep(interval)
+                yield _chunk(completion_id, model, {}, finish_reason="stop", usage=usage)
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["active"] -= 1
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    stats["active"] += 1
+    try:
+        await asyncio.sleep(settings["ttft"] + interval * len(tokens))
+    finally:
+        stats["active"] -= 1
+    stats["completion_tokens"] += len(tokens)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="监听地址")
+@click.option("--port", default=6688, help="监听端口")
+@click.option("--ttft", default=0.5, help="首token延迟（秒）")
+@click.option("--tokens-per-sec", default=50.0, help="每秒生成的token数，0表示不限速")
+@click.option("--error-rate", default=0.0, help="返回500错误的概率")
+@click.option("--sections", default=3, help="大纲的章节数")
+@click.option("--subsections", default=2, help="每个章节的小节数")
+def main(host, port, ttft, tokens_per_sec, error_rate, sections, subsections):
+    settings.update(ttft=ttft, tokens_per_sec=tokens_per_sec, error_rate=error_rate,
+                    sections=sections, subsections=subsections)
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 20:00
+# @File  : run_benchmark.py
+# @Author:
+# @Desc  : 压测脚本：启动模拟LLM、大纲Agent、PPT内容Agent和main_api，并发请求大纲/整份PPT/流水线接口，
+#          统计TTFB和总耗时的p50/p95/p99、每秒生成的页数、错误率和各服务的内存增长，可以和之前的结果对比发现性能退化
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import click
+import httpx
+import psutil
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "main_api"))
+from slide_framing import SlideFramer, is_error_record  # noqa: E402
+
+SCENARIOS = ("outline", "deck", "pipeline")
+
+
+@dataclass
+class RequestResult:
+    # 第一个有效数据（大纲的第一个chunk、第一页完整的幻灯片）的耗时
+    ttfb: Optional[float] = None
+    total: float = 0.0
+    slides: int = 0
+    slide_errors: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class Service:
+    name: str
+    cwd: str
+    cmd: List[str]
+    ready_url: str
+    process: Optional[subprocess.Popen] = None
+    log_file: Optional[str] = None
+    memory: Dict[str, float] = field(default_factory=dict)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return round(values[rank], 4)
+
+
+def rss_mb(process: subprocess.Popen) -> float:
+    try:
+        return round(psutil.Process(process.pid).memory_info().rss / 1024 / 1024, 2)
+    except psutil.Error:
+        return 0.0
+
+
+# ---------------- 服务启动 ----------------
+
+def build_services(ports: Dict[str, int], llm_args: List[str], mock: bool) -> List[Service]:
+    python = sys.executable
+    if mock:
+        return [Service("mock_api", os.path.join(BACKEND_DIR, "mock_api"),
+                        [python, "-m", "uvicorn", "mock_main:app", "--host", "127.0.0.1", "--port", str(ports["main_api"]),
+                         "--log-level", "warning"],
+                        f"http://127.0.0.1:{ports['main_api']}/docs")]
+    return [
+        Service("fake_llm", BENCHMARK_DIR,
+                [python, "fake_llm.py", "--port", str(ports["llm"])] + llm_args,
+                f"http://127.0.0.1:{ports['llm']}/stats"),
+        Service("simpleOutline", os.path.join(BACKEND_DIR, "simpleOutline"),
+                [python, "main_api.py", "--host", "127.0.0.1", "--port", str(ports["outline"])],
+                f"http://127.0.0.1:{ports['outline']}/.well-known/agent.json"),
+        Service("slide_agent", os.path.join(BACKEND_DIR, "slide_agent"),
+                [python, "main_api.py", "--host", "127.0.0.1", "--port", str(ports["content"])],
+                f"http://127.0.0.1:{ports['content']}/.well-known/agent.json"),
+        Service("main_api", os.path.join(BACKEND_DIR, "main_api"),
+                [python, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(ports["main_api"]),
+                 "--log-level", "warning"],
+                f"http://127.0.0.1:{ports['main_api']}/metrics"),
+    ]
+
+
+def service_env(ports: Dict[str, int], cache_dir: str, streaming: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        # 大纲Agent和内容Agent都使用本地的模拟LLM，见slide_agent/slide_agent/config.py中的local_openai
+        "MODEL_PROVIDER": "local",
+        "LLM_MODEL": "fake-outline",
+        "LOCAL_API_URL": f"http://127.0.0.1:{ports['llm']}/v1",
+        "LOCAL_API_KEY": "EMPTY",
+        "STREAMING": "true" if streaming else "false",
+        "OUTLINE_API": f"http://127.0.0.1:{ports['outline']}",
+        "CONTENT_API": f"http://127.0.0.1:{ports['content']}",
+        # 每次压测使用新的缓存目录，结果不受之前的缓存影响
+        "CACHE_PATH": cache_dir,
+        "LOG_LEVEL": "WARNING",
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+async def wait_ready(service: Service, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if service.process.poll() is not None:
+                raise RuntimeError(f"{service.name}启动失败，日志见{service.log_file}")
+            try:
+                if (await client.get(service.ready_url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{service.name}在{timeout}秒内没有启动，日志见{service.log_file}")
+
+
+async def start_services(services: List[Service], env: Dict[str, str], log_dir: str, timeout: float) -> None:
+    for service in services:
+        service.log_file = os.path.join(log_dir, f"{service.name}.log")
+        with open(service.log_file, "w") as log:
+            service.process = subprocess.Popen(service.cmd, cwd=service.cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        await wait_ready(service, timeout)
+        print(f"{service.name}已启动, pid: {service.process.pid}")
+
+
+def stop_services(services: List[Service]) -> None:
+    for service in services:
+        if service.process and service.process.poll() is None:
+            service.process.terminate()
+    for service in services:
+        if service.process:
+            try:
+                service.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                service.process.kill()
+
+
+# ---------------- 请求 ----------------
+
+async def request_outline(client: httpx.AsyncClient, base_url: str, topic: str, language: str):
+    """请求大纲，返回(结果, 大纲文本)"""
+    result = RequestResult()
+    start = time.monotonic()
+    texts = []
+    payload = {"content": topic, "language": language, "model": "fake-outline", "stream": True}
+    async with client.stream("POST", f"{base_url}/tools/aippt_outline", json=payload) as response:
+        if response.status_code != 200:
+            result.error = f"HTTP {response.status_code}"
+            return result, ""
+        async for text in response.aiter_text():
+            if text and result.ttfb is None:
+                result.ttfb = time.monotonic() - start
+            texts.append(text)
+    result.total = time.monotonic() - start
+    outline = "".join(texts)
+    if not outline.strip():
+        result.error = "大纲为空"
+    elif outline.lstrip().startswith("{"):
+        try:
+            if is_error_record(json.loads(outline)):
+                result.error = json.loads(outline).get("code") or "OUTLINE_ERROR"
+        except json.JSONDecodeError:
+            pass
+    return result, outline
+
+
+async def run_outline(client: httpx.AsyncClient, base_url: str, topic: str, language: str) -> RequestResult:
+    result, _ = await request_outline(client, base_url, topic, language)
+    return result
+
+
+async def run_deck(client: httpx.AsyncClient, base_url: str, topic: str, language: str) -> RequestResult:
+    """与前端相同的两步：先生成大纲，再用大纲流式生成内容，客户端按页切分；TTFB为第一页完整幻灯片的耗时"""
+    start = time.monotonic()
+    result, outline = await request_outline(client, base_url, topic, language)
+    if result.error:
+        return result
+    result.ttfb = None
+    framer = SlideFramer()
+    async with client.stream("POST", f"{base_url}/tools/aippt", json={"content": outline}) as response:
+        if response.status_code != 200:
+            result.error = f"HTTP {response.status_code}"
+            return result
+        async for text in response.aiter_text():
+            for obj in framer.feed(text):
+                if is_error_record(obj):
+                    result.error = obj.get("code") or "CONTENT_ERROR"
+                    continue
+                result.slides += 1
+                if result.ttfb is None:
+                    result.ttfb = time.monotonic() - start
+    result.slide_errors = len(framer.errors) + (1 if framer.close() else 0)
+    result.total = time.monotonic() - start
+    if not result.slides and not result.error:
+        result.error = "没有生成任何幻灯片"
+    return result
+
+
+async def run_pipeline(client: httpx.AsyncClient, base_url: str, topic: str, language: str) -> RequestResult:
+    """流水线接口，返回NDJSON，每行一页"""
+    result = RequestResult()
+    start = time.monotonic()
+    payload = {"content": topic, "language": language, "model": "fake-outline", "stream": True}
+    async with client.stream("POST", f"{base_url}/tools/aippt_pipeline", json=payload) as response:
+        if response.status_code != 200:
+            result.error = f"HTTP {response.status_code}"
+            return result
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") == "slide":
+                result.slides += 1
+                if result.ttfb is None:
+                    result.ttfb = time.monotonic() - start
+            elif record.get("type") == "error":
+                if record.get("code") == "PIPELINE_OUTLINE_INVALID" or "GENERATION_FAILED" in (record.get("code") or ""):
+                    result.error = record.get("code")
+                else:
+                    result.slide_errors += 1
+    result.total = time.monotonic() - start
+    if not result.slides and not result.error:
+        result.error = "没有生成任何幻灯片"
+    return result
+
+
+SCENARIO_RUNNERS: Dict[str, Callable] = {"outline": run_outline, "deck": run_deck, "pipeline": run_pipeline}
+
+
+async def run_scenario(name: str, base_url: str, requests: int, concurrency: int, language: str,
+                       repeat_prompts: bool, timeout: float) -> dict:
+    runner = SCENARIO_RUNNERS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[RequestResult] = []
+
+    async def one(index: int, client: httpx.AsyncClient):
+        # 默认每个请求的主题不同，不会命中大纲和幻灯片的缓存
+        topic = "压测主题" if repeat_prompts else f"压测主题{name}{index}"
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(runner(client, base_url, topic, language), timeout)
+            except Exception as e:
+                result = RequestResult(error=f"{type(e).__name__}: {e}", total=time.monotonic() - start)
+            results.append(result)
+
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout), limits=limits) as client:
+        wall_start = time.monotonic()
+        await asyncio.gather(*(one(i, client) for i in range(requests)))
+        wall = time.monotonic() - wall_start
+
+    ok = [r for r in results if not r.error]
+    ttfbs = [r.ttfb for r in ok if r.ttfb is not None]
+    totals = [r.total for r in ok]
+    slides = sum(r.slides for r in ok)
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r.error:
+            errors[r.error[:80]] = errors.get(r.error[:80], 0) + 1
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "error_types": errors,
+        "slide_errors": sum(r.slide_errors for r in results),
+        "ttfb_p50": percentile(ttfbs, 50),
+        "ttfb_p95": percentile(ttfbs, 95),
+        "ttfb_p99": percentile(ttfbs, 99),
+        "total_p50": percentile(totals, 50),
+        "total_p95": percentile(totals, 95),
+        "total_p99": percentile(totals, 99),
+        "slides": slides,
+        "slides_per_sec": round(slides / wall, 3) if wall else 0.0,
+        "requests_per_sec": round(len(ok) / wall, 3) if wall else 0.0,
+        "wall_seconds": round(wall, 3),
+    }
+
+
+# ---------------- 报告 ----------------
+
+# 对比基线时检查的指标，True表示越大越差
+COMPARED_METRICS = {
+    "ttfb_p95": True,
+    "total_p95": True,
+    "slides_per_sec": False,
+    "requests_per_sec": False,
+}
+# 延迟变化小于这个值（秒）时不算退化，避免毫秒级的抖动被当成退化
+MIN_LATENCY_DELTA = 0.05
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """返回超过容忍度的退化项"""
+    regressions = []
+    for name, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if higher_is_worse and new - old < MIN_LATENCY_DELTA:
+                continue
+            if (higher_is_worse and change > tolerance) or (not higher_is_worse and change < -tolerance):
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.1%})")
+        if current["error_rate"] > base.get("error_rate", 0) + 0.01:
+            regressions.append(f"{name}.error_rate: {base.get('error_rate')} -> {current['error_rate']}")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    print("\n========== 压测结果 ==========")
+    header = f"{'场景':<10}{'请求':>6}{'错误率':>8}{'TTFB p50':>10}{'p95':>8}{'p99':>8}{'总耗时p50':>10}{'p95':>8}{'p99':>8}{'页/秒':>8}"
+    print(header)
+    for name, s in report["scenarios"].items():
+        fmt = lambda v: "-" if v is None else f"{v:.2f}"
+        print(f"{name:<10}{s['requests']:>6}{s['error_rate']:>8.2%}{fmt(s['ttfb_p50']):>10}{fmt(s['ttfb_p95']):>8}"
+              f"{fmt(s['ttfb_p99']):>8}{fmt(s['total_p50']):>10}{fmt(s['total_p95']):>8}{fmt(s['total_p99']):>8}"
+              f"{s['slides_per_sec']:>8.2f}")
+        if s["error_types"]:
+            print(f"  错误: {s['error_types']}")
+    if report["memory"]:
+        print("\n内存(MB)：")
+        for name, m in report["memory"].items():
+            print(f"  {name:<14} 开始 {m['start']:>8} 结束 {m['end']:>8} 峰值 {m['peak']:>8} 增长 {m['growth']:>8}")
+
+
+async def sample_memory(services: List[Service], stop: asyncio.Event, interval: float = 0.5) -> None:
+    while not stop.is_set():
+        for service in services:
+            service.memory["peak"] = max(service.memory.get("peak", 0.0), rss_mb(service.process))
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def benchmark(scenarios, requests, concurrency, language, repeat_prompts, timeout, start, base_url, ports,
+                    llm_args, mock, streaming, warmup, log_dir) -> dict:
+    services: List[Service] = []
+    cache_dir = tempfile.mkdtemp(prefix="aippt_bench_cache_")
+    log_dir = log_dir or tempfile.mkdtemp(prefix="aippt_bench_logs_")
+    os.makedirs(log_dir, exist_ok=True)
+    try:
+        if start:
+            services = build_services(ports, llm_args, mock)
+            print(f"服务日志目录: {log_dir}")
+            await start_services(services, service_env(ports, cache_dir, streaming), log_dir, timeout=120)
+        # 预热：加载模型、获取Agent Card、建立连接
+        for _ in range(warmup):
+            await run_scenario("outline", base_url, 1, 1, language, False, timeout)
+        for service in services:
+            service.memory["start"] = rss_mb(service.process)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(services, stop))
+        results = {}
+        for name in scenarios:
+            print(f"运行场景{name}: {requests}个请求, 并发{concurrency}")
+            results[name] = await run_scenario(name, base_url, requests, concurrency, language, repeat_prompts, timeout)
+        stop.set()
+        await sampler
+        memory = {}
+        for service in services:
+            end = rss_mb(service.process)
+            memory[service.name] = {"start": service.memory["start"], "end": end,
+                                    "peak": max(service.memory.get("peak", 0.0), end),
+                                    "growth": round(end - service.memory["start"], 2)}
+        return {
+            "config": {"requests": requests, "concurrency": concurrency, "repeat_prompts": repeat_prompts,
+                       "streaming": streaming, "mock": mock, "llm_args": llm_args,
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+            "scenarios": results,
+            "memory": memory,
+        }
+    finally:
+        stop_services(services)
+
+
+@click.command()
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(SCENARIOS), help="要运行的场景，可以指定多次，默认全部")
+@click.option("--requests", default=20, help="每个场景的请求数")
+@click.option("--concurrency", default=5, help="并发请求数")
+@click.option("--language", default="中文", help="请求的语言")
+@click.option("--repeat-prompts", is_flag=True, help="所有请求使用相同的主题，用于测试缓存和请求合并的效果")
+@click.option("--timeout", default=300.0, help="单个请求的超时时间（秒）")
+@click.option("--start/--no-start", default=True, help="是否启动服务，--no-start时压测--base-url指定的已有服务")
+@click.option("--base-url", default="", help="main_api的地址，默认使用--main-api-port启动的服务")
+@click.option("--mock", is_flag=True, help="启动mock_api代替完整的服务，只能运行outline和deck场景")
+@click.option("--streaming/--no-streaming", default=True, help="大纲Agent是否使用流式的LLM请求")
+@click.option("--llm-port", default=16688)
+@click.option("--outline-port", default=20001)
+@click.option("--content-port", default=20011)
+@click.option("--main-api-port", default=16800)
+@click.option("--ttft", default=0.5, help="模拟LLM的首token延迟（秒）")
+@click.option("--tokens-per-sec", default=50.0, help="模拟LLM每秒生成的token数")
+@click.option("--error-rate", default=0.0, help="模拟LLM返回错误的概率")
+@click.option("--sections", default=3, help="模拟大纲的章节数")
+@click.option("--subsections", default=2, help="模拟大纲每个章节的小节数")
+@click.option("--warmup", default=1, help="正式压测前的预热请求数")
+@click.option("--log-dir", default="", help="服务日志目录，默认使用临时目录")
+@click.option("--output", default="", help="把结果写入JSON文件")
+@click.option("--baseline", default="", help="之前的结果JSON文件，对比是否有性能退化")
+@click.option("--tolerance", default=0.2, help="对比基线时允许的变化比例")
+def main(scenarios, requests, concurrency, language, repeat_prompts, timeout, start, base_url, mock, streaming,
+         llm_port, outline_port, content_port, main_api_port, ttft, tokens_per_sec, error_rate, sections, subsections,
+         warmup, log_dir, output, baseline, tolerance):
+    scenarios = list(scenarios) or list(SCENARIOS)
+    if mock:
+        scenarios = [name for name in scenarios if name != "pipeline"]
+    ports = {"llm": llm_port, "outline": outline_port, "content": content_port, "main_api": main_api_port}
+    base_url = (base_url or f"http://127.0.0.1:{main_api_port}").rstrip("/")
+    llm_args = ["--ttft", str(ttft), "--tokens-per-sec", str(tokens_per_sec), "--error-rate", str(error_rate),
+                "--sections", str(sections), "--subsections", str(subsections)]
+    report = asyncio.run(benchmark(scenarios, requests, concurrency, language, repeat_prompts, timeout, start,
+                                   base_url, ports, llm_args, mock, streaming, warmup, log_dir))
+    print_report(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到{output}")
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), tolerance)
+        if regressions:
+            print("\n发现性能退化：")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n与基线{baseline}相比没有超过{tolerance:.0%}的退化")
+
+
+if __name__ == "__main__":
+    main()
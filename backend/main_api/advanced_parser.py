@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/9/16 10:00
+# @File  : advanced_parser.py
+# @Author: 
+# @Contact : 
+# @Desc  : 高级Markdown解析器，支持从Markdown中提取详细内容说明
+
+import json
+import re
+from typing import Dict, List, Optional
+
+DEFAULT_COVER_TEXT = "A presentation generated by AI"
+
+
+class StreamingOutlineParser:
+    """
+    单遍、增量的Markdown大纲解析器，结果与parse_markdown_to_slides_advanced完全一致。
+    每一行只处理一次，章节/项目的@描述通过"正在查找描述的章节/项目"状态获得，不再向后扫描，解析耗时和大纲长度成正比。
+
+    流式用法：大纲边生成边feed，feed返回已经确定的幻灯片[{"index": 最终位置, "slide": 幻灯片}]：
+    1. 封面在找到描述（或遇到下一个标题）后返回
+    2. 过渡页在找到章节描述后返回，内容页在下一个##/###标题出现时返回；封面和第一个##章节出现之前无法确定页码，先缓存
+    3. 目录页和结束页依赖全部章节，在close时返回
+    章节标题重复时，过渡页的描述以最后一个有描述的同名章节为准（与一次性解析相同），
+    close会重新返回这些内容有变化的页，调用方按index覆盖即可。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # 连续的@行先缓存，遇到非@行时合并为一行
+        self._pending_descriptions: Optional[List[str]] = None
+        self._closed = False
+        # 封面
+        self._cover_title: Optional[str] = None
+        self._cover_description = ""
+        self._cover_open = False
+        # 目录和章节描述
+        self._sections: List[str] = []
+        self._section_descriptions: Dict[str, str] = {}
+        # 正在查找描述的章节
+        self._open_section: Optional[str] = None
+        # 正文（过渡页和内容页），过渡页的text在close时根据章节描述生成
+        self._body: List[dict] = []
+        # 还在查找描述的过渡页在_body中的位置
+        self._open_transition: Optional[int] = None
+        self._current_subsection_title = ""
+        self._current_items: List[str] = []
+        self._current_item_descriptions: Dict[str, str] = {}
+        # 正在查找描述的项目
+        self._open_item: Optional[str] = None
+        # 已经返回的幻灯片 index -> slide
+        self._emitted: Dict[int, dict] = {}
+        self._cover_emitted = False
+        # 下一个要返回的正文页在_body中的位置
+        self._next_body = 0
+        self.slides: List[dict] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        """输入一段文本（可以是不完整的行），返回新确定的幻灯片"""
+        if self._closed:
+            raise RuntimeError("parser is closed")
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            self._feed_line(line.strip())
+        return self._collect()
+
+    def close(self) -> List[dict]:
+        """大纲结束，返回剩余的幻灯片和内容有变化的幻灯片，完整结果在self.slides中"""
+        if self._closed:
+            return []
+        self._feed_line(self._buffer.strip())
+        self._buffer = ""
+        self._flush_descriptions()
+        self._closed = True
+        # 到达结尾，所有查找描述的状态结束
+        self._cover_open = False
+        self._open_section = None
+        self._open_transition = None
+        self._open_item = None
+        self._flush_subsection()
+
+        slides = []
+        if self._cover_title is not None:
+            slides.append(self._cover_slide())
+        if self._sections:
+            slides.append({"type": "contents", "data": {"items": list(self._sections)}})
+        slides.extend(self._body_slide(entry) for entry in self._body)
+        slides.append({"type": "end"})
+        self.slides = slides
+
+        changed = []
+        for index, slide in enumerate(slides):
+            if self._emitted.get(index) != slide:
+                changed.append({"index": index, "slide": slide})
+                self._emitted[index] = slide
+        return changed
+
+    def _feed_line(self, line: str) -> None:
+        if line.startswith('@'):
+            if self._pending_descriptions is None:
+                self._pending_descriptions = []
+            self._pending_descriptions.append(line[1:].strip())  # 去掉@符号
+            return
+        self._flush_descriptions()
+        self._process_line(line)
+
+    def _flush_descriptions(self) -> None:
+        if self._pending_descriptions is not None:
+            # 合并连续的@行
+            line = '@' + ' '.join(self._pending_descriptions)
+            self._pending_descriptions = None
+            self._process_line(line)
+
+    def _process_line(self, line: str) -> None:
+        is_heading = line.startswith('#')
+        description = line[1:].strip() if line.startswith('@') else None
+
+        # 封面描述：封面标题之后、下一个标题之前的第一个@行
+        if self._cover_open:
+            if is_heading:
+                self._cover_open = False
+            elif description is not None:
+                self._cover_description = description
+                self._cover_open = False
+        # 章节描述：##标题之后、下一个标题之前的第一个@行
+        if self._open_section is not None:
+            if is_heading:
+                self._open_section = None
+                self._open_transition = None
+            elif description is not None:
+                self._section_descriptions[self._open_section] = description
+                self._open_section = None
+                self._open_transition = None
+        # 项目描述：- 项目之后、下一个项目或标题之前的第一个@行
+        if self._open_item is not None:
+            if is_heading or line.startswith('-'):
+                self._open_item = None
+            elif description is not None:
+                self._current_item_descriptions[self._open_item] = description
+                self._open_item = None
+
+        if line.startswith('# '):
+            if self._cover_title is None:
+                self._cover_title = line[2:].strip()
+                self._cover_open = True
+        elif line.startswith('## '):
+            section_title = line[3:].strip()
+            self._flush_subsection()
+            self._sections.append(section_title)
+            self._open_section = section_title
+            self._current_subsection_title = ""
+            # 添加过渡页，使用章节描述（如果有的话）
+            self._body.append({"type": "transition", "title": section_title})
+            self._open_transition = len(self._body) - 1
+        elif line.startswith('### '):
+            self._flush_subsection()
+            self._current_subsection_title = line[4:].strip()
+        elif line.startswith('- '):
+            if self._current_subsection_title:
+                item_title = line[2:].strip()
+                self._current_items.append(item_title)
+                self._open_item = item_title
+
+    def _flush_subsection(self) -> None:
+        """处理上一个子章节，生成内容页"""
+        if self._current_subsection_title:
+            slide_items = []
+            for item in self._current_items:
+                slide_items.append({
+                    "title": item,
+                    "text": self._current_item_descriptions.get(item, f"Detailed content about {item}")
+                })
+            self._body.append({"type": "content", "slide": {"type": "content", "data": {"title": self._current_subsection_title, "items": slide_items}}})
+            self._current_items = []
+            self._current_item_descriptions = {}
+            self._open_item = None
+        self._current_subsection_title = ""
+
+    def _cover_slide(self) -> dict:
+        return {"type": "cover", "data": {"title": self._cover_title, "text": self._cover_description if self._cover_description else DEFAULT_COVER_TEXT}}
+
+    def _body_slide(self, entry: dict) -> dict:
+        if entry["type"] == "transition":
+            title = entry["title"]
+            transition_text = self._section_descriptions.get(title, f"Exploring the topic of {title}")
+            return {"type": "transition", "data": {"title": title, "text": transition_text}}
+        return entry["slide"]
+
+    def _collect(self) -> List[dict]:
+        """返回已经确定内容和位置的幻灯片"""
+        ready = []
+        if self._cover_title is not None and not self._cover_open and not self._cover_emitted:
+            self._cover_emitted = True
+            self._emitted[0] = self._cover_slide()
+            ready.append({"index": 0, "slide": self._emitted[0]})
+        # 封面和目录页出现之前无法确定正文的页码（###下的内容页可以出现在任何##之前）
+        if self._cover_title is None or not self._sections:
+            return ready
+        while self._next_body < len(self._body) and self._next_body != self._open_transition:
+            index = 2 + self._next_body
+            self._emitted[index] = self._body_slide(self._body[self._next_body])
+            ready.append({"index": index, "slide": self._emitted[index]})
+            self._next_body += 1
+        return ready
+
+
+def parse_markdown_to_slides_advanced(markdown_text):
+    """
+    高级解析Markdown文本为幻灯片结构，支持从Markdown中提取详细内容说明
+    约定：
+    1. # 标题下的 @ 开头文本为章节详细说明
+    2. - 列表项后的 @ 开头文本为项目详细说明
+    3. 根据标题层级不同，@文本对应不同的type
+    
+    :param markdown_text: Markdown文本
+    :return: 幻灯片结构列表
+    """
+    parser = StreamingOutlineParser()
+    parser.feed(markdown_text.strip())
+    parser.close()
+    return parser.slides
+
+if __name__ == '__main__':
+    # 测试示例
+    test_markdown = """# 2025科技前沿动态
+@探索2025年科技领域的最新突破与发展趋势
+
+## 人工智能新突破
+@人工智能在2025年取得了重大进展，从大语言模型到量子计算，多个领域都有重要突破
+
+### 大语言模型的进化
+@大语言模型在2025年实现了质的飞跃，不仅在性能上大幅提升，还在多模态处理和推理能力方面取得了重要进展
+
+- 多模态大模型实现文本、图像、音频的深度融合理解
+@这些模型能够同时处理和理解多种类型的数据，为更复杂的AI应用奠定了基础
+
+- 参数效率优化，降低训练成本的同时提升性能
+@通过创新的架构设计和训练方法，新一代模型在保持高性能的同时显著降低了计算资源需求
+
+- 自主推理和规划能力增强，接近人类思维方式
+@模型现在能够进行更复杂的逻辑推理和长期规划，为通用人工智能的发展迈出了重要一步"""
+    
+    slides = parse_markdown_to_slides_advanced(test_markdown)
+    print(json.dumps(slides, indent=2, ensure_ascii=False))
\ No newline at end of file
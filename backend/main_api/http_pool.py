@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 10:00
+# @File  : http_pool.py
+# @Author: 
+# @Desc  : 进程内共享的httpx连接池，outline/content两个A2A客户端共用，连接保持keep-alive，生命周期跟随FastAPI的lifespan
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 安装了h2时才开启HTTP/2，否则httpx会报错
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_TIMEOUT = float(os.environ.get("A2A_HTTP_TIMEOUT", "60"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("A2A_HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("A2A_HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("A2A_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+_shared_client: Optional[httpx.AsyncClient] = None
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取当前事件循环上的共享httpx客户端，没有则创建，只在FastAPI的lifespan中调用。
+    httpx的连接绑定在创建它的事件循环上，所以共享客户端只属于lifespan所在的事件循环。
+    """
+    global _shared_client, _shared_loop
+    loop = asyncio.get_running_loop()
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = _new_client()
+        _shared_loop = loop
+        logger.info(f"创建共享的httpx连接池, http2: {HTTP2_AVAILABLE}, 最大连接数: {HTTP_MAX_CONNECTIONS}")
+    elif _shared_loop is not loop:
+        raise RuntimeError("共享的httpx客户端属于其它事件循环")
+    return _shared_client
+
+
+@asynccontextmanager
+async def acquire_http_client() -> AsyncIterator[httpx.AsyncClient]:
+    """
+    获取一个可用的httpx客户端：在共享客户端所属的事件循环（lifespan的事件循环）中直接复用连接池；
+    共享客户端还没有创建或已经关闭，或者在其它事件循环中（例如线程里的asyncio.run）时使用临时客户端，用完关闭。
+    这里不创建共享客户端，否则它会绑定到其它事件循环上，之后主事件循环使用时会报错。
+    """
+    loop = asyncio.get_running_loop()
+    if _shared_client is not None and not _shared_client.is_closed and _shared_loop is loop:
+        yield _shared_client
+        return
+    async with _new_client() as client:
+        yield client
+
+
+async def close_http_client() -> None:
+    """关闭共享的httpx客户端，在FastAPI的lifespan结束时调用"""
+    global _shared_client, _shared_loop
+    if _shared_client is not None and not _shared_client.is_closed:
+        await _shared_client.aclose()
+        logger.info("共享的httpx连接池已关闭")
+    _shared_client = None
+    _shared_loop = None
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 17:00
+# @File  : log_utils.py
+# @Author:
+# @Desc  : 日志工具：按请求的request_id关联日志，支持文本/JSON格式；流式处理中每个chunk的日志按级别和采样率输出，关闭时几乎没有开销
+
+import json
+import logging
+import os
+import random
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+# 日志级别
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# 日志格式: text 或 json
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# 热路径（每个chunk、每个event）日志的采样率，0表示不输出，1表示全部输出
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+# 当前请求的request_id，在请求入口设置，A2A调用时通过metadata传给下游Agent
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(request_id)s] %(message)s"
+DATE_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id() -> str:
+    return request_id_var.get()
+
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """设置当前上下文的request_id，没有传入时生成一个新的"""
+    request_id = request_id or new_request_id()
+    request_id_var.set(request_id)
+    return request_id
+
+
+class RequestIdFilter(logging.Filter):
+    """给每条日志加上当前的request_id"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，方便日志系统检索"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+_configured = False
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, logfile: Optional[str] = None) -> None:
+    """配置根日志，只在服务启动时调用一次，重复调用无效"""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handlers = [logging.StreamHandler()]
+    if logfile:
+        handlers.append(logging.FileHandler(logfile, mode='w', encoding='utf-8'))
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
+        handler.addFilter(RequestIdFilter())
+        handler.setFormatter(formatter)
+    logging.basicConfig(level=level, handlers=handlers, force=True)
+
+
+class HotPathLogger:
+    """
+    热路径日志：先判断级别，再按采样率决定是否输出，参数使用%格式延迟格式化，
+    没有开启对应级别时只有一次isEnabledFor判断的开销
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rate: float = LOG_SAMPLE_RATE):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def _sampled(self) -> bool:
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def debug(self, msg: str, *args) -> None:
+        if self.logger.isEnabledFor(logging.DEBUG) and self._sampled():
+            self.logger.debug(msg, *args, stacklevel=2)
+
+    def info(self, msg: str, *args) -> None:
+        if self.logger.isEnabledFor(logging.INFO) and self._sampled():
+            self.logger.info(msg, *args, stacklevel=2)
+
+
+def get_hot_logger(name: str) -> HotPathLogger:
+    return HotPathLogger(logging.getLogger(name))
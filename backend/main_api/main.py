@@ -1,14 +1,17 @@
+import asyncio
 import json
+import logging
 import os
+import time
 import re
 import sys
 import uuid
+from contextlib import asynccontextmanager
 
 import dotenv
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from pydantic import BaseModel
 
 # 添加当前目录到Python路径
@@ -26,7 +29,16 @@ except ImportError:
     from outline_client import A2AOutlineClientWrapper
 
 # 从新的工具文件中导入stream_agent_response
-from stream_utils import stream_agent_response
+from stream_utils import stream_agent_response, stream_pipeline_response
+from slide_framing import frame_slides
+from http_pool import get_http_client, close_http_client
+from log_utils import setup_logging, set_request_id
+from metrics import REQUEST_DURATION, instrument_stream, metrics_endpoint
+from trace_utils import setup_tracing
+from template_assets import template_store
+from material_store import MaterialTooLarge, UploadSizeLimitMiddleware, get_material_store
+from material_index import get_index
+from material_ingest import material_ingestor
 
 # 导入aippt_rest路由器
 try:
@@ -39,7 +51,27 @@ except ImportError:
 
 OUTLINE_API = os.environ["OUTLINE_API"]
 CONTENT_API = os.environ["CONTENT_API"]
-app = FastAPI()
+
+setup_logging()
+# 链路追踪，通过环境变量TRACE_EXPORTER开启，见trace_utils.py
+setup_tracing("main_api")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时创建共享的httpx连接池，所有到大纲/内容Agent的请求复用这些连接
+    get_http_client()
+    # 加载并压缩模板文件，之后/data/{filename}直接从内存返回
+    await asyncio.to_thread(template_store.load_all)
+    yield
+    await material_ingestor.shutdown()
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
+
+# 上传的文件超过大小上限时在读取请求体之前（或读取过程中）返回413，放在CORS里面，413的响应也带CORS头
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/api/upload_material"])
 
 # Allow CORS for the frontend development server
 app.add_middleware(
@@ -50,17 +82,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # 每个请求一个request_id，优先使用客户端传入的X-Request-ID，大纲/内容Agent的日志使用相同的id
+    request_id = set_request_id(request.headers.get("X-Request-ID"))
+    start = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # 只用路由模板作为标签，避免/data/{filename}这类路径产生过多的时间序列
+        route = request.scope.get("route")
+        REQUEST_DURATION.labels(route.path if route else "unmatched", request.method, str(status)).observe(time.monotonic() - start)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# Prometheus指标
+app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
 # 挂载aippt_rest路由
-app.include_router(aippt_rest_router, prefix="/tools", tags=["aippt_rest"])
+app.include_router(aippt_rest_router, tags=["aippt_rest"])
 
 class AipptRequest(BaseModel):
     content: str
     language: str
     model: str
     stream: bool
+    # 用户id，Agent会检索这个用户上传的资料
+    user_id: str = ""
 
 class AipptContentRequest(BaseModel):
     content: str
+    user_id: str = ""
 
 class MaterialItem(BaseModel):
     id: str
@@ -75,9 +129,15 @@ class SectionItem(BaseModel):
 @app.post("/tools/aippt_outline")
 async def aippt_outline(request: AipptRequest):
     assert request.stream, "只支持流式的返回大纲"
-    return StreamingResponse(stream_agent_response(request.content), media_type="text/plain")
+    return StreamingResponse(instrument_stream("aippt_outline", stream_agent_response(request.content, request.language, request.model, request.user_id)), media_type="text/plain")
+
+@app.post("/tools/aippt_pipeline")
+async def aippt_pipeline(request: AipptRequest):
+    """大纲生成和内容生成重叠进行，每确定一页大纲就开始生成这一页的内容"""
+    assert request.stream, "只支持流式的返回"
+    return StreamingResponse(instrument_stream("aippt_pipeline", frame_slides(stream_pipeline_response(request.content, request.language, request.model, request.user_id))), media_type="application/x-ndjson")
 
-async def stream_content_response(markdown_content: str):
+async def stream_content_response(markdown_content: str, user_id: str = ""):
     """  # PPT的正文内容生成"""
     try:
         # 用正则找到第一个一级标题及之后的内容
@@ -87,13 +147,12 @@ async def stream_content_response(markdown_content: str):
             result = markdown_content[match.start():]
         else:
             result = markdown_content
-        print(f"用户输入的markdown大纲是：{result}")
+        logger.debug("用户输入的markdown大纲是：%s", result)
 
-        
         content_wrapper = A2AContentClientWrapper(session_id=uuid.uuid4().hex, agent_url=CONTENT_API)
         has_data = False
         
-        async for chunk_data in content_wrapper.generate(result ):
+        async for chunk_data in content_wrapper.generate(result, user_id=user_id):
             # 检查chunk_data是否为空或无效
             if not chunk_data or not isinstance(chunk_data, dict):
                 continue
@@ -117,7 +176,7 @@ async def stream_content_response(markdown_content: str):
     except Exception as e:
         # 全局异常处理 - 确保任何异常都有返回
         error_msg = f"内容生成失败: {str(e)}"
-        print(f"stream_content_response异常: {error_msg}")
+        logger.error(f"stream_content_response异常: {error_msg}")
         yield json.dumps({
             "status": "error", 
             "message": error_msg,
@@ -128,42 +187,66 @@ async def stream_content_response(markdown_content: str):
 async def aippt_content(request: AipptContentRequest):
 
     markdown_content = request.content
-    return StreamingResponse(stream_content_response(markdown_content), media_type="text/plain")
+    return StreamingResponse(instrument_stream("aippt", stream_content_response(markdown_content, request.user_id)), media_type="text/plain")
+
+@app.post("/tools/aippt_ndjson")
+async def aippt_content_ndjson(request: AipptContentRequest):
+    """与/tools/aippt相同，但每页幻灯片输出为一行完整的NDJSON，带页码和耗时"""
+    return StreamingResponse(instrument_stream("aippt_ndjson", frame_slides(stream_content_response(request.content, request.user_id))), media_type="application/x-ndjson")
 
 @app.post("/api/upload_material")
 async def upload_material(
     file: UploadFile = File(...),
-    description: str = Form("")
+    description: str = Form(""),
+    user_id: str = Form("")
 ):
-    """上传素材文件"""
-    # 创建上传目录
-    upload_dir = "./uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # 生成唯一文件名
-    file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{file_id}{file_extension}"
-    file_path = os.path.join(upload_dir, unique_filename)
-    
-    # 保存文件
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    # 返回文件信息
-    return JSONResponse({
-        "id": file_id,
-        "name": file.filename,
-        "path": file_path,
-        "description": description,
-        "size": len(content)
-    })
+    """
+    上传素材文件，分块写入并按内容哈希去重，见material_store.py；之后在后台建立这个用户的检索索引。
+    请求体的大小在UploadSizeLimitMiddleware中已经检查过，超大的文件不会完整上传
+    """
+    store = get_material_store()
+    try:
+        # 文件读写和哈希计算在线程中进行，不阻塞事件循环
+        material = await asyncio.to_thread(store.save, file.file, file.filename, description, file.content_type or "")
+    except MaterialTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    finally:
+        await file.close()
+    if user_id:
+        material_ingestor.submit(material, user_id)
+    else:
+        # 没有user_id时不建立索引，所有人共用一个索引会把一个用户的资料用到别人的PPT里
+        logger.info(f"上传{material.name}时没有传user_id，不建立检索索引")
+    return JSONResponse(material.to_dict())
+
+@app.get("/api/material_index")
+async def get_material_index(user_id: str = ""):
+    """用户已经建立索引的资料"""
+    index = await asyncio.to_thread(get_index, user_id, False)
+    documents = await asyncio.to_thread(index.documents) if index else []
+    return {"user_id": user_id, "documents": documents}
+
+@app.get("/api/material_stats")
+async def get_material_stats():
+    # 素材数量、实际保存的文件数量和去重节省的空间
+    return get_material_store().stats()
+
+@app.get("/api/materials/{material_id}")
+async def get_material(material_id: str):
+    """根据素材id下载素材文件"""
+    material = get_material_store().get(material_id)
+    if material is None or not os.path.exists(material.path):
+        return JSONResponse(status_code=404, content={"error": f"素材{material_id}不存在"})
+    return FileResponse(material.path, media_type=material.content_type, filename=material.name)
 
 @app.get("/data/{filename}")
-async def get_data(filename: str):
-    file_path = os.path.join("./template", filename)
-    return FileResponse(file_path)
+async def get_data(filename: str, request: Request):
+    return await template_store.response(request, filename)
+
+@app.get("/templates/stats")
+async def get_template_stats():
+    # 每个模板文件的大小、压缩后大小和请求次数
+    return {"templates": template_store.stats()}
 
 if __name__ == "__main__":
     import uvicorn
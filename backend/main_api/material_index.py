@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 09:00
+# @File  : material_index.py
+# @Author:
+# @Desc  : 用户上传资料的本地检索：抽取文本、切块，按用户建立增量的BM25倒排索引（SQLite），
+#          main_api负责写入，大纲Agent和PPT内容Agent只读检索，不需要网络请求
+
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 索引目录，main_api和两个Agent需要使用同一个目录
+MATERIAL_INDEX_DIR = os.environ.get(
+    "MATERIAL_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "aippt", "material_index"))
+# 每块的最大字数和相邻块重叠的字数
+MATERIAL_CHUNK_CHARS = int(os.environ.get("MATERIAL_CHUNK_CHARS", "500"))
+MATERIAL_CHUNK_OVERLAP = int(os.environ.get("MATERIAL_CHUNK_OVERLAP", "50"))
+# 每次检索返回的块数
+MATERIAL_SEARCH_TOP_K = int(os.environ.get("MATERIAL_SEARCH_TOP_K", "3"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 英文和数字按单词切分，中文按相邻两个字切分（不依赖分词库）
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+_XML_TEXT_RE = re.compile(r"<(?:w|a):t(?:\s[^>]*)?>([^<]*)</(?:w|a):t>")
+_XML_PARAGRAPH_RE = re.compile(r"</(?:w|a):p>")
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown", ".csv", ".json", ".log")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if word[0].isascii():
+            tokens.append(word)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _read_text_file(path: str) -> str:
+    with open(path, "rb") as f:
+        data = f.read()
+    for encoding in ("utf-8", "gb18030"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="ignore")
+
+
+def _read_office_xml(path: str, prefix: str) -> str:
+    """docx/pptx是zip包，正文在word/document.xml和ppt/slides/slide*.xml的<w:t>/<a:t>中"""
+    texts = []
+    with zipfile.ZipFile(path) as archive:
+        names = sorted((n for n in archive.namelist() if n.startswith(prefix) and n.endswith(".xml")),
+                       key=lambda n: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", n)])
+        for name in names:
+            xml = archive.read(name).decode("utf-8", errors="ignore")
+            # 每个段落一行，方便按段落切块
+            for paragraph in _XML_PARAGRAPH_RE.split(xml):
+                text = "".join(_XML_TEXT_RE.findall(paragraph))
+                if text:
+                    texts.append(text)
+    return "\n".join(texts)
+
+
+def extract_text(path: str, name: str, content_type: str = "") -> str:
+    """从上传的文件中抽取文本，不支持的格式（例如图片）返回空字符串"""
+    extension = os.path.splitext(name)[1].lower()
+    try:
+        if extension in TEXT_EXTENSIONS or content_type.startswith("text/plain"):
+            return _read_text_file(path)
+        if extension in (".html", ".htm") or content_type.startswith("text/html"):
+            from bs4 import BeautifulSoup
+            return BeautifulSoup(_read_text_file(path), "html.parser").get_text("\n")
+        if extension == ".docx":
+            return _read_office_xml(path, "word/document")
+        if extension == ".pptx":
+            return _read_office_xml(path, "ppt/slides/slide")
+        if extension == ".pdf":
+            try:
+                from pypdf import PdfReader
+            except ImportError:
+                logger.warning(f"没有安装pypdf，无法抽取{name}的文本")
+                return ""
+            return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    except Exception as e:
+        logger.warning(f"抽取{name}的文本失败: {e}")
+    return ""
+
+
+def chunk_text(text: str, size: int = MATERIAL_CHUNK_CHARS, overlap: int = MATERIAL_CHUNK_OVERLAP) -> List[str]:
+    """按段落把文本合并成不超过size字的块，超长的段落按窗口切分"""
+    chunks = []
+    current = ""
+    for paragraph in (p.strip() for p in text.splitlines()):
+        if not paragraph:
+            continue
+        if len(current) + len(paragraph) + 1 <= size:
+            current = f"{current}\n{paragraph}" if current else paragraph
+            continue
+        if current:
+            chunks.append(current)
+        step = max(1, size - overlap)
+        while len(paragraph) > size:
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[step:]
+        current = paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def prepare_document(path: str, name: str, content_type: str = "", description: str = "") -> List[Tuple[str, Dict[str, int]]]:
+    """
+    抽取、切块并统计词频，返回[(块的文本, {词: 词频})]；CPU密集，在进程池中执行。
+    资料的描述单独作为一块，图片等没有文本的资料也能通过描述检索到
+    """
+    texts = chunk_text(extract_text(path, name, content_type))
+    if description.strip():
+        texts.insert(0, f"{name}: {description.strip()}")
+    return [(text, dict(Counter(tokenize(text)))) for text in texts]
+
+
+def index_path(user_id: str, index_dir: str = MATERIAL_INDEX_DIR) -> str:
+    # user_id可能包含任意字符，用哈希作为文件名
+    return os.path.join(index_dir, hashlib.sha256(user_id.encode()).hexdigest()[:32] + ".sqlite3")
+
+
+class MaterialIndex:
+    """
+    一个用户的BM25倒排索引，保存在SQLite中：
+    1. 每份资料写入时在一个事务中追加块和倒排表，并更新总块数和总长度，已有的数据不需要重建
+    2. 检索时只读取查询词的倒排表，计算BM25分数后取前top_k块
+    3. 同一个用户重复上传相同内容的资料只索引一次
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                material_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                name TEXT NOT NULL,
+                chunks INTEGER NOT NULL,
+                indexed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_sha256 ON documents (sha256);
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                material_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                text TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stats (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def contains(self, sha256: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM documents WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone() is not None
+
+    def add_document(self, material_id: str, sha256: str, name: str, chunks: List[Tuple[str, Dict[str, int]]]) -> bool:
+        """写入一份资料，相同内容的资料已经存在时返回False"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 在写事务中再检查一次，同时入库的相同资料只写入一份
+            if conn.execute("SELECT 1 FROM documents WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+                conn.execute("ROLLBACK")
+                return False
+            total_length = 0
+            for text, term_freqs in chunks:
+                length = sum(term_freqs.values())
+                total_length += length
+                chunk_id = conn.execute(
+                    "INSERT INTO chunks (material_id, name, text, length) VALUES (?, ?, ?, ?)",
+                    (material_id, name, text, length),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    ((term, chunk_id, tf) for term, tf in term_freqs.items()),
+                )
+            conn.executemany(
+                "INSERT INTO stats (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (("chunks", len(chunks)), ("length", total_length)),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (material_id, sha256, name, chunks, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (material_id, sha256, name, len(chunks), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def search(self, query: str, top_k: int = MATERIAL_SEARCH_TOP_K) -> List[dict]:
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT key, value FROM stats").fetchall())
+        total_chunks = stats.get("chunks", 0)
+        if not total_chunks:
+            return []
+        avg_length = stats.get("length", 0) / total_chunks or 1.0
+        placeholders = ",".join("?" * len(terms))
+        rows = conn.execute(
+            f"SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.chunk_id = p.chunk_id "
+            f"WHERE p.term IN ({placeholders})",
+            terms,
+        ).fetchall()
+        doc_freqs = Counter(term for term, _, _, _ in rows)
+        scores: Dict[int, float] = {}
+        for term, chunk_id, tf, length in rows:
+            df = doc_freqs[term]
+            idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        if not best:
+            return []
+        texts = dict((row[0], row[1:]) for row in conn.execute(
+            f"SELECT chunk_id, material_id, name, text FROM chunks WHERE chunk_id IN ({','.join('?' * len(best))})",
+            [chunk_id for chunk_id, _ in best],
+        ))
+        return [{"material_id": texts[chunk_id][0], "name": texts[chunk_id][1], "text": texts[chunk_id][2],
+                 "score": round(score, 4)} for chunk_id, score in best]
+
+    def documents(self) -> List[dict]:
+        """已经索引的资料，只返回文件名和块数；不返回素材id，user_id不是鉴权，素材id可以用来下载文件"""
+        rows = self._connect().execute("SELECT name, chunks, indexed_at FROM documents ORDER BY indexed_at").fetchall()
+        return [dict(zip(("name", "chunks", "indexed_at"), row)) for row in rows]
+
+
+_indexes: Dict[str, MaterialIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(user_id: str, create: bool = True) -> Optional[MaterialIndex]:
+    """获取用户的索引，create为False且用户没有上传过资料时返回None；没有user_id时返回None，
+    不同用户的资料不能放在同一个索引中，否则会被用到别人的PPT里"""
+    if not user_id:
+        return None
+    path = index_path(user_id)
+    index = _indexes.get(path)
+    if index is None:
+        if not create and not os.path.exists(path):
+            return None
+        with _indexes_lock:
+            index = _indexes.get(path)
+            if index is None:
+                index = _indexes[path] = MaterialIndex(path)
+    return index
+
+
+def has_materials(user_id: str) -> bool:
+    """用户是否上传过资料，只检查索引文件是否存在"""
+    if not user_id:
+        return False
+    return index_path(user_id) in _indexes or os.path.exists(index_path(user_id))
+
+
+def search_materials(user_id: str, query: str, top_k: int = MATERIAL_SEARCH_TOP_K) -> List[dict]:
+    """检索用户上传的资料，用户没有资料时返回空列表"""
+    index = get_index(user_id, create=False)
+    if index is None:
+        return []
+    start = time.monotonic()
+    results = index.search(query, top_k)
+    logger.debug("检索用户资料%s: %s，返回%s条，耗时%.1fms", user_id, query, len(results), (time.monotonic() - start) * 1000)
+    return results
+
+
+def format_references(results: List[dict]) -> str:
+    """把检索结果整理成放进prompt的参考资料"""
+    return "\n\n".join(f"[{i}] 《{r['name']}》\n{r['text']}" for i, r in enumerate(results, 1))
+
+
+def slide_query(slide_schema: dict) -> str:
+    """用一页幻灯片大纲中的标题和要点作为检索词"""
+    texts = []
+
+    def collect(value):
+        if isinstance(value, str):
+            texts.append(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                # text是解析器生成的默认描述，不作为检索词
+                if key != "text":
+                    collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+
+    collect(slide_schema.get("data"))
+    return " ".join(texts) if texts else json.dumps(slide_schema, ensure_ascii=False)
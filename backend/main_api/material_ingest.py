@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 09:00
+# @File  : material_ingest.py
+# @Author:
+# @Desc  : 上传资料的后台入库：在进程池中抽取文本、切块和分词，然后写入用户的BM25索引（见material_index.py）
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Set
+
+from material_index import get_index, prepare_document
+from material_store import Material
+
+logger = logging.getLogger(__name__)
+
+# 抽取文本的进程数，0表示不建立索引
+MATERIAL_INGEST_WORKERS = int(os.environ.get("MATERIAL_INGEST_WORKERS", "2"))
+
+
+class MaterialIngestor:
+    """
+    上传接口返回后在后台入库，不增加上传的耗时：
+    1. 文本抽取和分词是CPU密集的，在进程池中执行，不占用事件循环和GIL
+    2. 写索引在线程中执行，SQLite的事务保证同一个用户的并发写入互不影响
+    3. 同一个用户已经索引过相同内容的资料时跳过（同时上传的相同资料由写索引的事务去重）
+    """
+
+    def __init__(self, workers: int = MATERIAL_INGEST_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn启动的子进程不继承事件循环和连接池等状态
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, material: Material, user_id: str) -> None:
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.ingest(material, user_id))
+        # 保存task的引用，避免还没执行完就被垃圾回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def ingest(self, material: Material, user_id: str) -> int:
+        """入库一份资料，返回索引的块数"""
+        start = time.monotonic()
+        try:
+            index = await asyncio.to_thread(get_index, user_id)
+            if await asyncio.to_thread(index.contains, material.sha256):
+                logger.info(f"用户{user_id}已经索引过与{material.name}内容相同的资料，跳过")
+                return 0
+            loop = asyncio.get_running_loop()
+            chunks = await loop.run_in_executor(self._get_executor(), prepare_document, material.path, material.name,
+                                                material.content_type, material.description)
+            if not await asyncio.to_thread(index.add_document, material.id, material.sha256, material.name, chunks):
+                logger.info(f"用户{user_id}已经索引过与{material.name}内容相同的资料，跳过")
+                return 0
+        except Exception as e:
+            logger.error(f"资料{material.name}入库失败: {e}", exc_info=True)
+            return 0
+        logger.info(f"资料{material.name}已入库，用户: {user_id}，{len(chunks)}块，耗时{time.monotonic() - start:.2f}秒")
+        return len(chunks)
+
+    async def shutdown(self) -> None:
+        """等待正在入库的资料完成，然后关闭进程池"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+material_ingestor = MaterialIngestor()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 23:00
+# @File  : material_store.py
+# @Author:
+# @Desc  : 素材存储：上传的文件分块写入并同时计算sha256，按内容哈希保存，相同内容只保存一份；SQLite索引记录素材id到哈希的映射
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 上传目录，默认是本文件旁边的uploads目录
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+# 单个文件的大小上限（字节），默认100MB，超过时返回413
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+# 每次读取和写入的块大小
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# 上传请求中文件之外的部分（multipart的边界、表单字段）允许的大小
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class MaterialTooLarge(Exception):
+    """上传的文件超过UPLOAD_MAX_BYTES"""
+
+
+@dataclass
+class Material:
+    id: str
+    name: str
+    path: str
+    description: str
+    size: int
+    sha256: str
+    content_type: str
+    # 相同内容的文件已经存在，这次上传没有写入新的文件
+    deduplicated: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class MaterialStore:
+    """
+    按内容寻址的素材存储：
+    1. 文件保存在blobs/<哈希前两位>/<sha256>，相同内容的文件（即使文件名不同）只保存一份
+    2. 上传时分块读取，边写临时文件边计算哈希，内存占用与文件大小无关；超过大小上限时立即停止并删除临时文件
+    3. materials表记录素材id -> 哈希、文件名和描述，同一个文件被多次上传时每次都有自己的素材id
+    """
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.blob_dir = os.path.join(upload_dir, "blobs")
+        self.tmp_dir = os.path.join(upload_dir, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.db_path = os.path.join(upload_dir, "materials.sqlite3")
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS materials (
+                    id TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_materials_sha256 ON materials (sha256)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def save(self, source: BinaryIO, filename: str, description: str = "", content_type: str = "") -> Material:
+        """
+        从文件对象分块读取并保存，返回素材信息；同步执行，在事件循环中调用时放到线程中。
+        超过大小上限时抛出MaterialTooLarge。
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MaterialTooLarge(f"文件{filename}超过大小上限{self.max_bytes}字节")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.blob_path(sha256)
+            deduplicated = os.path.exists(path)
+            if not deduplicated:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # 临时目录和blobs在同一个文件系统上，rename是原子的，并发上传相同的文件时结果一样
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        material = Material(
+            id=str(uuid.uuid4()),
+            name=filename,
+            path=path,
+            description=description,
+            size=size,
+            sha256=sha256,
+            content_type=content_type or "application/octet-stream",
+            deduplicated=deduplicated,
+        )
+        self._connect().execute(
+            "INSERT INTO materials (id, sha256, name, description, size, content_type, path, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (material.id, sha256, filename, description, size, material.content_type, path, time.time()),
+        )
+        if deduplicated:
+            logger.info(f"素材{filename}与已有文件内容相同，复用{path}")
+        return material
+
+    def get(self, material_id: str) -> Optional[Material]:
+        row = self._connect().execute(
+            "SELECT id, name, path, description, size, sha256, content_type FROM materials WHERE id = ?",
+            (material_id,),
+        ).fetchone()
+        return Material(*row) if row else None
+
+    def stats(self) -> dict:
+        """素材数量、实际保存的文件数量，以及去重节省的空间"""
+        materials, total_bytes = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM materials").fetchone()
+        blobs, stored_bytes = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT path, size FROM materials)").fetchone()
+        return {
+            "materials": materials,
+            "blobs": blobs,
+            "total_bytes": total_bytes,
+            "stored_bytes": stored_bytes,
+            "saved_bytes": total_bytes - stored_bytes,
+        }
+
+
+_store: Optional[MaterialStore] = None
+
+
+def get_material_store() -> MaterialStore:
+    """第一次使用时创建，避免导入main时就创建上传目录"""
+    global _store
+    if _store is None:
+        _store = MaterialStore()
+    return _store
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI中间件：上传接口的请求体超过上限时直接返回413，不等整个文件上传完。
+    FastAPI在调用接口函数之前就已经把整个请求体读完并写入临时文件，只在MaterialStore.save中检查大小时，
+    超大的文件仍然会占满带宽和临时磁盘。
+    1. Content-Length超过上限时不读取请求体，直接返回413，uvicorn随后关闭连接
+    2. 没有Content-Length（分块传输）时边接收边计数，超过上限时立即返回413，之后接口的输出被丢弃
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+        # 请求体除了文件还有multipart的边界和表单字段
+        self.max_body_bytes = max_bytes + UPLOAD_FORM_OVERHEAD
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"error": f"上传的文件超过大小上限{self.max_bytes}字节"},
+                          ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await self._reject(send)
+            return
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # 后面的请求体不再读取，接口读取请求体时得到断开连接
+                    rejected = True
+                    await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # 已经返回413，丢弃接口（解析请求体失败后）的输出
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
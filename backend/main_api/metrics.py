@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 18:00
+# @File  : metrics.py
+# @Author:
+# @Desc  : Prometheus指标：请求/流式耗时、chunk数、每页和每个provider的LLM耗时、token数、缓存命中、任务队列、进行中的会话、会话服务和A2A任务存储的淘汰，通过/metrics接口暴露
+
+import time
+import logging
+from typing import AsyncIterator, Callable, List, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的分桶，LLM生成一页可能需要几十秒
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _get_or_create(metric_cls, name: str, documentation: str, labelnames=(), **kwargs):
+    """
+    同一个进程中这个模块可能以不同的模块名被导入多次（例如main_api中通过slide_agent包又导入了一次），
+    已经注册过的指标直接复用，避免重复注册报错
+    """
+    collector = REGISTRY._names_to_collectors.get(name)
+    if collector is None:
+        collector = metric_cls(name, documentation, labelnames, **kwargs)
+    return collector
+
+
+REQUEST_DURATION = _get_or_create(
+    Histogram, "aippt_http_request_duration_seconds", "HTTP请求耗时，流式接口只统计到返回响应头",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS)
+STREAM_FIRST_CHUNK = _get_or_create(
+    Histogram, "aippt_stream_first_chunk_seconds", "流式接口从开始到返回第一个chunk的耗时",
+    ["endpoint"], buckets=LATENCY_BUCKETS)
+STREAM_DURATION = _get_or_create(
+    Histogram, "aippt_stream_duration_seconds", "流式接口从开始到结束的耗时",
+    ["endpoint", "status"], buckets=LATENCY_BUCKETS)
+STREAM_CHUNKS = _get_or_create(
+    Counter, "aippt_stream_chunks_total", "流式接口返回的chunk数", ["endpoint"])
+LLM_LATENCY = _get_or_create(
+    Histogram, "aippt_llm_latency_seconds", "一次LLM调用的耗时",
+    ["agent", "provider", "model"], buckets=LATENCY_BUCKETS)
+SLIDE_LATENCY = _get_or_create(
+    Histogram, "aippt_slide_generation_seconds", "生成一页幻灯片的耗时（包含缓存命中）",
+    ["slide_type"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = _get_or_create(
+    Counter, "aippt_llm_tokens_total", "LLM调用消耗的token数，kind为prompt或completion",
+    ["agent", "provider", "kind"])
+CACHE_REQUESTS = _get_or_create(
+    Counter, "aippt_cache_requests_total", "缓存的读取次数，result为hit或miss", ["cache", "result"])
+TASK_QUEUE = _get_or_create(
+    Gauge, "aippt_task_queue_tasks", "后台PPT生成任务的数量，state为queued或running", ["state"])
+INFLIGHT_SESSIONS = _get_or_create(
+    Gauge, "aippt_inflight_sessions", "正在执行的Agent会话数", ["agent"])
+SESSIONS = _get_or_create(
+    Gauge, "aippt_sessions", "会话服务中保留在内存中的会话数")
+SESSION_BYTES = _get_or_create(
+    Gauge, "aippt_session_bytes", "内存中会话的估算大小（JSON序列化后的字节数）")
+SESSION_EVICTIONS = _get_or_create(
+    Counter, "aippt_session_evictions_total", "从内存中淘汰的会话数，reason为ttl、count或memory", ["reason"])
+A2A_TASKS = _get_or_create(
+    Gauge, "aippt_a2a_tasks", "A2A任务存储中的任务数，state为active或finished", ["state"])
+A2A_TASK_BYTES = _get_or_create(
+    Gauge, "aippt_a2a_task_bytes", "内存中结束的A2A任务的估算大小（JSON序列化后的字节数）")
+A2A_TASK_EVICTIONS = _get_or_create(
+    Counter, "aippt_a2a_task_evictions_total", "从内存中淘汰的A2A任务数，reason为retention、memory或stale", ["reason"])
+
+# 导出指标前执行的刷新函数，例如从任务管理器读取队列长度
+_refreshers: List[Callable[[], None]] = []
+
+
+def register_refresher(refresher: Callable[[], None]) -> None:
+    _refreshers.append(refresher)
+
+
+def observe_llm_call(agent: str, provider: str, model: str, seconds: float, usage_metadata=None) -> None:
+    """记录一次LLM调用的耗时和token数，usage_metadata为LlmResponse.usage_metadata"""
+    LLM_LATENCY.labels(agent, provider, model).observe(seconds)
+    if usage_metadata is None:
+        return
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", None)
+    completion_tokens = getattr(usage_metadata, "candidates_token_count", None)
+    if prompt_tokens:
+        LLM_TOKENS.labels(agent, provider, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(agent, provider, "completion").inc(completion_tokens)
+
+
+async def instrument_stream(endpoint: str, chunks: AsyncIterator) -> AsyncIterator:
+    """包装流式生成器，记录首个chunk的耗时、chunk数和总耗时"""
+    start = time.monotonic()
+    first = True
+    status = "ok"
+    try:
+        async for chunk in chunks:
+            if first:
+                STREAM_FIRST_CHUNK.labels(endpoint).observe(time.monotonic() - start)
+                first = False
+            STREAM_CHUNKS.labels(endpoint).inc()
+            yield chunk
+    except Exception:
+        status = "error"
+        raise
+    except BaseException:
+        # 客户端断开连接
+        status = "cancelled"
+        raise
+    finally:
+        STREAM_DURATION.labels(endpoint, status).observe(time.monotonic() - start)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    for refresher in _refreshers:
+        try:
+            refresher()
+        except Exception as e:
+            logger.warning(f"刷新指标失败: {e}")
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """/metrics接口，FastAPI和A2A的Starlette应用都可以直接挂载"""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 15:00
+# @File  : single_flight.py
+# @Author:
+# @Desc  : 流式请求合并：相同key的并发请求只请求一次上游，每个订阅者从头回放上游的chunk；可选地短时间缓存完整结果
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 完整结果的缓存时间（秒），0表示不缓存，只合并同时进行的请求
+OUTLINE_RESULT_CACHE_TTL = float(os.environ.get("OUTLINE_RESULT_CACHE_TTL", "0"))
+# 最多缓存的结果数量
+OUTLINE_RESULT_CACHE_MAX = int(os.environ.get("OUTLINE_RESULT_CACHE_MAX", "256"))
+
+# 上游生成器的类型：每次产出(文本, 是否是错误信息)
+ChunkProducer = Callable[[], AsyncIterator[Tuple[str, bool]]]
+
+
+def make_key(*parts) -> str:
+    """根据请求参数生成合并用的key"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+
+class _Flight:
+    """一次正在进行的上游请求"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.has_error = False
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        # 唤醒所有等待新chunk的订阅者，之后的等待使用新的Event
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlightStream:
+    """
+    流式请求的single-flight：
+    1. 第一个请求启动上游生成器，后续相同key的请求订阅同一个上游，先回放已经收到的chunk，再接收新的chunk
+    2. 所有订阅者都断开时，取消上游请求
+    3. 上游正常结束且没有错误时，按result_ttl缓存完整结果，之后的相同请求直接回放
+    """
+
+    def __init__(self, result_ttl: float = OUTLINE_RESULT_CACHE_TTL, max_results: int = OUTLINE_RESULT_CACHE_MAX):
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self._flights: Dict[str, _Flight] = {}
+        # key -> (完成时间, chunks)
+        self._results: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self.leaders = 0
+        self.followers = 0
+        self.cache_hits = 0
+
+    def _get_result(self, key: str) -> Optional[List[str]]:
+        item = self._results.get(key)
+        if item is None:
+            return None
+        finished_at, chunks = item
+        if time.monotonic() - finished_at > self.result_ttl:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return chunks
+
+    def _set_result(self, key: str, chunks: List[str]) -> None:
+        self._results[key] = (time.monotonic(), chunks)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    async def _run(self, key: str, flight: _Flight, producer: ChunkProducer) -> None:
+        completed = False
+        try:
+            async for text, is_error in producer():
+                flight.chunks.append(text)
+                flight.has_error = flight.has_error or is_error
+                flight.notify()
+            completed = True
+        except Exception as e:
+            logger.error(f"上游请求失败: {e}", exc_info=True)
+            flight.has_error = True
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if self.result_ttl > 0 and completed and not flight.has_error and flight.chunks:
+                self._set_result(key, flight.chunks)
+
+    async def stream(self, key: str, producer: ChunkProducer) -> AsyncIterator[str]:
+        """订阅key对应的上游流，producer只在没有相同key的请求进行时才会被调用"""
+        chunks = self._get_result(key) if self.result_ttl > 0 else None
+        if chunks is not None:
+            self.cache_hits += 1
+            for chunk in chunks:
+                yield chunk
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, producer))
+        else:
+            self.followers += 1
+            logger.info(f"合并相同的请求: {key[:12]}, 当前订阅者数量: {flight.subscribers + 1}")
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                changed = flight.changed
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    break
+                await changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 所有订阅者都断开了，没有必要继续请求上游
+                logger.info(f"所有订阅者都已断开，取消上游请求: {key[:12]}")
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._flights),
+            "cached_results": len(self._results),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cache_hits": self.cache_hits,
+        }
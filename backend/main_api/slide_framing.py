@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 16:00
+# @File  : slide_framing.py
+# @Author:
+# @Desc  : 把内容Agent流式返回的文本切分成一页一页完整的幻灯片JSON，每页输出一行NDJSON，客户端不用再拼接被拆开的JSON
+
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def ndjson_line(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class SlideFramer:
+    """
+    从流式文本中提取完整的JSON对象：
+    1. 跟踪花括号的层级，字符串内部（包括转义字符）的花括号不计数
+    2. 最外层对象闭合时，解析并返回这个对象；对象之外的文本（例如```json代码块标记、换行）被忽略
+    3. 只扫描新到达的字符，不会重复扫描已经处理过的文本
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # 解析失败的对象的原始文本
+        self.errors: List[str] = []
+
+    def feed(self, text: str) -> List[Any]:
+        """输入一段文本，返回其中闭合的JSON对象"""
+        objects = []
+        for char in text:
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                continue
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        objects.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        self.errors.append(raw)
+        return objects
+
+    def close(self) -> Optional[str]:
+        """流结束，返回没有闭合的对象的原始文本（没有则返回None）"""
+        pending = "".join(self._buffer) if self._depth > 0 else None
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        return pending
+
+
+def is_error_record(obj: Any) -> bool:
+    """stream_*_response在出错时返回{"status": "error", ...}"""
+    return isinstance(obj, dict) and obj.get("status") == "error" and "type" not in obj
+
+
+def is_slide_error(obj: Any) -> bool:
+    """内容Agent单页生成失败时这一页输出的错误记录，带slide_error，占用这一页的页码"""
+    return is_error_record(obj) and bool(obj.get("slide_error"))
+
+
+def is_replacement(obj: Any) -> bool:
+    """
+    流水线接口中已经返回的页的大纲变化后重新生成的结果{"replace_index": 页码, "slide": 幻灯片或单页错误记录}，
+    覆盖之前返回的这一页，不占用新的页码
+    """
+    return isinstance(obj, dict) and "replace_index" in obj and "slide" in obj and "type" not in obj
+
+
+def replacement_record(index: int, result: Any) -> Dict[str, Any]:
+    """流水线接口中替换第index页的记录，result是这一页新的幻灯片或单页错误记录"""
+    return {"replace_index": index, "slide": result}
+
+
+async def frame_slides(chunks: AsyncIterator[str], start_index: int = 0) -> AsyncIterator[str]:
+    """
+    把流式文本转换成NDJSON，每行一个记录：
+    {"type": "slide", "index": 页码, "slide": 幻灯片, "elapsed_ms": 距开始的毫秒数, "gap_ms": 距上一页的毫秒数}
+    {"type": "error", "index": 页码, "message": 错误信息, "code": 错误码, "elapsed_ms": ...}
+        单页生成失败时带"slide_error": true，这一页的页码被占用，后面的页码不变
+    {"type": "replace", "index": 页码, "slide": 幻灯片, "elapsed_ms": ...}
+        已经返回的页的大纲变化后重新生成的结果，客户端按页码覆盖这一页；重新生成失败时输出带"replace": true的单页错误
+    {"type": "done", "slides": 页数（包括失败的页）, "errors": 错误数, "elapsed_ms": ...}
+    """
+    framer = SlideFramer()
+    start = last = time.monotonic()
+    index = start_index
+    errors = 0
+    reported_errors = 0
+    async for chunk in chunks:
+        for obj in framer.feed(chunk):
+            now = time.monotonic()
+            if is_replacement(obj):
+                replaced = obj["slide"]
+                if is_slide_error(replaced):
+                    errors += 1
+                    yield ndjson_line({"type": "error", "index": obj["replace_index"], "message": replaced.get("message"),
+                                       "code": replaced.get("code"), "slide_error": True, "replace": True,
+                                       "elapsed_ms": int((now - start) * 1000)})
+                else:
+                    yield ndjson_line({"type": "replace", "index": obj["replace_index"], "slide": replaced,
+                                       "elapsed_ms": int((now - start) * 1000)})
+                continue
+            if is_slide_error(obj):
+                errors += 1
+                yield ndjson_line({"type": "error", "index": index, "message": obj.get("message"),
+                                   "code": obj.get("code"), "slide_error": True,
+                                   "elapsed_ms": int((now - start) * 1000)})
+                index += 1
+                last = now
+                continue
+            if is_error_record(obj):
+                errors += 1
+                yield ndjson_line({"type": "error", "index": index, "message": obj.get("message"),
+                                   "code": obj.get("code"), "elapsed_ms": int((now - start) * 1000)})
+                continue
+            yield ndjson_line({"type": "slide", "index": index, "slide": obj,
+                               "elapsed_ms": int((now - start) * 1000), "gap_ms": int((now - last) * 1000)})
+            index += 1
+            last = now
+        # 无法解析的JSON
+        while reported_errors < len(framer.errors):
+            errors += 1
+            yield ndjson_line({"type": "error", "index": index, "message": "幻灯片JSON解析失败",
+                               "code": "SLIDE_JSON_INVALID", "raw": framer.errors[reported_errors],
+                               "elapsed_ms": int((time.monotonic() - start) * 1000)})
+            reported_errors += 1
+    pending = framer.close()
+    if pending:
+        errors += 1
+        yield ndjson_line({"type": "error", "index": index, "message": "幻灯片JSON不完整",
+                           "code": "SLIDE_JSON_INCOMPLETE", "raw": pending,
+                           "elapsed_ms": int((time.monotonic() - start) * 1000)})
+    yield ndjson_line({"type": "done", "slides": index - start_index, "errors": errors,
+                       "elapsed_ms": int((time.monotonic() - start) * 1000)})
+
+
+async def collect_slides(chunks: AsyncIterator[str]) -> List[dict]:
+    """收集流式文本中的所有幻灯片对象，无法解析和生成失败的幻灯片被跳过；上游返回错误或没有任何幻灯片时抛出RuntimeError"""
+    framer = SlideFramer()
+    # 按页码保存，生成失败的页是None，替换记录按页码覆盖
+    pages: List[Optional[dict]] = []
+    async for chunk in chunks:
+        for obj in framer.feed(chunk):
+            if is_replacement(obj):
+                index, replaced = obj["replace_index"], obj["slide"]
+                if 0 <= index < len(pages):
+                    pages[index] = None if is_slide_error(replaced) else replaced
+                continue
+            if is_slide_error(obj):
+                logger.warning(f"跳过生成失败的幻灯片: {obj.get('message')}")
+                pages.append(None)
+                continue
+            if is_error_record(obj):
+                raise RuntimeError(obj.get("message") or "PPT内容生成失败")
+            pages.append(obj)
+    pending = framer.close()
+    for raw in framer.errors + ([pending] if pending else []):
+        logger.warning(f"跳过无法解析的幻灯片JSON: {raw[:200]}")
+    slides = [page for page in pages if page is not None]
+    if not slides:
+        raise RuntimeError("PPT内容生成失败，没有得到任何幻灯片")
+    return slides
@@ -1,40 +1,53 @@
+import asyncio
 import json
+import logging
 import os
 import re
 import uuid
+from typing import Dict
 import dotenv
+from opentelemetry import trace
+from advanced_parser import StreamingOutlineParser
+from slide_framing import SlideFramer, is_slide_error, replacement_record
 from outline_client import A2AOutlineClientWrapper
 from content_client import A2AContentClientWrapper
+from single_flight import SingleFlightStream, make_key
+from log_utils import get_request_id
+from trace_utils import tracer, use_context
 
 # 加载环境变量
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 获取环境变量
 OUTLINE_API = os.environ.get("OUTLINE_API", "http://localhost:10001")
 CONTENT_API = os.environ["CONTENT_API"]
 
+# 相同(prompt, language, model)的并发大纲请求共享一个上游请求
+outline_single_flight = SingleFlightStream()
+# 流水线接口中同时生成内容的页数
+PIPELINE_MAX_CONCURRENCY = int(os.environ.get("PIPELINE_MAX_CONCURRENCY", "5"))
 
 
-async def stream_agent_response(prompt: str):
-    """A generator that yields parts of the agent response."""
+async def _outline_chunks(prompt: str, language: str, user_id: str = ""):
+    """请求大纲Agent，产出(文本, 是否是错误信息)，错误的结果不会被缓存"""
     try:
         outline_wrapper = A2AOutlineClientWrapper(session_id=uuid.uuid4().hex, agent_url=OUTLINE_API)
         has_data = False
         
-        async for chunk_data in outline_wrapper.generate(prompt):
-            # print(f"生成大纲输出的chunk_data: {chunk_data}")
-            
+        async for chunk_data in outline_wrapper.generate(prompt, language=language, user_id=user_id):
             # 检查chunk_data是否为空或无效
             if not chunk_data or not isinstance(chunk_data, dict):
                 continue
                 
             if chunk_data.get("type") == "text" and chunk_data.get("text"):
                 has_data = True
-                yield chunk_data["text"]
+                yield chunk_data["text"], False
             elif chunk_data.get("type") == "error" and chunk_data.get("text"):
                 # 直接传递错误信息
                 has_data = True
-                yield chunk_data["text"]
+                yield chunk_data["text"], True
         
         # 如果整个流式传输过程中没有任何数据
         if not has_data:
@@ -42,20 +55,28 @@ async def stream_agent_response(prompt: str):
                 "status": "error", 
                 "message": "AI服务未返回有效数据，请检查服务状态",
                 "code": "NO_DATA_RECEIVED"
-            })
+            }), True
             
     except Exception as e:
         # 全局异常处理 - 确保任何异常都有返回
         error_msg = f"大纲生成失败: {str(e)}"
-        print(f"stream_agent_response异常: {error_msg}")
+        logger.error(f"stream_agent_response异常: {error_msg}")
         yield json.dumps({
             "status": "error", 
             "message": error_msg,
             "code": "OUTLINE_GENERATION_FAILED"
-        })
+        }), True
+
+
+async def stream_agent_response(prompt: str, language: str = "English", model: str = "", user_id: str = ""):
+    """A generator that yields parts of the agent response."""
+    # 不同用户上传的资料不同，大纲也可能不同
+    key = make_key("outline", prompt, language, model, user_id)
+    async for text in outline_single_flight.stream(key, lambda: _outline_chunks(prompt, language, user_id)):
+        yield text
 
 
-async def stream_content_response(markdown_content: str):
+async def stream_content_response(markdown_content: str, user_id: str = ""):
     """  # PPT的正文内容生成"""
     try:
         # 用正则找到第一个一级标题及之后的内容
@@ -65,12 +86,12 @@ async def stream_content_response(markdown_content: str):
             result = markdown_content[match.start():]
         else:
             result = markdown_content
-        print(f"用户输入的markdown大纲是：{result}")
+        logger.debug("用户输入的markdown大纲是：%s", result)
 
         content_wrapper = A2AContentClientWrapper(session_id=uuid.uuid4().hex, agent_url=CONTENT_API)
         has_data = False
 
-        async for chunk_data in content_wrapper.generate(result):
+        async for chunk_data in content_wrapper.generate(result, user_id=user_id):
             # 检查chunk_data是否为空或无效
             if not chunk_data or not isinstance(chunk_data, dict):
                 continue
@@ -94,9 +115,183 @@ async def stream_content_response(markdown_content: str):
     except Exception as e:
         # 全局异常处理 - 确保任何异常都有返回
         error_msg = f"内容生成失败: {str(e)}"
-        print(f"stream_content_response异常: {error_msg}")
+        logger.error(f"stream_content_response异常: {error_msg}")
         yield json.dumps({
             "status": "error",
             "message": error_msg,
             "code": "CONTENT_GENERATION_FAILED"
-        })
\ No newline at end of file
+        })
+
+def _slide_error(message: str) -> str:
+    """单页生成失败的错误记录，与内容Agent并发生成时单页失败的输出相同，占用这一页的页码"""
+    return json.dumps({
+        "status": "error",
+        "message": message,
+        "code": "SLIDE_GENERATION_FAILED",
+        "slide_error": True,
+    }, ensure_ascii=False)
+
+
+async def _generate_slide(slide: dict, language: str, semaphore: asyncio.Semaphore, user_id: str = "") -> str:
+    """调用内容Agent生成一页幻灯片，失败时返回这一页的错误记录（带slide_error）"""
+    slide_json = json.dumps(slide, ensure_ascii=False)
+    async with semaphore:
+        with tracer.start_as_current_span("pipeline.slide", attributes={"slide_type": slide.get("type", "")}):
+            try:
+                content_wrapper = A2AContentClientWrapper(session_id=uuid.uuid4().hex, agent_url=CONTENT_API)
+                texts = []
+                # 通过metadata直接传入这一页的大纲，内容Agent不再解析Markdown
+                async for chunk_data in content_wrapper.generate(slide_json, language=language, user_id=user_id, extra_metadata={"outline_json": [slide]}):
+                    if not chunk_data or not isinstance(chunk_data, dict):
+                        continue
+                    if chunk_data.get("type") == "text" and chunk_data.get("text"):
+                        texts.append(chunk_data["text"])
+                    elif chunk_data.get("type") == "error":
+                        raise RuntimeError(chunk_data.get("text"))
+                framer = SlideFramer()
+                objects = framer.feed("".join(texts))
+                if len(objects) == 1 and is_slide_error(objects[0]):
+                    # 内容Agent重试后仍然失败，原样转发它的错误记录
+                    return json.dumps(objects[0], ensure_ascii=False)
+                if len(objects) == 1 and isinstance(objects[0], dict) and "type" in objects[0]:
+                    # 每页只返回一个合法的JSON，保证页码和大纲一一对应
+                    return json.dumps(objects[0], ensure_ascii=False)
+                logger.warning(f"{slide.get('type')}类型的页内容生成没有返回合法的JSON")
+                return _slide_error(f"{slide.get('type')}类型的页内容生成没有返回合法的JSON")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"单页内容生成失败: {e}")
+                return _slide_error(f"单页内容生成失败: {e}")
+
+
+def _error_record(text: str):
+    """text是stream_agent_response产出的错误记录{"status": "error", ...}时返回这个记录，否则返回None"""
+    text = text.strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        record = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(record, dict) or record.get("status") != "error":
+        return None
+    return {
+        "status": "error",
+        "message": record.get("message") or "大纲生成失败",
+        "code": record.get("code") or "PIPELINE_OUTLINE_INVALID",
+    }
+
+
+async def stream_pipeline_response(prompt: str, language: str = "English", model: str = "", user_id: str = ""):
+    """
+    大纲和内容的流水线生成：大纲流式返回的同时增量解析，每确定一页就开始生成这一页的内容，
+    生成好的页按页码顺序返回，不用等整个大纲生成完再开始生成内容。
+    1. 第一页确定是封面、并且至少确定了一页正文（保证大纲多于两页）之前不返回任何页，不合法的大纲不会先返回几页再报错
+    2. 大纲返回错误记录时停止，转发这个错误
+    3. 已经返回的页因为同名章节内容变化时重新生成，返回替换记录（见slide_framing.replacement_record）
+    """
+    parser = StreamingOutlineParser()
+    semaphore = asyncio.Semaphore(max(1, PIPELINE_MAX_CONCURRENCY))
+    tasks: Dict[int, asyncio.Task] = {}
+    dispatched: Dict[int, dict] = {}
+    # 已经返回的页重新生成的task
+    replacements: Dict[int, asyncio.Task] = {}
+    # 下一个要返回的页码
+    next_index = 0
+    # 大纲是否已经确认合法，确认前不返回任何页
+    validated = False
+    pipeline_span = tracer.start_span("pipeline", attributes={"request_id": get_request_id()})
+    # 每页的生成task都挂在pipeline的span下面
+    pipeline_context = trace.set_span_in_context(pipeline_span)
+
+    def dispatch(ready_slides):
+        for item in ready_slides:
+            index, slide = item["index"], item["slide"]
+            if dispatched.get(index) == slide:
+                continue
+            dispatched[index] = slide
+            with use_context(pipeline_context):
+                task = asyncio.create_task(_generate_slide(slide, language, semaphore, user_id))
+            if index < next_index:
+                # 这一页已经返回过，同名章节导致内容变化了，重新生成后返回替换记录
+                if index in replacements:
+                    replacements[index].cancel()
+                replacements[index] = task
+                continue
+            if index in tasks:
+                # 同名章节导致这一页的内容变化了，重新生成
+                tasks[index].cancel()
+            tasks[index] = task
+
+    def is_valid():
+        # 解析器按页码确定页：第0页是封面，第2页开始是正文（第1页是目录），确定了正文说明大纲多于两页
+        return dispatched.get(0, {}).get("type") == "cover" and any(index >= 2 for index in dispatched)
+
+    def done_replacements():
+        for index in sorted(replacements):
+            if replacements[index].done():
+                yield replacement_record(index, json.loads(replacements.pop(index).result()))
+
+    def invalid_outline(outline_text: str) -> str:
+        # 大纲接口返回的是错误信息时原样转发，保留错误码
+        upstream_error = _error_record(outline_text)
+        if upstream_error is not None:
+            return json.dumps(upstream_error)
+        return json.dumps({
+            "status": "error",
+            "message": "大纲生成失败或大纲不合法，无法生成PPT内容",
+            "code": "PIPELINE_OUTLINE_INVALID"
+        })
+
+    outline_chunks = []
+    try:
+        async for text in stream_agent_response(prompt, language, model, user_id):
+            upstream_error = _error_record(text)
+            if upstream_error is not None:
+                # 大纲生成中途出错，已经返回的页保留，之后不再返回
+                yield json.dumps(upstream_error)
+                return
+            outline_chunks.append(text)
+            dispatch(parser.feed(text))
+            if not validated:
+                if 0 in dispatched and dispatched[0].get("type") != "cover":
+                    yield invalid_outline("".join(outline_chunks))
+                    return
+                validated = is_valid()
+            if not validated:
+                continue
+            while next_index in tasks and tasks[next_index].done():
+                yield tasks[next_index].result()
+                next_index += 1
+            for record in done_replacements():
+                yield json.dumps(record, ensure_ascii=False)
+        dispatch(parser.close())
+        slides = parser.slides
+        if not slides or slides[0]["type"] != "cover" or len(slides) <= 2:
+            # 大纲生成失败或者不是合法的大纲，不生成内容；此时还没有返回任何页
+            yield invalid_outline("".join(outline_chunks))
+            return
+        while next_index < len(slides):
+            yield await tasks[next_index]
+            next_index += 1
+            for record in done_replacements():
+                yield json.dumps(record, ensure_ascii=False)
+        while replacements:
+            index = min(replacements)
+            yield json.dumps(replacement_record(index, json.loads(await replacements.pop(index))), ensure_ascii=False)
+    except Exception as e:
+        error_msg = f"流水线生成失败: {str(e)}"
+        logger.error(f"stream_pipeline_response异常: {error_msg}")
+        yield json.dumps({
+            "status": "error",
+            "message": error_msg,
+            "code": "PIPELINE_GENERATION_FAILED"
+        })
+    finally:
+        # 客户端断开时取消还没有完成的页
+        for task in list(tasks.values()) + list(replacements.values()):
+            if not task.done():
+                task.cancel()
+        pipeline_span.set_attribute("slides", len(tasks))
+        pipeline_span.end()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 22:00
+# @File  : template_assets.py
+# @Author:
+# @Desc  : 模板文件（template_*.json和预览图）的内存缓存：启动时加载并校验，预先压缩好gzip/brotli，
+#          根据ETag返回304，文件修改后自动重新加载
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Dict, List, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from metrics import CACHE_REQUESTS
+
+try:
+    import brotli
+except ImportError:
+    # 没有安装brotli时只提供gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 模板目录，默认是本文件旁边的template目录，与启动时的工作目录无关
+TEMPLATE_DIR = os.environ.get("TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "template"))
+# 每隔多少秒检查一次文件是否修改，0表示每次请求都检查
+TEMPLATE_CHECK_INTERVAL = float(os.environ.get("TEMPLATE_CHECK_INTERVAL", "2"))
+# 浏览器缓存时间（秒），过期后用ETag验证，没有变化时返回304
+TEMPLATE_MAX_AGE = int(os.environ.get("TEMPLATE_MAX_AGE", "300"))
+TEMPLATE_GZIP_LEVEL = int(os.environ.get("TEMPLATE_GZIP_LEVEL", "9"))
+TEMPLATE_BROTLI_QUALITY = int(os.environ.get("TEMPLATE_BROTLI_QUALITY", "11"))
+
+# 只压缩文本类型，jpg等图片本身已经压缩过
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+@dataclass
+class TemplateAsset:
+    name: str
+    media_type: str
+    body: bytes
+    etag: str
+    mtime: float
+    last_modified: str
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+    hits: int = 0
+    not_modified: int = 0
+    checked_at: float = 0.0
+
+    def variant(self, encoding: str) -> bytes:
+        if encoding == "br":
+            return self.br_body
+        if encoding == "gzip":
+            return self.gzip_body
+        return self.body
+
+    def variant_etag(self, encoding: str) -> str:
+        # 不同编码的内容不同，ETag也要不同
+        return f'"{self.etag}-{encoding}"' if encoding != "identity" else f'"{self.etag}"'
+
+
+def load_asset(path: str) -> TemplateAsset:
+    """读取、校验并压缩一个模板文件，JSON格式错误时抛出ValueError"""
+    name = os.path.basename(path)
+    mtime = os.stat(path).st_mtime
+    with open(path, "rb") as f:
+        body = f.read()
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type == "application/json":
+        try:
+            json.loads(body)
+        except ValueError as e:
+            raise ValueError(f"模板{name}不是合法的JSON: {e}") from e
+    asset = TemplateAsset(
+        name=name,
+        media_type=media_type,
+        body=body,
+        etag=hashlib.sha256(body).hexdigest()[:32],
+        mtime=mtime,
+        last_modified=formatdate(mtime, usegmt=True),
+        checked_at=time.monotonic(),
+    )
+    if media_type.startswith(COMPRESSIBLE_TYPES):
+        # mtime=0保证相同的内容压缩结果相同
+        asset.gzip_body = gzip.compress(body, compresslevel=TEMPLATE_GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            asset.br_body = brotli.compress(body, quality=TEMPLATE_BROTLI_QUALITY)
+    return asset
+
+
+def choose_encoding(accept_encoding: str, asset: TemplateAsset) -> str:
+    """根据Accept-Encoding选择最小的可用编码"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding)
+    if asset.br_body is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if asset.gzip_body is not None and ("gzip" in accepted or "*" in accepted):
+        return "gzip"
+    return "identity"
+
+
+def etag_matches(if_none_match: str, asset: TemplateAsset) -> bool:
+    """If-None-Match中有这个文件任意编码的ETag时返回True（弱比较）"""
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == asset.etag or tag.startswith(f"{asset.etag}-"):
+            return True
+    return False
+
+
+class TemplateAssetStore:
+    """
+    模板文件的内存缓存：
+    1. load_all在启动时加载目录下的所有文件，JSON模板格式错误的文件不提供服务
+    2. 每个文件最多每TEMPLATE_CHECK_INTERVAL秒检查一次修改时间，变化后在线程中重新加载，加载失败时继续使用旧的内容
+    3. 缓存中没有的文件名会检查一次目录，支持运行中新增的模板；文件名中不能包含路径
+    """
+
+    def __init__(self, directory: str = TEMPLATE_DIR, check_interval: float = TEMPLATE_CHECK_INTERVAL):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._assets: Dict[str, TemplateAsset] = {}
+        # 同一个文件同时只重新加载一次
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    def load_all(self) -> None:
+        if not os.path.isdir(self.directory):
+            logger.warning(f"模板目录{self.directory}不存在")
+            return
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                self._assets[name] = load_asset(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"加载模板{name}失败: {e}")
+        logger.info(f"已加载{len(self._assets)}个模板文件，共{sum(len(a.body) for a in self._assets.values())}字节")
+
+    async def get(self, filename: str) -> Optional[TemplateAsset]:
+        if filename != os.path.basename(filename) or filename.startswith("."):
+            return None
+        asset = self._assets.get(filename)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked_at < self.check_interval:
+            return asset
+        path = os.path.join(self.directory, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            if asset is not None:
+                logger.info(f"模板{filename}已被删除")
+                self._assets.pop(filename, None)
+            return None
+        if asset is not None and asset.mtime == mtime:
+            asset.checked_at = now
+            return asset
+        return await self._reload(filename, path, asset)
+
+    async def _reload(self, filename: str, path: str, old: Optional[TemplateAsset]) -> Optional[TemplateAsset]:
+        task = self._loading.get(filename)
+        if task is None:
+            # 压缩大文件比较慢，放到线程中执行，不阻塞事件循环
+            task = asyncio.create_task(asyncio.to_thread(load_asset, path))
+            self._loading[filename] = task
+            task.add_done_callback(lambda _: self._loading.pop(filename, None))
+        try:
+            asset = await task
+        except (OSError, ValueError) as e:
+            logger.error(f"重新加载模板{filename}失败，继续使用旧的内容: {e}")
+            if old is not None:
+                old.checked_at = time.monotonic()
+            return old
+        if old is not None:
+            asset.hits, asset.not_modified = old.hits, old.not_modified
+        logger.info(f"模板{filename}已重新加载")
+        self._assets[filename] = asset
+        return asset
+
+    async def response(self, request: Request, filename: str) -> Response:
+        asset = await self.get(filename)
+        if asset is None:
+            CACHE_REQUESTS.labels("template", "miss").inc()
+            return JSONResponse(status_code=404, content={"error": f"模板文件{filename}不存在"})
+        asset.hits += 1
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), asset)
+        headers = {
+            "ETag": asset.variant_etag(encoding),
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": f"public, max-age={TEMPLATE_MAX_AGE}",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, asset):
+            asset.not_modified += 1
+            CACHE_REQUESTS.labels("template", "not_modified").inc()
+            return Response(status_code=304, headers=headers)
+        CACHE_REQUESTS.labels("template", "hit").inc()
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=asset.variant(encoding), media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> List[dict]:
+        """每个模板文件的大小、压缩后大小和请求次数"""
+        return [{
+            "name": asset.name,
+            "size": len(asset.body),
+            "gzip_size": len(asset.gzip_body) if asset.gzip_body is not None else None,
+            "br_size": len(asset.br_body) if asset.br_body is not None else None,
+            "etag": asset.etag,
+            "hits": asset.hits,
+            "not_modified": asset.not_modified,
+        } for asset in self._assets.values()]
+
+
+template_store = TemplateAssetStore()
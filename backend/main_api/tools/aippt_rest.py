@@ -16,10 +16,22 @@ sys.path.insert(0, backend_dir)
 
 # 直接导入PPT生成服务
 from slide_agent.aippt_service_v2 import task_manager
+from metrics import TASK_QUEUE, register_refresher
 
-router = APIRouter()
+# 前缀放在APIRouter上，路由的path就是完整路径，指标的route标签与实际路径一致
+router = APIRouter(prefix="/tools")
 logger = logging.getLogger(__name__)
 
+
+def _refresh_task_queue_metrics():
+    """导出指标时读取任务队列的长度"""
+    stats = task_manager.get_stats()
+    TASK_QUEUE.labels("queued").set(stats["queued"])
+    TASK_QUEUE.labels("running").set(stats["running"])
+
+
+register_refresher(_refresh_task_queue_metrics)
+
 class MarkdownRequest(BaseModel):
     markdown: str
     model: str = "qwen3-235b"  # 添加模型参数，默认值为qwen3-235b
@@ -69,4 +81,19 @@ async def get_aippt_result(task_id: str):
         return {
             "status": "failed",
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+@router.post("/aippt_rest_cancel/{task_id}")
+async def cancel_aippt_task(task_id: str):
+    """取消排队中或生成中的PPT生成任务"""
+    if task_manager.cancel_task(task_id):
+        return {"task_id": task_id, "status": "cancelled"}
+    task_status = task_manager.get_task_status(task_id)
+    if task_status is None:
+        return {"status": "not_found", "error": "Task not found"}
+    return {"task_id": task_id, "status": task_status["status"], "error": "Task is not running"}
+
+@router.get("/aippt_rest_stats")
+async def get_aippt_stats():
+    """PPT生成任务队列的指标：排队数、运行数、完成数等"""
+    return task_manager.get_stats()
@@ -37,8 +37,49 @@ from a2a.utils.errors import ServerError
 from a2a.utils.message import new_agent_text_message
 
 
+from log_utils import get_hot_logger, set_request_id
+from metrics import INFLIGHT_SESSIONS
+from trace_utils import extract_trace_context, tracer
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# 每个event的日志只在DEBUG级别按采样率输出
+hot_logger = get_hot_logger(__name__)
+# 执行器返回结果时需要用到的state
+TRACKED_STATE_KEYS = ("metadata",)
+
+
+class SessionStateView:
+    """
+    只跟踪执行器需要的几个state key，根据每个event的state_delta增量更新，
+    不用在每个event上调用get_session获取（并深拷贝）整个session
+    """
+
+    def __init__(self, state: dict, keys: tuple):
+        self.keys = keys
+        self.values = {key: state[key] for key in keys if key in state}
+
+    def apply(self, event: Event) -> None:
+        delta = event.actions.state_delta if event.actions else None
+        if not delta:
+            return
+        for key in self.keys:
+            if key in delta:
+                self.values[key] = delta[key]
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+
+class TracedTaskUpdater(TaskUpdater):
+    """每次向event queue发送状态或结果时记录一个span"""
+
+    async def update_status(self, *args, **kwargs):
+        with tracer.start_as_current_span("a2a.emit_status"):
+            return await super().update_status(*args, **kwargs)
+
+    async def add_artifact(self, *args, **kwargs):
+        with tracer.start_as_current_span("a2a.emit_artifact"):
+            return await super().add_artifact(*args, **kwargs)
 
 
 class ADKAgentExecutor(AgentExecutor):
@@ -73,26 +114,24 @@ class ADKAgentExecutor(AgentExecutor):
         session_obj = await self._upsert_session(
             session_id,metadata
         )
-        logger.debug(f"收到请求信息: {new_message}")
+        logger.debug("收到请求信息: %s", new_message)
         # Update session_id with the ID from the resolved session object
         # to be used in self._run_agent.
         session_id = session_obj.id
+        state_view = SessionStateView(session_obj.state, TRACKED_STATE_KEYS)
 
         async for event in self._run_agent(session_id, new_message):
+            state_view.apply(event)
 
             if event.is_final_response():
-                final_session = await self.runner.session_service.get_session(
-                    app_name=self.runner.app_name, user_id="self", session_id=session_id
-                )
-                print("最终的session中的结果final_session中的state: ", final_session.state)
-                final_metadata = final_session.state.get("metadata")
+                final_metadata = state_view.get("metadata")
                 parts = convert_genai_parts_to_a2a(event.content.parts)
                 logger.debug("Yielding final response: %s", parts)
                 await task_updater.add_artifact(parts, metadata=final_metadata)
                 await task_updater.complete()
                 break
             if not event.get_function_calls():
-                logger.debug(f"Yielding update response, {event}")
+                hot_logger.debug("Yielding update response, %s", event)
                 await task_updater.update_status(
                     TaskState.working,
                     message=task_updater.new_agent_message(
@@ -100,27 +139,38 @@ class ADKAgentExecutor(AgentExecutor):
                     ),
                 )
             else:
-                logger.info(f"Skipping event, {event}")
+                hot_logger.debug("Skipping event, %s", event)
 
     async def execute(
         self,
         context: RequestContext,
         event_queue: EventQueue,
     ):
-        # Run the agent until either complete or the task is suspended.
-        updater = TaskUpdater(event_queue, context.task_id, context.context_id)
-        # Immediately notify that the task is submitted.
-        if not context.current_task:
-            await updater.submit()
-        await updater.start_work()
-        await self._process_request(
-            types.UserContent(
-                parts=convert_a2a_parts_to_genai(context.message.parts),
-            ),
-            context.context_id,
-            updater,
-            metadata=context.message.metadata
-        )
+        # 使用调用方传入的request_id，日志可以和main_api中的请求关联起来
+        metadata = context.message.metadata or {}
+        request_id = set_request_id(metadata.get("request_id"))
+        # 继续调用方传入的链路，ADK内部的span（invocation、call_llm等）都挂在这个span下面
+        with tracer.start_as_current_span("a2a.execute", context=extract_trace_context(metadata),
+                                          attributes={"agent": self.runner.app_name, "request_id": request_id}):
+            # Run the agent until either complete or the task is suspended.
+            updater = TracedTaskUpdater(event_queue, context.task_id, context.context_id)
+            # Immediately notify that the task is submitted.
+            if not context.current_task:
+                await updater.submit()
+            await updater.start_work()
+            inflight = INFLIGHT_SESSIONS.labels(self.runner.app_name)
+            inflight.inc()
+            try:
+                await self._process_request(
+                    types.UserContent(
+                        parts=convert_a2a_parts_to_genai(context.message.parts),
+                    ),
+                    context.context_id,
+                    updater,
+                    metadata=context.message.metadata
+                )
+            finally:
+                inflight.dec()
         logger.debug("[adk agent ] 执行完成，退出")
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue):
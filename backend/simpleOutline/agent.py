@@ -1,4 +1,6 @@
 import os
+import time
+import contextvars
 from typing import Dict, Any, Optional
 
 from dotenv import load_dotenv
@@ -10,19 +12,44 @@ from google.adk.tools.tool_context import ToolContext
 
 import prompt
 from create_model import create_model
+from metrics import observe_llm_call
+from tools import MaterialSearch
+from material_index import has_materials
+from log_utils import get_hot_logger
 
 load_dotenv()
 
+# 每次调用LLM和工具都会经过callback，日志按级别和采样率输出，见log_utils.HotPathLogger
+hot_logger = get_hot_logger(__name__)
+
 model = create_model(model=os.environ["LLM_MODEL"], provider=os.environ["MODEL_PROVIDER"])
+# before_model_callback记录LLM调用的开始时间，after_model_callback统计耗时
+_llm_start: contextvars.ContextVar[float] = contextvars.ContextVar("llm_start", default=0.0)
+
+def remove_tool(llm_request: LlmRequest, name: str) -> None:
+    llm_request.tools_dict.pop(name, None)
+    if llm_request.config and llm_request.config.tools:
+        tools = []
+        for tool in llm_request.config.tools:
+            if tool.function_declarations:
+                tool.function_declarations = [f for f in tool.function_declarations if f.name != name]
+                if not tool.function_declarations:
+                    continue
+            tools.append(tool)
+        llm_request.config.tools = tools
 
 def before_model_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
     # 1. 检查用户输入
     agent_name = callback_context.agent_name
     history_length = len(llm_request.contents)
     metadata = callback_context.state.get("metadata")
-    print(f"调用了{agent_name}模型前的callback, 现在Agent共有{history_length}条历史记录,metadata数据为：{metadata}")
+    hot_logger.debug("调用了%s模型前的callback, 现在Agent共有%d条历史记录,metadata数据为：%s", agent_name, history_length, metadata)
     #清空contents,不需要上一步的拆分topic的记录, 不能在这里清理，否则，每次调用工具都会清除记忆，白操作了
     # llm_request.contents.clear()
+    if not has_materials((metadata or {}).get("user_id", "")):
+        # 用户没有上传资料时不提供MaterialSearch工具，避免多一轮没有结果的工具调用
+        remove_tool(llm_request, MaterialSearch.__name__)
+    _llm_start.set(time.monotonic())
     # 返回 None，继续调用 LLM
     return None
 def after_model_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
@@ -34,6 +61,11 @@ def after_model_callback(callback_context: CallbackContext, llm_response: LlmRes
         part_text = one_part.text
         if part_text is not None:
             part_texts.append(part_text)
+    # 流式模式下只在最后一个完整的回复上统计
+    start = _llm_start.get()
+    if start and not llm_response.partial:
+        observe_llm_call(agent_name, os.environ["MODEL_PROVIDER"], os.environ["LLM_MODEL"], time.monotonic() - start, llm_response.usage_metadata)
+        _llm_start.set(0.0)
     # part_text_content = "\n".join(part_texts)
     # metadata = callback_context.state.get("metadata")
     #清空contents,不需要上一步的拆分topic的记录, 不能在这里清理，否则，每次调用工具都会清除记忆，白操作了
@@ -46,7 +78,7 @@ def after_tool_callback(
 ) -> Optional[Dict]:
 
   tool_name = tool.name
-  print(f"调用了{tool_name}工具后的callback, tool_response数据为：{tool_response}")
+  hot_logger.debug("调用了%s工具后的callback, tool_response数据为：%s", tool_name, tool_response)
   return None
 
 root_agent = Agent(
@@ -59,4 +91,5 @@ root_agent = Agent(
     before_model_callback=before_model_callback,
     after_model_callback=after_model_callback,
     after_tool_callback=after_tool_callback,
+    tools=[MaterialSearch],
 )
@@ -3,116 +3,283 @@
 # @Date  : 2024/10/29 14:17
 # @File  : monitor_utils.py
 # @Author:
-# @Desc  :
+# @Desc  : 函数结果缓存。缓存存放在按key分片的SQLite文件中，支持LRU/TTL淘汰、容量上限、原子写入和命中统计
 
 import os
-import re
-import random
 import json
+import time
 import hashlib
 import pickle
 import asyncio
+import logging
+import sqlite3
+import threading
 from functools import wraps
+from typing import Any, Optional, Tuple
+
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# 缓存目录
+CACHE_PATH = os.environ.get("CACHE_PATH", "cache")
+# 每个缓存（所有分片合计）的最大字节数
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# 每个缓存（所有分片合计）的最大条目数
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "100000"))
+# 缓存有效期（秒），0表示不过期
+CACHE_TTL = float(os.environ.get("CACHE_TTL", str(7 * 24 * 3600)))
+# 分片数，减少多个进程同时写入时的锁竞争
+CACHE_SHARDS = int(os.environ.get("CACHE_SHARDS", "4"))
 
-# random.seed(42)
 
 def cal_md5(content):
     content = str(content)
     result = hashlib.md5(content.encode())
     return result.hexdigest()
 
-def async_cache_decorator(func):
-    cache_path = "cache"
-    if not os.path.exists(cache_path):
-        os.mkdir(cache_path)
 
+class CacheStore:
+    """
+    基于SQLite的缓存存储：
+    - key按哈希分到多个SQLite文件，每个文件使用WAL模式，写入在事务中完成，读写不会读到半个结果
+    - 超过有效期的条目读取时视为未命中；超过容量或条目上限时按最近访问时间淘汰
+    - 多个进程可以共享同一个缓存目录
+    """
+    # 命中后最近访问时间的更新间隔，避免每次读取都写数据库
+    TOUCH_INTERVAL = 60
+    # 淘汰时每个事务最多删除的条目数
+    EVICT_BATCH = 500
+
+    def __init__(self, name: str = "cache", cache_path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES,
+                 max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL, shards: int = CACHE_SHARDS):
+        self.name = name
+        self.cache_path = cache_path
+        self.shards = max(1, shards)
+        self.shard_max_bytes = max_bytes // self.shards
+        self.shard_max_entries = max(1, max_entries // self.shards)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 每个分片大致的字节数，超过上限时再去数据库里精确统计并淘汰
+        self._shard_bytes = [0] * self.shards
+        os.makedirs(cache_path, exist_ok=True)
+        for shard in range(self.shards):
+            conn = self._connect(shard)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+            self._shard_bytes[shard] = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _shard_of(self, key: str) -> int:
+        return int(key[:8], 16) % self.shards
+
+    def _connect(self, shard: int) -> sqlite3.Connection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(shard)
+        if conn is None:
+            db_file = os.path.join(self.cache_path, f"{self.name}_{shard}.sqlite3")
+            conn = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conns[shard] = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """返回(是否命中, 缓存的值)"""
+        conn = self._connect(self._shard_of(key))
+        row = conn.execute("SELECT value, created_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS.labels(self.name, "miss").inc()
+            return False, None
+        try:
+            value = pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"缓存{self.name}读取{key}失败，错误信息:{e}")
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS.labels(self.name, "miss").inc()
+            return False, None
+        if now - row[2] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        CACHE_REQUESTS.labels(self.name, "hit").inc()
+        return True, value
+
+    def set(self, key: str, value: Any) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        shard = self._shard_of(key)
+        now = time.time()
+        conn = self._connect(shard)
+        # 覆盖已有的key时减去旧值的大小，读取和写入在同一个事务中
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.writes += 1
+            self._shard_bytes[shard] += len(data) - (row[0] if row else 0)
+            need_evict = self._shard_bytes[shard] > self.shard_max_bytes or self.writes % 100 == 0
+        if need_evict:
+            self._evict(shard)
+
+    def delete(self, key: str) -> None:
+        self._connect(self._shard_of(key)).execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _evict(self, shard: int) -> None:
+        """删除过期条目，然后按最近访问时间淘汰，直到低于容量和条目上限的90%"""
+        conn = self._connect(shard)
+        removed = 0
+        if self.ttl:
+            removed += conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        total_bytes, total_entries = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM cache").fetchone()
+        if total_bytes > self.shard_max_bytes or total_entries > self.shard_max_entries:
+            target_bytes = self.shard_max_bytes * 0.9
+            target_entries = int(self.shard_max_entries * 0.9)
+            # 每次删除最久没有访问的一批，不把整个分片的key读进内存，每批是一个短事务
+            while total_bytes > target_bytes or total_entries > target_entries:
+                over_entries = total_entries - target_entries
+                over_bytes = total_bytes - target_bytes
+                average_size = total_bytes / total_entries if total_entries else 1
+                batch = min(self.EVICT_BATCH, max(1, over_entries, int(over_bytes / max(average_size, 1)) + 1))
+                sizes = conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?) RETURNING size",
+                    (batch,),
+                ).fetchall()
+                if not sizes:
+                    break
+                total_bytes -= sum(size for size, in sizes)
+                total_entries -= len(sizes)
+                removed += len(sizes)
+        with self._lock:
+            self._shard_bytes[shard] = total_bytes
+            self.evictions += removed
+        if removed:
+            logger.info(f"缓存{self.name}的分片{shard}淘汰了{removed}条记录")
+
+    def clear(self) -> None:
+        for shard in range(self.shards):
+            self._connect(shard).execute("DELETE FROM cache")
+            self._shard_bytes[shard] = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "bytes": sum(self._shard_bytes),
+        }
+
+
+_default_store: Optional[CacheStore] = None
+
+
+def get_cache_store() -> CacheStore:
+    """cache_decorator和async_cache_decorator共用的缓存存储"""
+    global _default_store
+    if _default_store is None:
+        _default_store = CacheStore()
+    return _default_store
+
+
+def _make_key(func, args, kwargs) -> str:
+    # 当装饰类中的函数的时候，args的第一个参数是实例化的类，这会通常导致改变，我们不想检测它是否改变，那么就忽略它
+    if len(args) > 0 and not isinstance(args[0], (int, float, str, list, tuple, dict)):
+        args = args[1:]
+    # kwargs按名称排序，相同的参数不同的传参顺序得到相同的key
+    key = json.dumps([f"{func.__module__}.{func.__qualname__}", args, sorted(kwargs.items())],
+                     ensure_ascii=False, default=repr)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def async_cache_decorator(func):
+    """
+    cache_decorator的异步版本，读写缓存放到线程中执行，不阻塞事件循环
+    """
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        usecache = kwargs.get("usecache", True)
-        if "usecache" in kwargs:
-            del kwargs["usecache"]
-
-        if len(args)> 0:
-            if isinstance(args[0],(int, float, str, list, tuple, dict)):
-                key = str(args) + str(kwargs) + func.__name__
-            else:
-                # 第1个参数以后的内容
-                key = str(args[1:]) + str(kwargs) + func.__name__
-        else:
-            key = str(args) + str(kwargs) + func.__name__
-
-        key_file = os.path.join(cache_path, cal_md5(key) + "_cache.pkl")
+        usecache = kwargs.pop("usecache", True)
+        store = get_cache_store()
+        key = _make_key(func, args, kwargs)
 
-        if os.path.exists(key_file) and usecache:
-            print(f"缓存命中，读取缓存文件: {key_file}")
-            with open(key_file, 'rb') as f:
-                result = pickle.load(f)
+        if usecache:
+            hit, result = await asyncio.to_thread(store.get, key)
+            if hit:
+                logger.debug(f"函数{func.__name__}缓存命中: {key}")
                 return result
 
         # 使用 `await` 调用异步函数
         result = await func(*args, **kwargs)
 
         if isinstance(result, tuple) and result[0] == False:
-            print(f"函数 {func.__name__} 返回结果为 False, 不缓存")
+            logger.debug(f"函数 {func.__name__} 返回结果为 False, 不缓存")
         else:
-            with open(key_file, 'wb') as f:
-                pickle.dump(result, f)
-            print(f"缓存未命中，结果缓存至文件: {key_file}")
+            await asyncio.to_thread(store.set, key, result)
+            logger.debug(f"函数{func.__name__}缓存未命中，结果已缓存: {key}")
 
         return result
 
     return wrapper
 
+
 def cache_decorator(func):
     """
-    cache从文件中读取, 当func中存在usecache时，并且为False时，不使用缓存
+    cache从缓存存储中读取, 当func中存在usecache时，并且为False时，不使用缓存
     Args:
         func ():
     Returns:
     """
-    cache_path = "cache" #cache目录
-    if not os.path.exists(cache_path):
-        os.mkdir(cache_path)
-
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # 将args和kwargs转换为哈希键， 当装饰类中的函数的时候，args的第一个参数是实例化的类，这会通常导致改变，我们不想检测它是否改变，那么就忽略它
-        usecache = kwargs.get("usecache", True)
-        if "usecache" in kwargs:
-            del kwargs["usecache"]
-        if len(args)> 0:
-            if isinstance(args[0],(int, float, str, list, tuple, dict)):
-                key = str(args) + str(kwargs) + func.__name__
-            else:
-                # 第1个参数以后的内容
-                key = str(args[1:]) + str(kwargs) + func.__name__
-        else:
-            key = str(args) + str(kwargs) + func.__name__
-        # 变成md5字符串
-        key_file = os.path.join(cache_path, cal_md5(key) + "_cache.pkl")
+        usecache = kwargs.pop("usecache", True)
+        store = get_cache_store()
+        key = _make_key(func, args, kwargs)
         # 如果结果已缓存，则返回缓存的结果
-        if os.path.exists(key_file) and usecache:
-            # 去掉kwargs中的usecache
-            print(f"函数{func.__name__}被调用，缓存被命中，使用已缓存结果，对于参数{key}, 读取文件:{key_file}")
-            try:
-                with open(key_file, 'rb') as f:
-                    result = pickle.load(f)
-                    return result
-            except Exception as e:
-                print(f"函数{func.__name__}被调用，缓存被命中，读取文件:{key_file}失败，错误信息:{e}")
+        if usecache:
+            hit, result = store.get(key)
+            if hit:
+                logger.debug(f"函数{func.__name__}被调用，缓存被命中，使用已缓存结果: {key}")
+                return result
         result = func(*args, **kwargs)
-        # 将结果缓存到文件中
         # 如果返回的数据是一个元祖，并且第1个参数是False,说明这个函数报错了，那么就不缓存了是我们自己的一个设定
         if isinstance(result, tuple) and result[0] == False:
-            print(f"函数{func.__name__}被调用，返回结果为False，对于参数{key}, 不缓存")
+            logger.debug(f"函数{func.__name__}被调用，返回结果为False，不缓存")
         else:
-            with open(key_file, 'wb') as f:
-                pickle.dump(result, f)
-            print(f"函数{func.__name__}被调用，缓存未命中，结果被缓存，对于参数{key}, 写入文件:{key_file}")
+            store.set(key, result)
+            logger.debug(f"函数{func.__name__}被调用，缓存未命中，结果被缓存: {key}")
         return result
 
     return wrapper
 
 
 if __name__ == "__main__":
-    cal_md5("hello")
\ No newline at end of file
+    cal_md5("hello")
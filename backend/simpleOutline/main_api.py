@@ -1,5 +1,6 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 
 import click
 import uvicorn
@@ -9,25 +10,27 @@ from dotenv import load_dotenv
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from starlette.routing import Route
 from google.adk.agents.run_config import RunConfig, StreamingMode
 from a2a.server.apps import A2AStarletteApplication
 from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
 from a2a.types import AgentCapabilities, AgentCard, AgentSkill
 from starlette.middleware.cors import CORSMiddleware
 from starlette.applications import Starlette
 from agent import root_agent
+from log_utils import setup_logging
+from trace_utils import setup_tracing
+from metrics import metrics_endpoint
+from session_service import BoundedSessionService
+from a2a_task_store import EvictingTaskStore
 
 # 加载环境变量
 load_dotenv()
 
-# 配置日志格式和级别
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+# 配置日志格式和级别，见log_utils.py，通过环境变量LOG_LEVEL、LOG_FORMAT、LOG_SAMPLE_RATE配置
+setup_logging()
+# 链路追踪，通过环境变量TRACE_EXPORTER开启，见trace_utils.py
+setup_tracing("simpleOutline")
 logger = logging.getLogger(__name__)
 
 @click.command()
@@ -72,11 +75,13 @@ def main(host: str, port: int, agent_url: str=""):
 
     # 初始化 Runner，管理 agent 的执行、会话、记忆和产物
     logger.info("初始化Runner...")
+    # 会话按TTL和LRU淘汰，限制内存占用，见session_service.py
+    session_service = BoundedSessionService()
     runner = Runner(
         app_name=agent_card.name,
         agent=root_agent,
         artifact_service=InMemoryArtifactService(),
-        session_service=InMemorySessionService(),
+        session_service=session_service,
         memory_service=InMemoryMemoryService(),
     )
 
@@ -97,9 +102,12 @@ def main(host: str, port: int, agent_url: str=""):
     # 初始化 agent 执行器
     agent_executor = ADKAgentExecutor(runner, agent_card, run_config)
 
+    # 结束的任务保留一段时间后淘汰，限制内存占用，见a2a_task_store.py
+    task_store = EvictingTaskStore()
+
     # 请求处理器，管理任务存储和请求分发
     request_handler = DefaultRequestHandler(
-        agent_executor=agent_executor, task_store=InMemoryTaskStore()
+        agent_executor=agent_executor, task_store=task_store
     )
 
     # 构建 Starlette 应用
@@ -107,7 +115,15 @@ def main(host: str, port: int, agent_url: str=""):
         agent_card=agent_card, http_handler=request_handler
     )
 
-    app = a2a_app.build()
+    @asynccontextmanager
+    async def lifespan(app):
+        # 后台淘汰过期的会话和任务，关闭时保存
+        async with session_service.lifespan(app), task_store.lifespan(app):
+            yield
+
+    app = a2a_app.build(lifespan=lifespan)
+    # Prometheus指标
+    app.routes.append(Route("/metrics", metrics_endpoint, methods=["GET"]))
     # CORS
     app.add_middleware(
         CORSMiddleware,
@@ -8,6 +8,7 @@
 
 OUTLINE_INSTRUCTION = """
 根据用户的描述生成大纲。按下面的格式生成大纲，仅生成大纲即可，无需多余说明, 可以在使用DocumentSearch进行大纲的细节补充。。
+如果可以使用MaterialSearch工具，说明用户上传了资料，先检索资料中与主题相关的内容，大纲要覆盖资料中的要点。
 输出格式与规则（严格遵守）：
 - 使用Markdown标题层级：# 标题 → ## 一级部分 → ### 二级小节 → 列表要点
 - 一级部分数量：5个；每个一级部分下含3–4个二级小节
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 11:00
+# @File  : session_service.py
+# @Author:
+# @Desc  : 有上限的ADK会话服务：按TTL和LRU淘汰会话，限制会话数量和估算的内存占用；
+#          可选把淘汰的会话保存到SQLite，再次访问时加载回内存
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+
+from metrics import SESSION_BYTES, SESSION_EVICTIONS, SESSIONS, register_refresher
+
+logger = logging.getLogger(__name__)
+
+# 会话最后一次读写后在内存中保留的时间（秒）
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+# 内存中最多保留的会话数量，超过后淘汰最久没有使用的会话
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "500"))
+# 内存中会话的估算大小上限（MB），按JSON序列化后的字节数估算
+SESSION_MAX_MB = float(os.environ.get("SESSION_MAX_MB", "256"))
+# 最近多少秒内有读写的会话认为正在执行，超过数量或内存上限时也不淘汰（TTL到期的仍然淘汰）
+SESSION_ACTIVE_GRACE = float(os.environ.get("SESSION_ACTIVE_GRACE", "300"))
+# 淘汰的会话保存到这个SQLite文件，为空表示直接丢弃
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "")
+# 保存到SQLite的会话保留的时间（秒），默认7天
+SESSION_DB_TTL = float(os.environ.get("SESSION_DB_TTL", str(7 * 24 * 3600)))
+# 后台检查TTL的间隔（秒）
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "60"))
+
+# (app_name, user_id, session_id)
+SessionKey = Tuple[str, str, str]
+
+
+def _key(session: Session) -> SessionKey:
+    return session.app_name, session.user_id, session.id
+
+
+class SessionSpillStore:
+    """
+    保存被淘汰的会话，整个会话序列化成一行JSON。
+    使用WAL模式，每个线程使用自己的连接（与aippt_task_store.py相同）。
+    """
+    # 每写入多少次清理一次过期的会话
+    CLEANUP_EVERY = 100
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, ttl: float = SESSION_DB_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS adk_sessions (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (app_name, user_id, session_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_adk_sessions_updated_at ON adk_sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put_many(self, sessions: List[Session]) -> None:
+        now = time.time()
+        rows = [(*_key(session), session.model_dump_json(), now) for session in sessions]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO adk_sessions (app_name, user_id, session_id, data, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+        self._writes += len(rows)
+        if self._writes >= self.CLEANUP_EVERY:
+            self._writes = 0
+            self.cleanup()
+
+    def pop(self, key: SessionKey) -> Optional[Session]:
+        """取出并删除一个会话，加载回内存后以内存中的为准"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data, updated_at FROM adk_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?",
+            key).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM adk_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+        data, updated_at = row
+        if time.time() - updated_at > self.ttl:
+            return None
+        return Session.model_validate_json(data)
+
+    def delete(self, key: SessionKey) -> None:
+        self._connect().execute(
+            "DELETE FROM adk_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+
+    def cleanup(self) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM adk_sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        if cursor.rowcount:
+            logger.info(f"清理了{cursor.rowcount}个过期的已保存会话")
+        return cursor.rowcount
+
+
+def _estimate_size(value: Any) -> int:
+    """估算会话占用的内存，使用JSON序列化后的字节数（实际的Python对象更大，只用于比较和设置上限）"""
+    if isinstance(value, Event):
+        return len(value.model_dump_json(exclude_none=True))
+    if isinstance(value, Session):
+        return len(value.model_dump_json())
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class BoundedSessionService(InMemorySessionService):
+    """
+    在InMemorySessionService的基础上限制内存中的会话：
+    1. 每个会话记录最后一次读写的时间和估算大小，按最近使用排序
+    2. 超过SESSION_TTL没有读写的会话被淘汰；会话数量或估算大小超过上限时，从最久没有使用的开始淘汰，
+       但最近SESSION_ACTIVE_GRACE秒内有读写的会话（正在执行的Agent）不淘汰
+    3. 设置了SESSION_DB_PATH时，淘汰的会话保存到SQLite，get_session在内存中找不到时从SQLite加载回来；
+       关闭服务时把内存中的会话也保存下来，重启后可以继续之前的会话
+    list_sessions只返回内存中的会话。
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_count: int = SESSION_MAX_COUNT,
+                 max_bytes: int = int(SESSION_MAX_MB * 1024 * 1024), active_grace: float = SESSION_ACTIVE_GRACE,
+                 db_path: str = SESSION_DB_PATH):
+        super().__init__()
+        self.ttl = ttl
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.active_grace = active_grace
+        self.spill = SessionSpillStore(db_path) if db_path else None
+        # key -> [最后一次读写的时间(monotonic), 估算大小]，按最近使用排序
+        self._lru: "OrderedDict[SessionKey, List[float]]" = OrderedDict()
+        self.total_bytes = 0
+        register_refresher(self._refresh_metrics)
+
+    def _refresh_metrics(self) -> None:
+        SESSIONS.set(len(self._lru))
+        SESSION_BYTES.set(self.total_bytes)
+
+    def _track(self, key: SessionKey, size: int) -> None:
+        """记录一次读写，size为新增的估算大小"""
+        entry = self._lru.get(key)
+        if entry is None:
+            entry = self._lru[key] = [0.0, 0]
+        entry[0] = time.monotonic()
+        entry[1] += size
+        self.total_bytes += size
+        self._lru.move_to_end(key)
+
+    def _reset_size(self, key: SessionKey) -> None:
+        entry = self._lru.get(key)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            entry[1] = 0
+
+    def _remove(self, key: SessionKey) -> Optional[Session]:
+        """从内存中移除一个会话，返回被移除的会话"""
+        _, size = self._lru.pop(key, (0.0, 0))
+        self.total_bytes -= size
+        app_name, user_id, session_id = key
+        user_sessions = self.sessions.get(app_name, {}).get(user_id)
+        if not user_sessions:
+            return None
+        session = user_sessions.pop(session_id, None)
+        if not user_sessions:
+            # 每个请求的user_id可能不同，清理空的字典
+            del self.sessions[app_name][user_id]
+        return session
+
+    def _collect_victims(self) -> List[Tuple[SessionKey, str]]:
+        now = time.monotonic()
+        victims = []
+        count, total = len(self._lru), self.total_bytes
+        # 按最近使用排序，最前面的最久没有使用，遇到第一个不需要淘汰的就可以停止
+        for key, (accessed_at, size) in self._lru.items():
+            idle = now - accessed_at
+            if idle > self.ttl:
+                reason = "ttl"
+            elif idle < self.active_grace:
+                break
+            elif count > self.max_count:
+                reason = "count"
+            elif total > self.max_bytes:
+                reason = "memory"
+            else:
+                break
+            victims.append((key, reason))
+            count -= 1
+            total -= size
+        return victims
+
+    async def evict(self) -> int:
+        """淘汰过期和超过上限的会话，返回淘汰的数量"""
+        victims = self._collect_victims()
+        if not victims:
+            return 0
+        evicted = []
+        for key, reason in victims:
+            session = self._remove(key)
+            SESSION_EVICTIONS.labels(reason).inc()
+            logger.debug(f"淘汰会话{key[2]}，原因: {reason}")
+            if session is not None:
+                evicted.append(session)
+        if self.spill is not None and evicted:
+            try:
+                # 已经从内存中移除，序列化和写入放到线程中执行
+                await asyncio.to_thread(self.spill.put_many, evicted)
+            except sqlite3.Error as e:
+                logger.error(f"保存{len(evicted)}个被淘汰的会话失败: {e}")
+        logger.info(f"淘汰了{len(victims)}个会话，内存中还有{len(self._lru)}个，估算{self.total_bytes / 1024 / 1024:.1f}MB")
+        return len(victims)
+
+    async def _restore(self, key: SessionKey) -> None:
+        """内存中没有的会话从SQLite加载回来"""
+        if self.spill is None or key in self._lru:
+            return
+        try:
+            session = await asyncio.to_thread(self.spill.pop, key)
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"加载已保存的会话{key[2]}失败: {e}")
+            return
+        # 在线程中加载时可能已经创建了同一个会话，以内存中的为准
+        if session is None or key in self._lru:
+            return
+        app_name, user_id, session_id = key
+        self.sessions.setdefault(app_name, {}).setdefault(user_id, {})[session_id] = session
+        self._track(key, _estimate_size(session))
+        logger.info(f"从SQLite加载会话{session_id}，{len(session.events)}个event")
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[Dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        await self.evict()
+        session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        key = _key(session)
+        # 相同的session_id会覆盖之前的会话，重新计算大小
+        self._reset_size(key)
+        self._track(key, _estimate_size(session.state))
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        await self.evict()
+        key = (app_name, user_id, session_id)
+        await self._restore(key)
+        session = await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+        if session is not None:
+            self._track(key, 0)
+        return session
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self._remove(key)
+        if self.spill is not None:
+            await asyncio.to_thread(self.spill.delete, key)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        key = _key(session)
+        # partial的event不会保存到会话中
+        if not event.partial and key in self._lru:
+            self._track(key, _estimate_size(event))
+        return event
+
+    async def sweep_forever(self, interval: float = SESSION_SWEEP_INTERVAL) -> None:
+        """没有请求时也按TTL淘汰会话，在服务的lifespan中作为后台任务运行"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict()
+                if self.spill is not None:
+                    await asyncio.to_thread(self.spill.cleanup)
+            except Exception as e:
+                logger.error(f"淘汰会话失败: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        """关闭服务时把内存中的会话保存到SQLite"""
+        if self.spill is None or not self._lru:
+            return
+        sessions = [session for key in list(self._lru) if (session := self._remove(key)) is not None]
+        await asyncio.to_thread(self.spill.put_many, sessions)
+        logger.info(f"已保存{len(sessions)}个会话到{self.spill.db_path}")
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        """作为Starlette应用的lifespan：运行期间后台淘汰过期的会话，关闭时保存会话"""
+        sweeper = asyncio.create_task(self.sweep_forever())
+        try:
+            yield
+        finally:
+            sweeper.cancel()
+            await self.close()
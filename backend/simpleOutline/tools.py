@@ -8,10 +8,17 @@
 
 from google.adk.tools import ToolContext
 from google.adk.tools.agent_tool import AgentTool
-from weixin_search import sogou_weixin_search,get_real_url,get_article_content
+from weixin_search import async_get_wechat_article
+from material_index import search_materials
+import asyncio
+import logging
 import time
 from datetime import datetime
 import random
+from log_utils import get_hot_logger
+
+logger = logging.getLogger(__name__)
+hot_logger = get_hot_logger(__name__)
 
 async def DocumentSearch(
     keyword: str, number: int,
@@ -23,36 +30,39 @@ async def DocumentSearch(
     :return: 返回每篇文档数据
     """
     agent_name = tool_context.agent_name
-    print(f"Agent{agent_name}正在调用工具：DocumentSearch: " + keyword)
+    logger.info("Agent%s正在调用工具：DocumentSearch: %s", agent_name, keyword)
     metadata = tool_context.state.get("metadata", {})
     if metadata is None:
         metadata = {}
-    print(f"调用工具：DocumentSearch时传入的metadata: {metadata}")
-    print("文档检索: " + keyword)
+    hot_logger.debug("调用工具：DocumentSearch时传入的metadata: %s", metadata)
     start_time = time.time()
-    results = sogou_weixin_search(keyword)
-    if not results:
-        return f"没有搜索到{keyword}相关的文章"
-    articles = []
-    results = results[:number]
-    for every_result in results:
-        sougou_link = every_result["link"]
-        real_url = get_real_url(sougou_link)
-        # referer：请求来源
-        content = get_article_content(real_url, referer=sougou_link)
-        article = {
-            "title": every_result["title"],
-            "publish_time": every_result["publish_time"],
-            "real_url": real_url,
-            "content": content
-        }
-        articles.append(article)
+    # 并发获取文章，不阻塞事件循环，到达截止时间时返回已获取的部分文章
+    articles = await async_get_wechat_article(keyword, number)
+    if isinstance(articles, str):
+        return articles
     end_time = time.time()
-    print(f"关键词{keyword}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
+    logger.info("关键词%s相关的文章已经获取完毕，获取到%d篇, 耗时%.2f秒", keyword, len(articles), end_time - start_time)
     metadata["tool_document_ids"] = articles
     tool_context.state["metadata"] = metadata
     return articles
 
+async def MaterialSearch(
+    keyword: str,
+    tool_context: ToolContext,
+):
+    """
+    在用户上传的资料中检索与关键词相关的内容
+    :param keyword: str, 检索的关键词
+    :return: 返回相关的资料片段，每个包含资料名称和内容
+    """
+    metadata = tool_context.state.get("metadata") or {}
+    user_id = metadata.get("user_id", "")
+    # 本地BM25索引，没有网络请求
+    results = await asyncio.to_thread(search_materials, user_id, keyword)
+    if not results:
+        return "用户没有上传相关的资料"
+    return [{"name": r["name"], "text": r["text"]} for r in results]
+
 if __name__ == '__main__':
     result = DocumentSearch(keyword="电动汽车")
     print(result)
\ No newline at end of file
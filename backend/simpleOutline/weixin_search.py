@@ -5,29 +5,47 @@
 # @Author: johnson
 # @Contact : github: johnson7788
 # @Desc  : 使用搜索搜索微信公众号文章，先关机关键词搜索搜狗，获取链接，然后使用get_real_url获取真实链接，最后使用真实链接获取公众号内容。
+#          async_get_wechat_article使用httpx并发获取文章，限制总并发和每个域名的并发，单篇超时或整体截止时间到达时返回已获取的部分结果。
+import os
 import json
 import asyncio
-from typing import Any, Dict, List, Optional
+import logging
+from typing import Any, Dict, List, Optional, Union
+import httpx
 import requests
 from lxml import html
-from urllib.parse import quote
-from cache_utils import cache_decorator
+from urllib.parse import quote, urlparse
+from cache_utils import cache_decorator, async_cache_decorator
 import time
 
-@cache_decorator
-def sogou_weixin_search(query: str) -> List[Dict[str, str]]:
-    """在搜狗微信搜索中搜索指定关键词并返回结果列表"""
-    headers = {
+logger = logging.getLogger(__name__)
+
+# 同时获取文章的请求数
+WEIXIN_FETCH_CONCURRENCY = int(os.environ.get("WEIXIN_FETCH_CONCURRENCY", "8"))
+# 每个域名（weixin.sogou.com, mp.weixin.qq.com）同时的请求数，避免被限流
+WEIXIN_PER_HOST_CONCURRENCY = int(os.environ.get("WEIXIN_PER_HOST_CONCURRENCY", "4"))
+# 单篇文章（获取真实链接+获取正文）的超时时间（秒）
+WEIXIN_ARTICLE_TIMEOUT = float(os.environ.get("WEIXIN_ARTICLE_TIMEOUT", "10"))
+# 一次搜索的整体截止时间（秒），到达后返回已经获取到的文章
+WEIXIN_SEARCH_DEADLINE = float(os.environ.get("WEIXIN_SEARCH_DEADLINE", "20"))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0'
+
+
+def _search_headers(query: str) -> Dict[str, str]:
+    return {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
         'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
         'Cache-Control': 'no-cache',
         'Connection': 'keep-alive',
         'Pragma': 'no-cache',
         'Referer': f'https://weixin.sogou.com/weixin?query={quote(query)}',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0',
+        'User-Agent': USER_AGENT,
     }
 
-    params = {
+
+def _search_params(query: str) -> Dict[str, str]:
+    return {
         'type': '2',
         's_from': 'input',
         'query': query,
@@ -36,71 +54,20 @@ def sogou_weixin_search(query: str) -> List[Dict[str, str]]:
         '_sug_type_': '',
     }
 
-    try:
-        response = requests.get('https://weixin.sogou.com/weixin', params=params, headers=headers)
 
-        if response.status_code == 200:
-            tree = html.fromstring(response.text)
-            results = []
+REAL_URL_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Pragma': 'no-cache',
+    'User-Agent': USER_AGENT,
+    'Cookie': 'ABTEST=7|1750756616|v1; SUID=0A5BF4788E52A20B00000000685A6D08; IPLOC=CN1100; SUID=605BF4783954A20B00000000685A6D08; SUV=006817F578F45BFE685A6D0B913DA642; SNUID=B3E34CC0B8BF80F5737E3561B9B78454; ariaDefaultTheme=undefined',
+}
 
-            elements = tree.xpath("//a[contains(@id, 'sogou_vr_11002601_title_')]")
-            publish_time = tree.xpath(
-                "//li[contains(@id, 'sogou_vr_11002601_box_')]/div[@class='txt-box']/div[@class='s-p']/span[@class='s2']")
-
-            for element, time_elem in zip(elements, publish_time):
-                title = element.text_content().strip()
-                link = element.get('href')
-                if link and not link.startswith('http'):
-                    link = 'https://weixin.sogou.com' + link
-                results.append({
-                    'title': title,
-                    'link': link,
-                    'publish_time': time_elem.text_content().strip()
-                })
-
-            return results
-        else:
-            return []
-    except Exception as e:
-        return []
 
-@cache_decorator
-def get_real_url(sogou_url: str) -> str:
-    """从搜狗微信链接获取真实的微信公众号文章链接"""
-    headers = {
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        'Pragma': 'no-cache',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0',
-        'Cookie': 'ABTEST=7|1750756616|v1; SUID=0A5BF4788E52A20B00000000685A6D08; IPLOC=CN1100; SUID=605BF4783954A20B00000000685A6D08; SUV=006817F578F45BFE685A6D0B913DA642; SNUID=B3E34CC0B8BF80F5737E3561B9B78454; ariaDefaultTheme=undefined',
-    }
-
-    try:
-        response = requests.get(sogou_url, headers=headers)
-
-        script_content = response.text
-        start_index = script_content.find("url += '") + len("url += '")
-        url_parts = []
-        while True:
-            part_start = script_content.find("url += '", start_index)
-            if part_start == -1:
-                break
-            part_end = script_content.find("'", part_start + len("url += '"))
-            part = script_content[part_start + len("url += '"):part_end]
-            url_parts.append(part)
-            start_index = part_end + 1
-
-        full_url = ''.join(url_parts).replace("@", "")
-        return "https://mp." + full_url
-    except Exception as e:
-        return ""
-
-@cache_decorator
-def get_article_content(real_url: str, referer: str) -> str:
-    """获取微信公众号文章的正文内容"""
-    headers = {
+def _article_headers(referer: str) -> Dict[str, str]:
+    return {
         'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
         'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
         'cache-control': 'no-cache',
@@ -115,45 +82,209 @@ def get_article_content(real_url: str, referer: str) -> str:
         'sec-fetch-site': 'cross-site',
         'sec-fetch-user': '?1',
         'upgrade-insecure-requests': '1',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0',
+        'user-agent': USER_AGENT,
     }
 
+
+def _parse_search_results(page: str) -> List[Dict[str, str]]:
+    """解析搜狗微信搜索的结果页"""
+    tree = html.fromstring(page)
+    results = []
+
+    elements = tree.xpath("//a[contains(@id, 'sogou_vr_11002601_title_')]")
+    publish_time = tree.xpath(
+        "//li[contains(@id, 'sogou_vr_11002601_box_')]/div[@class='txt-box']/div[@class='s-p']/span[@class='s2']")
+
+    for element, time_elem in zip(elements, publish_time):
+        title = element.text_content().strip()
+        link = element.get('href')
+        if link and not link.startswith('http'):
+            link = 'https://weixin.sogou.com' + link
+        results.append({
+            'title': title,
+            'link': link,
+            'publish_time': time_elem.text_content().strip()
+        })
+    return results
+
+
+def _parse_real_url(script_content: str) -> str:
+    """搜狗的跳转页通过js拼接出真实链接，从js中提取出来"""
+    start_index = script_content.find("url += '") + len("url += '")
+    url_parts = []
+    while True:
+        part_start = script_content.find("url += '", start_index)
+        if part_start == -1:
+            break
+        part_end = script_content.find("'", part_start + len("url += '"))
+        part = script_content[part_start + len("url += '"):part_end]
+        url_parts.append(part)
+        start_index = part_end + 1
+
+    full_url = ''.join(url_parts).replace("@", "")
+    return "https://mp." + full_url
+
+
+def _parse_article_content(page: str) -> str:
+    """提取公众号文章的正文"""
+    tree = html.fromstring(page)
+    content_elements = tree.xpath("//div[@id='js_content']//text()")
+    cleaned_content = [text.strip() for text in content_elements if text.strip()]
+    main_content = '\n'.join(cleaned_content)
+    return main_content
+
+
+@cache_decorator
+def sogou_weixin_search(query: str) -> List[Dict[str, str]]:
+    """在搜狗微信搜索中搜索指定关键词并返回结果列表"""
+    try:
+        response = requests.get('https://weixin.sogou.com/weixin', params=_search_params(query), headers=_search_headers(query))
+
+        if response.status_code == 200:
+            return _parse_search_results(response.text)
+        else:
+            return []
+    except Exception as e:
+        return []
+
+@cache_decorator
+def get_real_url(sogou_url: str) -> str:
+    """从搜狗微信链接获取真实的微信公众号文章链接"""
+    try:
+        response = requests.get(sogou_url, headers=REAL_URL_HEADERS)
+        return _parse_real_url(response.text)
+    except Exception as e:
+        return ""
+
+@cache_decorator
+def get_article_content(real_url: str, referer: str) -> str:
+    """获取微信公众号文章的正文内容"""
     try:
-        response = requests.get(real_url, headers=headers)
-        tree = html.fromstring(response.text)
-        content_elements = tree.xpath("//div[@id='js_content']//text()")
-        cleaned_content = [text.strip() for text in content_elements if text.strip()]
-        main_content = '\n'.join(cleaned_content)
-        return main_content
+        response = requests.get(real_url, headers=_article_headers(referer))
+        return _parse_article_content(response.text)
     except Exception as e:
         return f"获取文章内容失败: {str(e)}"
 
-def get_wechat_article(query: str, number=10):
+
+class WeixinFetcher:
     """
-    获取前10篇文章
+    异步获取微信公众号文章，一次搜索使用一个httpx连接池：
+    1. 总并发由semaphore限制，每个域名再单独限制并发
+    2. 每篇文章有单独的超时时间，超时的文章被丢弃
+    3. 整体截止时间到达后，取消未完成的请求，返回已经获取到的文章
+    方法的第一个参数是self，缓存的key会忽略它，所以结果和同步版本一样按参数缓存
     """
-    start_time = time.time()
-    results = sogou_weixin_search(query)
-    if not results:
-        return f"没有搜索到{query}相关的文章"
-    articles = []
-    results = results[:number]
-    for every_result in results:
-        sougou_link = every_result["link"]
-        real_url = get_real_url(sougou_link)
-        # referer：请求来源
-        content = get_article_content(real_url, referer=sougou_link)
-        article = {
-            "title": every_result["title"],
-            "publish_time": every_result["publish_time"],
+
+    def __init__(self, client: httpx.AsyncClient, concurrency: int = WEIXIN_FETCH_CONCURRENCY,
+                 per_host_concurrency: int = WEIXIN_PER_HOST_CONCURRENCY):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.per_host_concurrency = per_host_concurrency
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return semaphore
+
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        async with self.semaphore, self._host_semaphore(url):
+            return await self.client.get(url, **kwargs)
+
+    @async_cache_decorator
+    async def search(self, query: str) -> List[Dict[str, str]]:
+        """sogou_weixin_search的异步版本，请求失败时抛出异常，失败的结果不会被缓存"""
+        response = await self._get('https://weixin.sogou.com/weixin', params=_search_params(query), headers=_search_headers(query))
+        response.raise_for_status()
+        return _parse_search_results(response.text)
+
+    @async_cache_decorator
+    async def get_real_url(self, sogou_url: str) -> str:
+        """get_real_url的异步版本"""
+        response = await self._get(sogou_url, headers=REAL_URL_HEADERS)
+        response.raise_for_status()
+        return _parse_real_url(response.text)
+
+    @async_cache_decorator
+    async def get_article_content(self, real_url: str, referer: str) -> str:
+        """get_article_content的异步版本"""
+        response = await self._get(real_url, headers=_article_headers(referer))
+        response.raise_for_status()
+        return _parse_article_content(response.text)
+
+    async def fetch_article(self, result: Dict[str, str]) -> Dict[str, str]:
+        sougou_link = result["link"]
+        try:
+            real_url = await self.get_real_url(sougou_link)
+        except Exception as e:
+            logger.warning(f"获取真实链接失败: {sougou_link}, {e}")
+            real_url = ""
+        try:
+            # referer：请求来源
+            content = await self.get_article_content(real_url, referer=sougou_link)
+        except Exception as e:
+            content = f"获取文章内容失败: {str(e)}"
+        return {
+            "title": result["title"],
+            "publish_time": result["publish_time"],
             "real_url": real_url,
             "content": content
         }
-        articles.append(article)
+
+    async def fetch_articles(self, results: List[Dict[str, str]], article_timeout: float = WEIXIN_ARTICLE_TIMEOUT,
+                             deadline: float = WEIXIN_SEARCH_DEADLINE) -> List[Dict[str, str]]:
+        """并发获取文章，结果保持搜索结果的顺序，超时的文章被丢弃"""
+        tasks = [asyncio.create_task(asyncio.wait_for(self.fetch_article(result), article_timeout)) for result in results]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"到达截止时间{deadline}秒，{len(pending)}篇文章未获取完成，返回部分结果")
+            await asyncio.gather(*pending, return_exceptions=True)
+        articles = []
+        for result, task in zip(results, tasks):
+            if task not in done:
+                continue
+            if task.exception() is not None:
+                logger.warning(f"获取文章失败: {result['title']}, {task.exception()!r}")
+                continue
+            articles.append(task.result())
+        return articles
+
+
+async def async_get_wechat_article(query: str, number=10, article_timeout: float = WEIXIN_ARTICLE_TIMEOUT,
+                                   deadline: float = WEIXIN_SEARCH_DEADLINE) -> Union[str, List[Dict[str, str]]]:
+    """
+    get_wechat_article的异步版本，并发获取前number篇文章，耗时取决于最慢的一篇文章，最多deadline秒
+    """
+    start_time = time.time()
+    limits = httpx.Limits(max_connections=WEIXIN_FETCH_CONCURRENCY, max_keepalive_connections=WEIXIN_FETCH_CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits, timeout=article_timeout, follow_redirects=True) as client:
+        fetcher = WeixinFetcher(client)
+        try:
+            results = await fetcher.search(query)
+        except Exception as e:
+            logger.warning(f"搜狗微信搜索{query}失败: {e}")
+            results = []
+        if not results:
+            return f"没有搜索到{query}相关的文章"
+        remaining = max(0.0, deadline - (time.time() - start_time))
+        articles = await fetcher.fetch_articles(results[:number], article_timeout=article_timeout, deadline=remaining)
     end_time = time.time()
-    print(f"关键词{query}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
+    logger.info(f"关键词{query}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
     return articles
 
+
+def get_wechat_article(query: str, number=10):
+    """
+    获取前10篇文章，同步调用，不能在事件循环中使用，事件循环中请使用async_get_wechat_article
+    """
+    return asyncio.run(async_get_wechat_article(query, number))
+
 if __name__ == '__main__':
     result = get_wechat_article(query="吉利汽车",number=2)
     print(result)
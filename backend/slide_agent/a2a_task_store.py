@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 13:00
+# @File  : a2a_task_store.py
+# @Author:
+# @Desc  : A2A的任务存储：结束的任务保留一段时间后淘汰，限制内存中任务的估算大小；
+#          可选把淘汰的任务压缩后保存到SQLite，tasks/get仍然可以查到
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from a2a.server.tasks import TaskStore
+from a2a.types import Task, TaskState
+
+from slide_agent.metrics import A2A_TASK_BYTES, A2A_TASK_EVICTIONS, A2A_TASKS, register_refresher
+
+logger = logging.getLogger(__name__)
+
+# 任务结束后在内存中保留的时间（秒）
+A2A_TASK_RETENTION = float(os.environ.get("A2A_TASK_RETENTION", "600"))
+# 内存中结束的任务的估算大小上限（MB），超过后从最早结束的开始淘汰
+A2A_TASK_MAX_MB = float(os.environ.get("A2A_TASK_MAX_MB", "128"))
+# 没有结束的任务超过这个时间（秒）没有更新时认为执行器已经异常退出，直接淘汰
+A2A_TASK_STALE_TTL = float(os.environ.get("A2A_TASK_STALE_TTL", str(6 * 3600)))
+# 淘汰的任务保存到这个SQLite文件，为空表示直接丢弃
+A2A_TASK_DB_PATH = os.environ.get("A2A_TASK_DB_PATH", "")
+# 保存到SQLite的任务保留的时间（秒），默认7天
+A2A_TASK_DB_TTL = float(os.environ.get("A2A_TASK_DB_TTL", str(7 * 24 * 3600)))
+# 后台淘汰的间隔（秒）
+A2A_TASK_SWEEP_INTERVAL = float(os.environ.get("A2A_TASK_SWEEP_INTERVAL", "60"))
+
+# 进入这些状态后任务不会再变化
+TERMINAL_STATES = (TaskState.completed, TaskState.canceled, TaskState.failed, TaskState.rejected)
+
+
+def _is_finished(task: Task) -> bool:
+    return task.status is not None and task.status.state in TERMINAL_STATES
+
+
+class TaskSpillStore:
+    """
+    保存被淘汰的任务，整个任务序列化成JSON后用zlib压缩（幻灯片JSON的压缩率很高）。
+    使用WAL模式，每个线程使用自己的连接（与aippt_task_store.py相同）。
+    """
+    # 每写入多少次清理一次过期的任务
+    CLEANUP_EVERY = 100
+
+    def __init__(self, db_path: str = A2A_TASK_DB_PATH, ttl: float = A2A_TASK_DB_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS a2a_tasks (
+                    task_id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_a2a_tasks_updated_at ON a2a_tasks (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put_many(self, tasks: List[Task]) -> None:
+        now = time.time()
+        rows = [(task.id, zlib.compress(task.model_dump_json(exclude_none=True).encode("utf-8")), now)
+                for task in tasks]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR REPLACE INTO a2a_tasks (task_id, data, updated_at) VALUES (?, ?, ?)", rows)
+        self._writes += len(rows)
+        if self._writes >= self.CLEANUP_EVERY:
+            self._writes = 0
+            self.cleanup()
+
+    def get(self, task_id: str) -> Optional[Task]:
+        row = self._connect().execute(
+            "SELECT data FROM a2a_tasks WHERE task_id = ? AND updated_at >= ?",
+            (task_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return Task.model_validate_json(zlib.decompress(row[0]))
+
+    def delete(self, task_id: str) -> None:
+        self._connect().execute("DELETE FROM a2a_tasks WHERE task_id = ?", (task_id,))
+
+    def cleanup(self) -> int:
+        cursor = self._connect().execute("DELETE FROM a2a_tasks WHERE updated_at < ?", (time.time() - self.ttl,))
+        if cursor.rowcount:
+            logger.info(f"清理了{cursor.rowcount}个过期的已保存任务")
+        return cursor.rowcount
+
+
+@dataclass
+class _Entry:
+    task: Task
+    # 最后一次保存的时间(monotonic)
+    updated_at: float
+    # 结束后估算的大小，没有结束的任务还在变化，记为0
+    size: int = 0
+    finished: bool = False
+
+
+class EvictingTaskStore(TaskStore):
+    """
+    替代InMemoryTaskStore，保存的仍然是任务对象本身（TaskManager会原地修改后再保存）：
+    1. 任务进入结束状态时估算一次大小（JSON序列化后的字节数），之后不会再变化
+    2. 结束超过A2A_TASK_RETENTION秒的任务被淘汰；结束的任务总大小超过A2A_TASK_MAX_MB时，从最早结束的开始淘汰；
+       没有结束的任务只有超过A2A_TASK_STALE_TTL没有更新时才淘汰
+    3. 设置了A2A_TASK_DB_PATH时，淘汰的结束任务保存到SQLite，get在内存中找不到时从SQLite读取
+    """
+
+    def __init__(self, retention: float = A2A_TASK_RETENTION, max_bytes: int = int(A2A_TASK_MAX_MB * 1024 * 1024),
+                 stale_ttl: float = A2A_TASK_STALE_TTL, db_path: str = A2A_TASK_DB_PATH):
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.spill = TaskSpillStore(db_path) if db_path else None
+        # task_id -> _Entry，按最后一次保存的时间排序
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.finished_bytes = 0
+        self.lock = asyncio.Lock()
+        register_refresher(self._refresh_metrics)
+
+    def _refresh_metrics(self) -> None:
+        finished = sum(1 for entry in self._entries.values() if entry.finished)
+        A2A_TASKS.labels("active").set(len(self._entries) - finished)
+        A2A_TASKS.labels("finished").set(finished)
+        A2A_TASK_BYTES.set(self.finished_bytes)
+
+    async def save(self, task: Task) -> None:
+        finished = _is_finished(task)
+        # 结束的任务不会再修改，可以在线程中序列化，大任务不阻塞事件循环
+        size = await asyncio.to_thread(lambda: len(task.model_dump_json(exclude_none=True))) if finished else 0
+        async with self.lock:
+            old = self._entries.pop(task.id, None)
+            if old is not None:
+                self.finished_bytes -= old.size
+            self._entries[task.id] = _Entry(task, time.monotonic(), size, finished)
+            self.finished_bytes += size
+            victims = self._collect_victims()
+        if victims:
+            await self._spill(victims)
+
+    async def get(self, task_id: str) -> Optional[Task]:
+        async with self.lock:
+            entry = self._entries.get(task_id)
+            if entry is not None:
+                return entry.task
+        if self.spill is None:
+            return None
+        try:
+            # 从SQLite读取的任务不放回内存，再次保存时才会放回
+            return await asyncio.to_thread(self.spill.get, task_id)
+        except (sqlite3.Error, ValueError, zlib.error) as e:
+            logger.error(f"读取已保存的任务{task_id}失败: {e}")
+            return None
+
+    async def delete(self, task_id: str) -> None:
+        async with self.lock:
+            entry = self._entries.pop(task_id, None)
+            if entry is not None:
+                self.finished_bytes -= entry.size
+        if self.spill is not None:
+            await asyncio.to_thread(self.spill.delete, task_id)
+
+    def _collect_victims(self) -> List[_Entry]:
+        """在锁内调用，从内存中移除需要淘汰的任务并返回"""
+        now = time.monotonic()
+        evicted = []
+        finished_bytes = self.finished_bytes
+        # 按最后一次保存的时间排序；没有结束的任务很少（等于正在执行的请求数），跳过它们继续检查后面的
+        for task_id, entry in self._entries.items():
+            idle = now - entry.updated_at
+            if not entry.finished:
+                if idle <= self.stale_ttl:
+                    continue
+                reason = "stale"
+                logger.warning(f"任务{task_id}超过{self.stale_ttl}秒没有更新，状态: {entry.task.status.state}，淘汰")
+            elif idle > self.retention:
+                reason = "retention"
+            elif finished_bytes > self.max_bytes:
+                reason = "memory"
+            else:
+                break
+            finished_bytes -= entry.size
+            A2A_TASK_EVICTIONS.labels(reason).inc()
+            evicted.append(task_id)
+        victims = [self._entries.pop(task_id) for task_id in evicted]
+        self.finished_bytes = finished_bytes
+        return victims
+
+    async def _spill(self, victims: List[_Entry]) -> None:
+        finished = [entry.task for entry in victims if entry.finished]
+        if self.spill is not None and finished:
+            try:
+                await asyncio.to_thread(self.spill.put_many, finished)
+            except sqlite3.Error as e:
+                logger.error(f"保存{len(finished)}个被淘汰的任务失败: {e}")
+        logger.info(f"淘汰了{len(victims)}个任务，内存中还有{len(self._entries)}个，"
+                    f"结束的任务估算{self.finished_bytes / 1024 / 1024:.1f}MB")
+
+    async def evict(self) -> int:
+        """淘汰过期和超过上限的任务，返回淘汰的数量"""
+        async with self.lock:
+            victims = self._collect_victims()
+        if victims:
+            await self._spill(victims)
+        return len(victims)
+
+    async def sweep_forever(self, interval: float = A2A_TASK_SWEEP_INTERVAL) -> None:
+        """没有请求时也淘汰过期的任务"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict()
+                if self.spill is not None:
+                    await asyncio.to_thread(self.spill.cleanup)
+            except Exception as e:
+                logger.error(f"淘汰任务失败: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        """关闭服务时把内存中结束的任务保存到SQLite"""
+        if self.spill is None:
+            return
+        async with self.lock:
+            finished = [entry.task for entry in self._entries.values() if entry.finished]
+        if finished:
+            await asyncio.to_thread(self.spill.put_many, finished)
+            logger.info(f"已保存{len(finished)}个任务到{self.spill.db_path}")
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        """作为Starlette应用的lifespan：运行期间后台淘汰任务，关闭时保存结束的任务"""
+        sweeper = asyncio.create_task(self.sweep_forever())
+        try:
+            yield
+        finally:
+            sweeper.cancel()
+            await self.close()
@@ -37,8 +37,15 @@ from a2a.utils.errors import ServerError
 from a2a.utils.message import new_agent_text_message
 from google.adk.agents.base_agent import BaseAgent
 
+from log_utils import get_hot_logger, set_request_id
+from slide_agent.metrics import INFLIGHT_SESSIONS
+from trace_utils import extract_trace_context, tracer
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# 每个event的日志只在DEBUG级别按采样率输出
+hot_logger = get_hot_logger(__name__)
+# 执行器返回结果时需要用到的state
+TRACKED_STATE_KEYS = ("metadata", "references")
 
 
 def extract_agent_names(agent: BaseAgent, names=None):
@@ -52,6 +59,41 @@ def extract_agent_names(agent: BaseAgent, names=None):
         extract_agent_names(sub, names)
     return names
 
+
+class SessionStateView:
+    """
+    只跟踪执行器需要的几个state key，根据每个event的state_delta增量更新，
+    不用在每个event上调用get_session获取（并深拷贝）整个session
+    """
+
+    def __init__(self, state: dict, keys: tuple):
+        self.keys = keys
+        self.values = {key: state[key] for key in keys if key in state}
+
+    def apply(self, event: Event) -> None:
+        delta = event.actions.state_delta if event.actions else None
+        if not delta:
+            return
+        for key in self.keys:
+            if key in delta:
+                self.values[key] = delta[key]
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+
+class TracedTaskUpdater(TaskUpdater):
+    """每次向event queue发送状态或结果时记录一个span"""
+
+    async def update_status(self, *args, **kwargs):
+        with tracer.start_as_current_span("a2a.emit_status"):
+            return await super().update_status(*args, **kwargs)
+
+    async def add_artifact(self, *args, **kwargs):
+        with tracer.start_as_current_span("a2a.emit_artifact"):
+            return await super().add_artifact(*args, **kwargs)
+
+
 class ADKAgentExecutor(AgentExecutor):
     """An AgentExecutor that runs an ADK-based Agent."""
 
@@ -89,24 +131,21 @@ class ADKAgentExecutor(AgentExecutor):
         session_obj = await self._upsert_session(
             session_id,metadata
         )
-        logger.debug(f"收到请求信息: {new_message}")
+        logger.debug("收到请求信息: %s", new_message)
         # Update session_id with the ID from the resolved session object
         # to be used in self._run_agent.
         session_id = session_obj.id
+        state_view = SessionStateView(session_obj.state, TRACKED_STATE_KEYS)
         # 汇集所有的 agent 名称
-        logger.info(f"收到请求信息: {new_message}")
         agent_names = extract_agent_names(self.runner.agent)
         agent_names = list(agent_names)
         async for event in self._run_agent(session_id, new_message):
+            state_view.apply(event)
             agent_author = event.author
             if agent_author in self.show_agent:
                 logger.info(f"[adk executor] {agent_author}完成")
                 if event.content and event.content.parts:
-                    final_session = await self.runner.session_service.get_session(
-                        app_name=self.runner.app_name, user_id="self", session_id=session_id
-                    )
-                    print("最终的session中的结果final_session中的state: ", final_session.state)
-                    references = final_session.state.get("references", [])
+                    references = state_view.get("references", [])
                     # 最后一个agent的输出了，输出成status
                     await task_updater.update_status(
                         TaskState.working,
@@ -114,35 +153,30 @@ class ADKAgentExecutor(AgentExecutor):
                             convert_genai_parts_to_a2a(event.content.parts), metadata={"author": agent_author, "show": True, "references": references}
                         ),
                     )
-                    print(f"final_session中的parts: {event.content.parts}")
+                    hot_logger.debug("final_session中的parts: %s", event.content.parts)
                     # await task_updater.complete()  # 这个会关掉event的Queue
                     # break
                 else:
-                    print(f"event.content没有结果，跳过, Agent是: {agent_author}, event是: {event}")
+                    hot_logger.debug("event.content没有结果，跳过, Agent是: %s, event是: %s", agent_author, event)
                     continue
             elif not event.content or not event.content.parts:
-                print(f"event.content没有结果，跳过, Agent是: {agent_author}, event是: {event}")
+                hot_logger.debug("event.content没有结果，跳过, Agent是: %s, event是: %s", agent_author, event)
                 continue
             elif event.is_final_response():
-                final_session = await self.runner.session_service.get_session(
-                    app_name=self.runner.app_name, user_id="self", session_id=session_id
-                )
-                print("最终的session中的结果final_session中的state: ", final_session.state)
-                final_metadata = final_session.state.get("metadata")
-                references = final_session.state.get("references",[])
+                references = state_view.get("references", [])
                 agent_author = event.author
                 if agent_author in agent_names:
                     logger.info(f"[adk executor] {agent_author}完成")
                     agent_names.remove(agent_author)
                 parts = convert_genai_parts_to_a2a(event.content.parts)
-                logger.info("返回最终的结果: %s", parts)
+                logger.debug("返回最终的结果: %s", parts)
                 await task_updater.add_artifact(parts=parts,metadata={"author": agent_author, "references": references})
                 if not agent_names:
                     # 说明任务整体完成了，没有要进行其它任务的Agent了，所有Agent都完成了自己的任务
                     await task_updater.complete()  # 这个会关掉event的Queue
                     break
             elif event.get_function_calls():
-                logger.info(f"触发了工具调用。。。返回DataPart数据, {event}")
+                hot_logger.debug("触发了工具调用。。。返回DataPart数据, %s", event)
                 await task_updater.update_status(
                     TaskState.working,
                     message=task_updater.new_agent_message(
@@ -150,7 +184,7 @@ class ADKAgentExecutor(AgentExecutor):
                     ),
                 )
             elif event.get_function_responses():
-                logger.info(f"工具返回了结果。。。返回DataPart数据, {event}")
+                hot_logger.debug("工具返回了结果。。。返回DataPart数据, %s", event)
                 await task_updater.update_status(
                     TaskState.working,
                     message=task_updater.new_agent_message(
@@ -158,7 +192,7 @@ class ADKAgentExecutor(AgentExecutor):
                     ),
                 )
             else:
-                logger.info(f"其它的事件,例如数据的流事件 {event}")
+                hot_logger.debug("其它的事件,例如数据的流事件 %s", event)
                 await task_updater.update_status(
                     TaskState.working,
                     message=task_updater.new_agent_message(
@@ -171,20 +205,31 @@ class ADKAgentExecutor(AgentExecutor):
         context: RequestContext,
         event_queue: EventQueue,
     ):
-        # Run the agent until either complete or the task is suspended.
-        updater = TaskUpdater(event_queue, context.task_id, context.context_id)
-        # Immediately notify that the task is submitted.
-        if not context.current_task:
-            await updater.submit()
-        await updater.start_work()
-        await self._process_request(
-            types.UserContent(
-                parts=convert_a2a_parts_to_genai(context.message.parts),
-            ),
-            context.context_id,
-            updater,
-            metadata=context.message.metadata
-        )
+        # 使用调用方传入的request_id，日志可以和main_api中的请求关联起来
+        metadata = context.message.metadata or {}
+        request_id = set_request_id(metadata.get("request_id"))
+        # 继续调用方传入的链路，ADK内部的span（invocation、call_llm等）都挂在这个span下面
+        with tracer.start_as_current_span("a2a.execute", context=extract_trace_context(metadata),
+                                          attributes={"agent": self.runner.app_name, "request_id": request_id}):
+            # Run the agent until either complete or the task is suspended.
+            updater = TracedTaskUpdater(event_queue, context.task_id, context.context_id)
+            # Immediately notify that the task is submitted.
+            if not context.current_task:
+                await updater.submit()
+            await updater.start_work()
+            inflight = INFLIGHT_SESSIONS.labels(self.runner.app_name)
+            inflight.inc()
+            try:
+                await self._process_request(
+                    types.UserContent(
+                        parts=convert_a2a_parts_to_genai(context.message.parts),
+                    ),
+                    context.context_id,
+                    updater,
+                    metadata=context.message.metadata
+                )
+            finally:
+                inflight.dec()
         logger.info("[adk executor] Agent执行完成退出")
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue):
@@ -1,10 +1,10 @@
+import asyncio
 import logging
 import os
 import sys
+import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
-import asyncio
 
 # 添加项目根目录到Python路径
 # 获取当前文件的目录
@@ -16,55 +16,140 @@ sys.path.insert(0, backend_dir)
 
 # 从新的工具文件中导入stream_agent_response
 # from main_api.stream_utils import stream_content_response
+from main_api.slide_framing import collect_slides
 from main_api.stream_utils import stream_content_response
 from slide_agent.slide_agent.advanced_parser import parse_markdown_to_slides_advanced
+from slide_agent.aippt_task_store import AIPPT_TASK_HEARTBEAT_INTERVAL, BaseTaskStore, create_task_store
 
 logger = logging.getLogger(__name__)
 
 
+# 同时生成的PPT任务数，根据下游LLM服务的并发能力调整
+AIPPT_MAX_CONCURRENCY = int(os.environ.get("AIPPT_MAX_CONCURRENCY", "8"))
+
+
 class AIPPTTaskManager:
-    def __init__(self):
-        self._tasks: Dict[str, dict] = {}
-        self._executor = ThreadPoolExecutor(max_workers=4)
+    def __init__(self, task_store: Optional[BaseTaskStore] = None, max_concurrency: int = AIPPT_MAX_CONCURRENCY):
+        # 任务存储，完成的任务结果会按过期时间和数量上限淘汰，见aippt_task_store.py
+        # 存储定义了__len__，空的存储为假，不能用or
+        self._tasks: BaseTaskStore = task_store if task_store is not None else create_task_store()
+        # 任务直接作为asyncio.Task运行在服务的事件循环上，用信号量限制同时生成的任务数
+        self._max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._running: Dict[str, asyncio.Task] = {}
+        # 有任务在执行时定期更新心跳，并取消其它worker转发过来的取消请求
+        self._heartbeat: Optional[asyncio.Task] = None
+        # 队列指标
+        self._queued = 0
+        self._active = 0
+        self._finished = {"completed": 0, "failed": 0, "cancelled": 0}
+        self._last_queue_wait = 0.0
 
     def create_task(self) -> str:
         """生成唯一任务ID并初始化任务状态"""
         task_id = str(uuid.uuid4())
-        self._tasks[task_id] = {
+        self._tasks.set(task_id, {
             "status": "pending",
             "result": None,
             "error": None
-        }
+        })
         return task_id
 
     def start_processing(self, task_id: str, markdown_content: str, model: str = "qwen3-235b"):
-        """启动异步处理任务"""
+        """启动异步处理任务，需要在事件循环中调用"""
+        self._tasks.set(task_id, {
+            "status": "processing",
+            "result": None,
+            "error": None
+        })
+        task = asyncio.get_running_loop().create_task(self._process(task_id, markdown_content, model))
+        self._running[task_id] = task
+        task.add_done_callback(lambda _: self._running.pop(task_id, None))
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.get_running_loop().create_task(self._heartbeat_loop())
 
-        def _process():
+    async def _heartbeat_loop(self):
+        """当前进程还有任务在执行时运行：更新任务的心跳，取消在其它worker上请求取消的任务"""
+        while self._running:
+            await asyncio.sleep(AIPPT_TASK_HEARTBEAT_INTERVAL)
             try:
-                # 使用实际的PPT生成逻辑，传递模型参数
-                result = self._generate_ppt(markdown_content, model)
-                self._tasks[task_id] = {
-                    "status": "completed",
-                    "result": result,
-                    "error": None
-                }
+                cancel_ids = await asyncio.to_thread(self._tasks.heartbeat)
             except Exception as e:
-                logger.error(f"Task {task_id} failed: {str(e)}")
-                self._tasks[task_id] = {
-                    "status": "failed",
-                    "result": None,
-                    "error": str(e)
-                }
+                logger.error(f"更新任务心跳失败: {e}")
+                continue
+            for task_id in cancel_ids:
+                task = self._running.get(task_id)
+                if task is not None and not task.done():
+                    logger.info(f"Task {task_id} cancel requested by another worker")
+                    task.cancel()
 
-        self._tasks[task_id]["status"] = "processing"
-        self._executor.submit(_process)
+    async def _process(self, task_id: str, markdown_content: str, model: str):
+        submitted_at = time.monotonic()
+        acquired = False
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+            acquired = True
+            self._queued -= 1
+            self._active += 1
+            self._last_queue_wait = time.monotonic() - submitted_at
+            # 使用实际的PPT生成逻辑，传递模型参数
+            result = await self._generate_ppt(markdown_content, model)
+            self._tasks.set(task_id, {
+                "status": "completed",
+                "result": result,
+                "error": None
+            })
+            self._finished["completed"] += 1
+        except asyncio.CancelledError:
+            logger.info(f"Task {task_id} cancelled")
+            self._tasks.set(task_id, {
+                "status": "cancelled",
+                "result": None,
+                "error": "Task cancelled"
+            })
+            self._finished["cancelled"] += 1
+            raise
+        except Exception as e:
+            logger.error(f"Task {task_id} failed: {str(e)}")
+            self._tasks.set(task_id, {
+                "status": "failed",
+                "result": None,
+                "error": str(e)
+            })
+            self._finished["failed"] += 1
+        finally:
+            if acquired:
+                self._active -= 1
+                self._semaphore.release()
+            else:
+                self._queued -= 1
+
+    def cancel_task(self, task_id: str) -> bool:
+        """取消排队中或生成中的任务，任务不存在或已经结束返回False"""
+        task = self._running.get(task_id)
+        if task is not None and not task.done():
+            task.cancel()
+            return True
+        # 任务可能在其它worker中执行，通过任务存储转发取消请求
+        return self._tasks.request_cancel(task_id)
 
     def get_task_status(self, task_id: str) -> Optional[dict]:
         """获取任务状态"""
         return self._tasks.get(task_id)
 
-    def _generate_ppt(self, markdown: str, model: str = "qwen3-235b") -> dict:
+    def get_stats(self) -> dict:
+        """任务队列的指标"""
+        return {
+            "max_concurrency": self._max_concurrency,
+            "queued": self._queued,
+            "running": self._active,
+            "finished": dict(self._finished),
+            "last_queue_wait_seconds": round(self._last_queue_wait, 3),
+            "stored_tasks": len(self._tasks),
+        }
+
+    async def _generate_ppt(self, markdown: str, model: str = "qwen3-235b") -> list:
         """实际的PPT生成逻辑"""
         try:
             # 检查Markdown中是否包含@符号，如果有则使用高级解析器
@@ -73,7 +158,7 @@ class AIPPTTaskManager:
                 slide_structure = parse_markdown_to_slides_advanced(markdown)
             else:
                 # 使用流式处理来生成PPT内容
-                slide_structure = self._stream_generate_ppt(markdown)
+                slide_structure = await self._stream_generate_ppt(markdown)
 
             # 直接返回幻灯片结构，与前端PPT页面使用相同的数据结构
             return slide_structure
@@ -81,22 +166,10 @@ class AIPPTTaskManager:
             logger.error(f"PPT generation failed: {str(e)}")
             raise
 
-    def _stream_generate_ppt(self, markdown: str) -> list:
-        """通过流式处理生成PPT内容"""
-        # 收集流式响应数据
-        collected_data = []
-        
-        # 创建一个包装函数来运行异步生成器
-        async def collect_stream_data():
-            async for chunk in stream_content_response(markdown):
-                # print(f'{chunk}')
-                collected_data.append(chunk)
-        
-        # 使用asyncio.run()运行异步函数
-        # 这样可以在同步上下文中执行异步代码
-        asyncio.run(collect_stream_data())
-        
-        return collected_data
+    async def _stream_generate_ppt(self, markdown: str) -> list:
+        """通过流式处理生成PPT内容，返回幻灯片对象的列表"""
+        # 流式文本中的JSON可能被拆分到多个chunk中，按完整的JSON对象收集
+        return await collect_slides(stream_content_response(markdown))
 
 
 # 全局单例
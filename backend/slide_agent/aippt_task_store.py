@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 12:00
+# @File  : aippt_task_store.py
+# @Author:
+# @Desc  : AIPPTTaskManager的任务存储，支持内存(LRU+TTL)和SQLite两种后端，完成的任务结果会按过期时间和数量上限淘汰
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务存储的后端: memory 或 sqlite
+AIPPT_TASK_STORE = os.environ.get("AIPPT_TASK_STORE", "memory")
+# sqlite后端的数据库文件，重启后任务状态不丢失
+AIPPT_TASK_DB_PATH = os.environ.get("AIPPT_TASK_DB_PATH", "aippt_tasks.sqlite3")
+# 任务最后一次更新后保留的时间（秒）
+AIPPT_TASK_TTL = float(os.environ.get("AIPPT_TASK_TTL", "3600"))
+# 最多保留的任务数量，超过后淘汰最久没有使用的任务
+AIPPT_TASK_MAX = int(os.environ.get("AIPPT_TASK_MAX", "1000"))
+# 执行任务的进程更新心跳和检查取消请求的间隔（秒）
+AIPPT_TASK_HEARTBEAT_INTERVAL = float(os.environ.get("AIPPT_TASK_HEARTBEAT_INTERVAL", "2"))
+# 超过这个时间（秒）没有心跳的任务认为执行它的进程已经退出
+AIPPT_TASK_HEARTBEAT_TIMEOUT = float(os.environ.get("AIPPT_TASK_HEARTBEAT_TIMEOUT", "30"))
+
+# 当前进程的标识：主机名、pid和每次启动生成的id（pid可能被复用，例如容器重启后仍然是1）
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+# 还没有结束的任务状态
+ACTIVE_STATUSES = ("pending", "processing")
+
+
+class BaseTaskStore(ABC):
+    """任务存储的接口，任务记录是可以json序列化的dict: {"status": ..., "result": ..., "error": ...}"""
+
+    @abstractmethod
+    def set(self, task_id: str, record: dict) -> None:
+        """写入或覆盖一个任务记录"""
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[dict]:
+        """获取任务记录，不存在或已过期返回None"""
+
+    @abstractmethod
+    def delete(self, task_id: str) -> None:
+        """删除任务记录"""
+
+    @abstractmethod
+    def cleanup(self) -> int:
+        """淘汰过期和超过数量上限的任务，返回淘汰的数量"""
+
+    def heartbeat(self) -> List[str]:
+        """更新当前进程正在执行的任务的心跳，返回其它进程请求取消的任务id；只在当前进程内有效的存储不需要"""
+        return []
+
+    def request_cancel(self, task_id: str) -> bool:
+        """请求取消不在当前进程中执行的任务，由执行任务的进程在heartbeat时取消；返回任务是否还没有结束"""
+        return False
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class MemoryTaskStore(BaseTaskStore):
+    """内存中的LRU + TTL任务存储，只在当前进程内有效"""
+
+    def __init__(self, max_tasks: int = AIPPT_TASK_MAX, ttl: float = AIPPT_TASK_TTL):
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        # task_id -> (更新时间, 任务记录)，按最近使用排序
+        self._tasks: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, task_id: str, record: dict) -> None:
+        with self._lock:
+            self._tasks[task_id] = (time.time(), record)
+            self._tasks.move_to_end(task_id)
+            while len(self._tasks) > self.max_tasks:
+                evicted_id, _ = self._tasks.popitem(last=False)
+                logger.info(f"任务数量超过上限{self.max_tasks}，淘汰任务: {evicted_id}")
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            item = self._tasks.get(task_id)
+            if item is None:
+                return None
+            updated_at, record = item
+            if time.time() - updated_at > self.ttl:
+                del self._tasks[task_id]
+                return None
+            self._tasks.move_to_end(task_id)
+            return record
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def cleanup(self) -> int:
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [task_id for task_id, (updated_at, _) in self._tasks.items() if updated_at < deadline]
+            for task_id in expired:
+                del self._tasks[task_id]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+class SQLiteTaskStore(BaseTaskStore):
+    """
+    SQLite任务存储，重启后任务状态不丢失，多个uvicorn worker可以共享同一个数据库文件：
+    1. 排队中和生成中的任务记录执行它的进程(OWNER_ID)和心跳时间，执行任务的进程定期更新心跳
+    2. 进程退出后它的任务不再有心跳，其它进程启动或查询任务时把这些任务标记为失败，
+       不会影响其它还在运行的worker的任务
+    3. 取消请求写入数据库，由执行任务的进程在更新心跳时读取后取消
+    使用WAL模式，读写互不阻塞；每个线程使用自己的连接。
+    """
+    # 每写入多少次做一次淘汰
+    CLEANUP_EVERY = 100
+
+    def __init__(self, db_path: str = AIPPT_TASK_DB_PATH, max_tasks: int = AIPPT_TASK_MAX, ttl: float = AIPPT_TASK_TTL,
+                 heartbeat_timeout: float = AIPPT_TASK_HEARTBEAT_TIMEOUT):
+        self.db_path = db_path
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self.heartbeat_timeout = heartbeat_timeout
+        self._local = threading.local()
+        self._writes = 0
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS aippt_tasks (
+                    task_id TEXT PRIMARY KEY,
+                    record TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # 旧版本创建的表没有这些列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(aippt_tasks)")}
+            for column, definition in (("status", "TEXT"), ("owner", "TEXT"), ("heartbeat_at", "REAL"),
+                                       ("cancel_requested", "INTEGER NOT NULL DEFAULT 0")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE aippt_tasks ADD COLUMN {column} {definition}")
+            if "status" not in columns:
+                conn.execute("UPDATE aippt_tasks SET status = json_extract(record, '$.status')")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_aippt_tasks_updated_at ON aippt_tasks (updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_aippt_tasks_owner ON aippt_tasks (owner, status)")
+        self.cleanup()
+        self.fail_orphaned()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def set(self, task_id: str, record: dict) -> None:
+        # 任务只由创建它的进程写入，写入时记录执行任务的进程；已经请求的取消保留
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO aippt_tasks (task_id, record, updated_at, status, owner, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(task_id) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at, "
+            "status = excluded.status, owner = excluded.owner, heartbeat_at = excluded.heartbeat_at",
+            (task_id, json.dumps(record, ensure_ascii=False), now, record.get("status"), OWNER_ID, now),
+        )
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            self.cleanup()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT record, status, owner, heartbeat_at FROM aippt_tasks WHERE task_id = ? AND updated_at >= ?",
+            (task_id, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        record, status, owner, heartbeat_at = row
+        if status in ACTIVE_STATUSES and self._owner_gone(owner, heartbeat_at, time.time()):
+            # 执行任务的进程已经退出，标记为失败后重新读取
+            self.fail_orphaned(task_id)
+            row = self._connect().execute("SELECT record FROM aippt_tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            record = row[0]
+        return json.loads(record)
+
+    def delete(self, task_id: str) -> None:
+        self._connect().execute("DELETE FROM aippt_tasks WHERE task_id = ?", (task_id,))
+
+    def heartbeat(self) -> List[str]:
+        conn = self._connect()
+        placeholders = ",".join("?" * len(ACTIVE_STATUSES))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"UPDATE aippt_tasks SET heartbeat_at = ? WHERE owner = ? AND status IN ({placeholders})",
+                         (time.time(), OWNER_ID, *ACTIVE_STATUSES))
+            rows = conn.execute(
+                f"SELECT task_id FROM aippt_tasks WHERE owner = ? AND status IN ({placeholders}) AND cancel_requested = 1",
+                (OWNER_ID, *ACTIVE_STATUSES)).fetchall()
+        return [row[0] for row in rows]
+
+    def request_cancel(self, task_id: str) -> bool:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT record, status, owner, heartbeat_at FROM aippt_tasks WHERE task_id = ?",
+                               (task_id,)).fetchone()
+            if row is None or row[1] not in ACTIVE_STATUSES:
+                return False
+            record, _, owner, heartbeat_at = row
+            if self._owner_gone(owner, heartbeat_at, now):
+                # 没有进程在执行这个任务，直接标记为已取消
+                record = json.loads(record)
+                record.update(status="cancelled", result=None, error="Task cancelled")
+                conn.execute("UPDATE aippt_tasks SET record = ?, status = ?, updated_at = ? WHERE task_id = ?",
+                             (json.dumps(record, ensure_ascii=False), "cancelled", now, task_id))
+            else:
+                conn.execute("UPDATE aippt_tasks SET cancel_requested = 1 WHERE task_id = ?", (task_id,))
+        return True
+
+    def _owner_gone(self, owner: Optional[str], heartbeat_at: Optional[float], now: float) -> bool:
+        """执行任务的进程是否已经退出：心跳超时，或者同一台机器上的进程已经不存在"""
+        if not owner or heartbeat_at is None:
+            # 旧版本写入的任务没有记录进程
+            return True
+        if owner == OWNER_ID:
+            return False
+        if now - heartbeat_at > self.heartbeat_timeout:
+            return True
+        host, pid, _ = owner.rsplit(":", 2)
+        if host != socket.gethostname():
+            return False
+        if int(pid) == os.getpid():
+            # pid相同但启动id不同，是重启之前的进程（例如容器重启后pid仍然是1）
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def fail_orphaned(self, task_id: Optional[str] = None) -> int:
+        """
+        把执行进程已经退出的排队中或生成中的任务标记为失败，否则前端会一直轮询到任务过期；
+        启动时检查所有任务，查询时只检查这个任务
+        """
+        conn = self._connect()
+        now = time.time()
+        updated = 0
+        placeholders = ",".join("?" * len(ACTIVE_STATUSES))
+        sql = f"SELECT task_id, record, owner, heartbeat_at FROM aippt_tasks WHERE status IN ({placeholders})"
+        params = list(ACTIVE_STATUSES)
+        if task_id is not None:
+            sql += " AND task_id = ?"
+            params.append(task_id)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for orphan_id, record, owner, heartbeat_at in conn.execute(sql, params).fetchall():
+                if not self._owner_gone(owner, heartbeat_at, now):
+                    continue
+                record = json.loads(record)
+                record.update(status="failed", result=None, error="执行任务的服务进程已经退出，请重新提交")
+                conn.execute("UPDATE aippt_tasks SET record = ?, status = ?, updated_at = ? WHERE task_id = ?",
+                             (json.dumps(record, ensure_ascii=False), "failed", now, orphan_id))
+                updated += 1
+        if updated:
+            logger.warning(f"{updated}个任务的执行进程已经退出，已标记为失败")
+        return updated
+
+    def cleanup(self) -> int:
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM aippt_tasks WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM aippt_tasks WHERE task_id IN ("
+            "SELECT task_id FROM aippt_tasks ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_tasks,),
+        ).rowcount
+        if removed:
+            logger.info(f"淘汰了{removed}个过期或超过数量上限的任务")
+        return removed
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM aippt_tasks").fetchone()[0]
+
+
+def create_task_store(backend: str = AIPPT_TASK_STORE) -> BaseTaskStore:
+    """根据配置创建任务存储"""
+    if backend == "memory":
+        return MemoryTaskStore()
+    elif backend == "sqlite":
+        logger.info(f"使用SQLite任务存储: {AIPPT_TASK_DB_PATH}")
+        return SQLiteTaskStore()
+    else:
+        raise ValueError(f"Unsupported task store: {backend}")
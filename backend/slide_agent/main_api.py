@@ -1,18 +1,15 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 load_dotenv()
+from log_utils import setup_logging
+from trace_utils import setup_tracing
 logfile = os.path.join("api.log")
-# 日志的格式
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(name)s -  %(message)s',
-    datefmt='%Y/%m/%d %H:%M:%S',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler(logfile, mode='w', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# 日志的格式和级别见log_utils.py，通过环境变量LOG_LEVEL、LOG_FORMAT、LOG_SAMPLE_RATE配置
+setup_logging(logfile=logfile)
+# 链路追踪，通过环境变量TRACE_EXPORTER开启，见trace_utils.py
+setup_tracing("slide_agent")
 logger = logging.getLogger(__name__)
 
 import click
@@ -21,12 +18,10 @@ from adk_agent_executor import ADKAgentExecutor
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from starlette.routing import Route
 from google.adk.agents.run_config import RunConfig,StreamingMode
 from a2a.server.apps import A2AStarletteApplication
 from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
 from starlette.middleware.cors import CORSMiddleware
 from a2a.types import (
     AgentCapabilities,
@@ -34,6 +29,9 @@ from a2a.types import (
     AgentSkill,
 )
 from slide_agent.agent import root_agent
+from slide_agent.metrics import metrics_endpoint
+from session_service import BoundedSessionService
+from a2a_task_store import EvictingTaskStore
 
 @click.command()
 @click.option("--host", "host", default="localhost", help="服务器绑定的主机名（默认为 localhost,可以指定具体本机ip）")
@@ -67,11 +65,13 @@ def main(host, port, agent_url=""):
         skills=[skill],
     )
     # mcptools = load_mcp_tools(mcp_config_path=mcp_config_path)
+    # 会话按TTL和LRU淘汰，限制内存占用，见session_service.py
+    session_service = BoundedSessionService()
     runner = Runner(
         app_name=agent_card.name,
         agent=root_agent,
         artifact_service=InMemoryArtifactService(),
-        session_service=InMemorySessionService(),
+        session_service=session_service,
         memory_service=InMemoryMemoryService(),
     )
 
@@ -90,9 +90,12 @@ def main(host, port, agent_url=""):
         )
     agent_executor = ADKAgentExecutor(runner, agent_card, run_config, show_agent)
 
+    # 结束的任务保留一段时间后淘汰，限制内存占用，见a2a_task_store.py
+    task_store = EvictingTaskStore()
+
     # 初始化请求处理器
     request_handler = DefaultRequestHandler(
-        agent_executor=agent_executor, task_store=InMemoryTaskStore()
+        agent_executor=agent_executor, task_store=task_store
     )
 
     # 构建A2A应用
@@ -100,7 +103,15 @@ def main(host, port, agent_url=""):
         agent_card=agent_card, http_handler=request_handler
     )
 
-    app = a2a_app.build()
+    @asynccontextmanager
+    async def lifespan(app):
+        # 后台淘汰过期的会话和任务，关闭时保存
+        async with session_service.lifespan(app), task_store.lifespan(app):
+            yield
+
+    app = a2a_app.build(lifespan=lifespan)
+    # Prometheus指标
+    app.routes.append(Route("/metrics", metrics_endpoint, methods=["GET"]))
     # CORS
     app.add_middleware(
         CORSMiddleware,
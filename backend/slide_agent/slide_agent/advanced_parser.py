@@ -8,148 +8,219 @@
 
 import json
 import re
+from typing import Dict, List, Optional
 
-def parse_markdown_to_slides_advanced(markdown_text):
+DEFAULT_COVER_TEXT = "A presentation generated by AI"
+
+
+class StreamingOutlineParser:
     """
-    高级解析Markdown文本为幻灯片结构，支持从Markdown中提取详细内容说明
-    约定：
-    1. # 标题下的 @ 开头文本为章节详细说明
-    2. - 列表项后的 @ 开头文本为项目详细说明
-    3. 根据标题层级不同，@文本对应不同的type
-    
-    :param markdown_text: Markdown文本
-    :return: 幻灯片结构列表
+    单遍、增量的Markdown大纲解析器，结果与parse_markdown_to_slides_advanced完全一致。
+    每一行只处理一次，章节/项目的@描述通过"正在查找描述的章节/项目"状态获得，不再向后扫描，解析耗时和大纲长度成正比。
+
+    流式用法：大纲边生成边feed，feed返回已经确定的幻灯片[{"index": 最终位置, "slide": 幻灯片}]：
+    1. 封面在找到描述（或遇到下一个标题）后返回
+    2. 过渡页在找到章节描述后返回，内容页在下一个##/###标题出现时返回；封面和第一个##章节出现之前无法确定页码，先缓存
+    3. 目录页和结束页依赖全部章节，在close时返回
+    章节标题重复时，过渡页的描述以最后一个有描述的同名章节为准（与一次性解析相同），
+    close会重新返回这些内容有变化的页，调用方按index覆盖即可。
     """
-    slides = []
-    lines = markdown_text.strip().split('\n')
-    
-    # 预处理：将连续的@行合并为段落
-    processed_lines = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
+
+    def __init__(self):
+        self._buffer = ""
+        # 连续的@行先缓存，遇到非@行时合并为一行
+        self._pending_descriptions: Optional[List[str]] = None
+        self._closed = False
+        # 封面
+        self._cover_title: Optional[str] = None
+        self._cover_description = ""
+        self._cover_open = False
+        # 目录和章节描述
+        self._sections: List[str] = []
+        self._section_descriptions: Dict[str, str] = {}
+        # 正在查找描述的章节
+        self._open_section: Optional[str] = None
+        # 正文（过渡页和内容页），过渡页的text在close时根据章节描述生成
+        self._body: List[dict] = []
+        # 还在查找描述的过渡页在_body中的位置
+        self._open_transition: Optional[int] = None
+        self._current_subsection_title = ""
+        self._current_items: List[str] = []
+        self._current_item_descriptions: Dict[str, str] = {}
+        # 正在查找描述的项目
+        self._open_item: Optional[str] = None
+        # 已经返回的幻灯片 index -> slide
+        self._emitted: Dict[int, dict] = {}
+        self._cover_emitted = False
+        # 下一个要返回的正文页在_body中的位置
+        self._next_body = 0
+        self.slides: List[dict] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        """输入一段文本（可以是不完整的行），返回新确定的幻灯片"""
+        if self._closed:
+            raise RuntimeError("parser is closed")
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            self._feed_line(line.strip())
+        return self._collect()
+
+    def close(self) -> List[dict]:
+        """大纲结束，返回剩余的幻灯片和内容有变化的幻灯片，完整结果在self.slides中"""
+        if self._closed:
+            return []
+        self._feed_line(self._buffer.strip())
+        self._buffer = ""
+        self._flush_descriptions()
+        self._closed = True
+        # 到达结尾，所有查找描述的状态结束
+        self._cover_open = False
+        self._open_section = None
+        self._open_transition = None
+        self._open_item = None
+        self._flush_subsection()
+
+        slides = []
+        if self._cover_title is not None:
+            slides.append(self._cover_slide())
+        if self._sections:
+            slides.append({"type": "contents", "data": {"items": list(self._sections)}})
+        slides.extend(self._body_slide(entry) for entry in self._body)
+        slides.append({"type": "end"})
+        self.slides = slides
+
+        changed = []
+        for index, slide in enumerate(slides):
+            if self._emitted.get(index) != slide:
+                changed.append({"index": index, "slide": slide})
+                self._emitted[index] = slide
+        return changed
+
+    def _feed_line(self, line: str) -> None:
         if line.startswith('@'):
+            if self._pending_descriptions is None:
+                self._pending_descriptions = []
+            self._pending_descriptions.append(line[1:].strip())  # 去掉@符号
+            return
+        self._flush_descriptions()
+        self._process_line(line)
+
+    def _flush_descriptions(self) -> None:
+        if self._pending_descriptions is not None:
             # 合并连续的@行
-            description_lines = []
-            while i < len(lines) and lines[i].strip().startswith('@'):
-                description_lines.append(lines[i].strip()[1:].strip())  # 去掉@符号
-                i += 1
-            processed_lines.append('@' + ' '.join(description_lines))
-            continue
-        else:
-            processed_lines.append(line)
-            i += 1
-    
-    lines = processed_lines
+            line = '@' + ' '.join(self._pending_descriptions)
+            self._pending_descriptions = None
+            self._process_line(line)
+
+    def _process_line(self, line: str) -> None:
+        is_heading = line.startswith('#')
+        description = line[1:].strip() if line.startswith('@') else None
+
+        # 封面描述：封面标题之后、下一个标题之前的第一个@行
+        if self._cover_open:
+            if is_heading:
+                self._cover_open = False
+            elif description is not None:
+                self._cover_description = description
+                self._cover_open = False
+        # 章节描述：##标题之后、下一个标题之前的第一个@行
+        if self._open_section is not None:
+            if is_heading:
+                self._open_section = None
+                self._open_transition = None
+            elif description is not None:
+                self._section_descriptions[self._open_section] = description
+                self._open_section = None
+                self._open_transition = None
+        # 项目描述：- 项目之后、下一个项目或标题之前的第一个@行
+        if self._open_item is not None:
+            if is_heading or line.startswith('-'):
+                self._open_item = None
+            elif description is not None:
+                self._current_item_descriptions[self._open_item] = description
+                self._open_item = None
 
-    # Find title and its description
-    main_title = ""
-    main_description = ""
-    for i, line in enumerate(lines):
         if line.startswith('# '):
-            main_title = line[2:].strip()
-            # 查找下一个@行作为描述
-            j = i + 1
-            while j < len(lines):
-                if lines[j].startswith('#'):
-                    break
-                if lines[j].startswith('@'):
-                    main_description = lines[j][1:].strip()  # 去掉@符号
-                    break
-                j += 1
-            slides.append({"type": "cover", "data": {"title": main_title, "text": main_description if main_description else "A presentation generated by AI"}})
-            break
-
-    # Find sections for contents page
-    sections = []
-    section_descriptions = {}  # 存储章节描述
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.startswith('## '):
+            if self._cover_title is None:
+                self._cover_title = line[2:].strip()
+                self._cover_open = True
+        elif line.startswith('## '):
             section_title = line[3:].strip()
-            sections.append(section_title)
-            # 查找该章节的描述
-            j = i + 1
-            while j < len(lines):
-                if lines[j].startswith('##') or lines[j].startswith('#'):
-                    break
-                if lines[j].startswith('@'):
-                    section_descriptions[section_title] = lines[j][1:].strip()  # 去掉@符号
-                    break
-                j += 1
-        i += 1
-        
-    if sections:
-        slides.append({"type": "contents", "data": {"items": sections}})
-
-    # Process each section and its subsections
-    current_section_title = ""
-    current_subsection_title = ""
-    current_items = []
-    current_item_descriptions = {}  # 存储项目描述
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('## '):
-            # 处理上一个子章节
-            if current_subsection_title:
-                slide_items = []
-                for item in current_items:
-                    slide_items.append({
-                        "title": item, 
-                        "text": current_item_descriptions.get(item, f"Detailed content about {item}")
-                    })
-                slides.append({"type": "content", "data": {"title": current_subsection_title, "items": slide_items}})
-                current_items = []
-                current_item_descriptions = {}
-
-            current_section_title = line[3:].strip()
-            current_subsection_title = ""
+            self._flush_subsection()
+            self._sections.append(section_title)
+            self._open_section = section_title
+            self._current_subsection_title = ""
             # 添加过渡页，使用章节描述（如果有的话）
-            transition_text = section_descriptions.get(current_section_title, f"Exploring the topic of {current_section_title}")
-            slides.append({"type": "transition", "data": {"title": current_section_title, "text": transition_text}})
+            self._body.append({"type": "transition", "title": section_title})
+            self._open_transition = len(self._body) - 1
         elif line.startswith('### '):
-            # 处理上一个子章节
-            if current_subsection_title:
-                slide_items = []
-                for item in current_items:
-                    slide_items.append({
-                        "title": item, 
-                        "text": current_item_descriptions.get(item, f"Detailed content about {item}")
-                    })
-                slides.append({"type": "content", "data": {"title": current_subsection_title, "items": slide_items}})
-                current_items = []
-                current_item_descriptions = {}
-            current_subsection_title = line[4:].strip()
+            self._flush_subsection()
+            self._current_subsection_title = line[4:].strip()
         elif line.startswith('- '):
-            if current_subsection_title:
+            if self._current_subsection_title:
                 item_title = line[2:].strip()
-                current_items.append(item_title)
-                # 查找该项目的描述
-                j = i + 1
-                while j < len(lines):
-                    if lines[j].startswith('-') or lines[j].startswith('#'):
-                        break
-                    if lines[j].startswith('@'):
-                        current_item_descriptions[item_title] = lines[j][1:].strip()  # 去掉@符号
-                        break
-                    j += 1
-        i += 1
-
-    # 处理最后一个子章节
-    if current_subsection_title:
-        slide_items = []
-        for item in current_items:
-            slide_items.append({
-                "title": item, 
-                "text": current_item_descriptions.get(item, f"Detailed content about {item}")
-            })
-        slides.append({"type": "content", "data": {"title": current_subsection_title, "items": slide_items}})
-
-    slides.append({"type": "end"})
-    return slides
+                self._current_items.append(item_title)
+                self._open_item = item_title
+
+    def _flush_subsection(self) -> None:
+        """处理上一个子章节，生成内容页"""
+        if self._current_subsection_title:
+            slide_items = []
+            for item in self._current_items:
+                slide_items.append({
+                    "title": item,
+                    "text": self._current_item_descriptions.get(item, f"Detailed content about {item}")
+                })
+            self._body.append({"type": "content", "slide": {"type": "content", "data": {"title": self._current_subsection_title, "items": slide_items}}})
+            self._current_items = []
+            self._current_item_descriptions = {}
+            self._open_item = None
+        self._current_subsection_title = ""
+
+    def _cover_slide(self) -> dict:
+        return {"type": "cover", "data": {"title": self._cover_title, "text": self._cover_description if self._cover_description else DEFAULT_COVER_TEXT}}
+
+    def _body_slide(self, entry: dict) -> dict:
+        if entry["type"] == "transition":
+            title = entry["title"]
+            transition_text = self._section_descriptions.get(title, f"Exploring the topic of {title}")
+            return {"type": "transition", "data": {"title": title, "text": transition_text}}
+        return entry["slide"]
+
+    def _collect(self) -> List[dict]:
+        """返回已经确定内容和位置的幻灯片"""
+        ready = []
+        if self._cover_title is not None and not self._cover_open and not self._cover_emitted:
+            self._cover_emitted = True
+            self._emitted[0] = self._cover_slide()
+            ready.append({"index": 0, "slide": self._emitted[0]})
+        # 封面和目录页出现之前无法确定正文的页码（###下的内容页可以出现在任何##之前）
+        if self._cover_title is None or not self._sections:
+            return ready
+        while self._next_body < len(self._body) and self._next_body != self._open_transition:
+            index = 2 + self._next_body
+            self._emitted[index] = self._body_slide(self._body[self._next_body])
+            ready.append({"index": index, "slide": self._emitted[index]})
+            self._next_body += 1
+        return ready
+
+
+def parse_markdown_to_slides_advanced(markdown_text):
+    """
+    高级解析Markdown文本为幻灯片结构，支持从Markdown中提取详细内容说明
+    约定：
+    1. # 标题下的 @ 开头文本为章节详细说明
+    2. - 列表项后的 @ 开头文本为项目详细说明
+    3. 根据标题层级不同，@文本对应不同的type
+    
+    :param markdown_text: Markdown文本
+    :return: 幻灯片结构列表
+    """
+    parser = StreamingOutlineParser()
+    parser.feed(markdown_text.strip())
+    parser.close()
+    return parser.slides
 
 if __name__ == '__main__':
     # 测试示例
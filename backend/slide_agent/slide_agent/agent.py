@@ -4,7 +4,7 @@ from google.adk.agents.sequential_agent import SequentialAgent
 from google.genai import types  # 用于在回调里短路并给用户返回消息
 
 from .advanced_parser import parse_markdown_to_slides_advanced
-from .sub_agents.ppt_writer.agent import ppt_generator_loop_agent
+from .sub_agents.ppt_writer.agent import ppt_generator_agent
 # from .utils import parse_markdown_to_slides  # 复用你已有的解析函数
 # 在模块顶部加载环境变量
 load_dotenv('.env')
@@ -47,6 +47,8 @@ def before_agent_callback(callback_context: CallbackContext):
     2) 校验 + 解析为 JSON（slides 结构）
     3) 成功：写入 state['metadata']['outline_json']，继续执行
        失败：直接返回错误信息，短路后续 Agent 执行
+    如果metadata中已经带有outline_json（main_api的流水线接口逐页调用），直接使用它
+    
     """
     state = callback_context.state
     metadata = state.get("metadata") or {}
@@ -57,6 +59,13 @@ def before_agent_callback(callback_context: CallbackContext):
 
 
     md_content = _get_markdown_from_context(callback_context)
+    outline_json = metadata.get("outline_json")
+    if isinstance(outline_json, list) and outline_json:
+        # 流水线模式：调用方已经增量解析好了大纲，只传入需要生成的页，不再解析Markdown
+        state["outline_json"] = outline_json
+        state["slides_plan_num"] = len(outline_json)
+        state["makrdown"] = md_content
+        return None
     if not md_content or not _is_valid_outline(md_content):
         # 解析前的快速校验失败：直接告诉用户不合法并短路
         return types.Content(
@@ -77,13 +86,13 @@ def before_agent_callback(callback_context: CallbackContext):
     state["outline_json"] = slides
     state["slides_plan_num"] = len(slides)
     state["makrdown"] = md_content
-    # 返回 None 继续执行后续 Agent: ppt_generator_loop_agent
+    # 返回 None 继续执行后续 Agent: ppt_generator_agent
     return None
 
 
 root_agent = SequentialAgent(
     name="WritingSystemAgent",
     description="多Agent写作系统的总协调器",
-    sub_agents=[ppt_generator_loop_agent],
+    sub_agents=[ppt_generator_agent],
     before_agent_callback=before_agent_callback
 )
@@ -41,4 +41,27 @@ PPT_CHECKER_AGENT_CONFIG = {
     # "model": "deepseek-chat",
     "provider": "local_openai",
     "model": "qwen3-235b",
-}
\ No newline at end of file
+}
+# PPT每页内容的生成方式
+PPT_GENERATE_CONFIG = {
+    # "loop": 逐页串行生成（PPTGeneratorLoopAgent）; "parallel": 多页并发生成，按页码顺序输出
+    "mode": "parallel",
+    # 并发模式下，同时调用LLM生成的最大页数，根据LLM服务的限流情况调整
+    "max_concurrency": 5,
+    # 并发模式下，每页最多调用几次LLM，都失败时这一页输出错误记录{"status": "error", "code": "SLIDE_GENERATION_FAILED", "slide_error": true, ...}
+    "max_attempts": 3,
+    # 第一次重试前等待的秒数，之后每次翻倍
+    "retry_backoff": 1.0,
+}
+# 每页幻灯片生成结果的缓存，key是这一页的prompt（包含prompt模板和这一页的json）、模型和provider，
+# 相同的页（例如结束页、重新生成只修改了一个章节的PPT）直接使用缓存的结果，不再调用LLM
+SLIDE_CACHE_CONFIG = {
+    "enabled": True,
+    # 缓存文件名的前缀，缓存目录由环境变量CACHE_PATH指定
+    "name": "slide_cache",
+    # 缓存的有效期（秒）
+    "ttl": 7 * 24 * 3600,
+    # 缓存的最大字节数和最大页数，超过后淘汰最久没有使用的页
+    "max_bytes": 256 * 1024 * 1024,
+    "max_entries": 20000,
+}
@@ -1,27 +1,87 @@
+import asyncio
+import contextvars
+import hashlib
+import inspect
+import json
 import logging
-from typing import List, AsyncGenerator, Optional
+import time
+from typing import List, AsyncGenerator, Optional, Tuple
 
-from google.adk.agents import LoopAgent  # Import LoopAgent and BaseAgent
+from google.adk.agents import BaseAgent, LoopAgent  # Import LoopAgent and BaseAgent
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.agents.invocation_context import InvocationContext
 from google.adk.agents.llm_agent import LlmAgent  # Renamed Agent to LlmAgent for clarity/convention
 from google.adk.events import Event, EventActions
 from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+from opentelemetry import trace
 
 from . import prompt
-from ...config import PPT_WRITER_AGENT_CONFIG
+from .cache_utils import CacheStore
+from ...config import PPT_WRITER_AGENT_CONFIG, PPT_GENERATE_CONFIG, SLIDE_CACHE_CONFIG
 from ...create_model import create_model
+from ...material_index import format_references, search_materials, slide_query
+from ...metrics import SLIDE_LATENCY, observe_llm_call
 
 logger = logging.getLogger(__name__)
+# span的配置见adk_agent_executor同级的trace_utils.py
+tracer = trace.get_tracer("aippt")
+
+# 每页幻灯片的生成结果缓存，多个进程共享同一个缓存目录
+slide_cache: Optional[CacheStore] = None
+if SLIDE_CACHE_CONFIG.get("enabled"):
+    slide_cache = CacheStore(
+        name=SLIDE_CACHE_CONFIG.get("name", "slide_cache"),
+        max_bytes=SLIDE_CACHE_CONFIG.get("max_bytes", 256 * 1024 * 1024),
+        max_entries=SLIDE_CACHE_CONFIG.get("max_entries", 20000),
+        ttl=SLIDE_CACHE_CONFIG.get("ttl", 7 * 24 * 3600),
+    )
+# before_model_callback未命中缓存时记录这次调用的缓存key，after_model_callback用它保存结果。
+# 并发模式下每页在自己的task中生成，contextvar不会互相覆盖
+_slide_cache_key: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("slide_cache_key", default=None)
+# 没有命中缓存时记录LLM调用的开始时间，after_model_callback统计耗时
+_llm_start: contextvars.ContextVar[float] = contextvars.ContextVar("llm_start", default=0.0)
+# 并发模式下正在构造请求的页(页码, schema)，_get_dynamic_instruction优先使用它，而不是session中的current_slide_index
+_current_slide: contextvars.ContextVar[Optional[Tuple[int, dict]]] = contextvars.ContextVar("current_slide", default=None)
+# 这些类型的页面会检索用户上传的资料
+MATERIAL_SLIDE_TYPES = ("content", "transition")
+# 并发模式下单页重试后仍然失败时，这一页输出的错误记录的错误码
+SLIDE_ERROR_CODE = "SLIDE_GENERATION_FAILED"
+
+
+def slide_cache_key(llm_request: LlmRequest) -> Optional[str]:
+    """根据这一页的prompt（prompt模板+这一页的json）、模型和provider计算缓存key"""
+    system_instruction = llm_request.config.system_instruction if llm_request.config else None
+    if not isinstance(system_instruction, str) or not system_instruction:
+        return None
+    key = json.dumps([system_instruction, llm_request.model, PPT_WRITER_AGENT_CONFIG["provider"]], ensure_ascii=False)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
 def my_before_model_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
     # 1. 检查用户输入
     agent_name = callback_context.agent_name
     history_length = len(llm_request.contents)
     metadata = callback_context.state.get("metadata")
-    print(f"调用了{agent_name}模型前的callback, 现在Agent共有{history_length}条历史记录,metadata数据为：{metadata}")
-    logger.info(f"调用了{agent_name}模型前的callback, 现在Agent共有{history_length}条历史记录,metadata数据为：{metadata}")
+    logger.debug("调用了%s模型前的callback, 现在Agent共有%s条历史记录,metadata数据为：%s", agent_name, history_length, metadata)
     #清空contents,不需要上一步的拆分topic的记录, 不能在这里清理，否则，每次调用工具都会清除记忆，白操作了
     # llm_request.contents.clear()
+    _slide_cache_key.set(None)
+    if slide_cache is not None:
+        try:
+            cache_key = slide_cache_key(llm_request)
+            # metadata中usecache为False时不读缓存，重新生成，新的结果仍然会写入缓存
+            usecache = not (isinstance(metadata, dict) and metadata.get("usecache") is False)
+            if cache_key and usecache:
+                hit, slide_text = slide_cache.get(cache_key)
+                if hit:
+                    logger.info(f"{agent_name}命中幻灯片缓存: {cache_key[:12]}")
+                    # 返回缓存的结果，跳过LLM调用
+                    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=slide_text)]))
+            _slide_cache_key.set(cache_key)
+        except Exception as e:
+            logger.warning(f"读取幻灯片缓存失败: {e}")
+    _llm_start.set(time.monotonic())
     # 返回 None，继续调用 LLM
     return None
 def my_after_model_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
@@ -33,6 +93,19 @@ def my_after_model_callback(callback_context: CallbackContext, llm_response: Llm
         part_text = one_part.text
         if part_text is not None:
             part_texts.append(part_text)
+    start = _llm_start.get()
+    if start and not llm_response.partial:
+        observe_llm_call(agent_name, PPT_WRITER_AGENT_CONFIG["provider"], PPT_WRITER_AGENT_CONFIG["model"],
+                         time.monotonic() - start, llm_response.usage_metadata)
+        _llm_start.set(0.0)
+    cache_key = _slide_cache_key.get()
+    # 只缓存完整的、没有报错的回复，流式模式下的中间token不缓存
+    if slide_cache is not None and cache_key and part_texts and not llm_response.partial and not llm_response.error_code:
+        try:
+            slide_cache.set(cache_key, "\n".join(part_texts))
+            _slide_cache_key.set(None)
+        except Exception as e:
+            logger.warning(f"写入幻灯片缓存失败: {e}")
     # part_text_content = "\n".join(part_texts)
     # metadata = callback_context.state.get("metadata")
     # logger.info(f"调用了{agent_name}模型后的callback, 这次模型回复{response_parts}条信息,metadata数据为：{metadata},回复内容是: {part_text_content}")
@@ -70,7 +143,30 @@ def my_after_agent_callback(callback_context: CallbackContext) -> None:
 
     # 更新会话状态
     callback_context.state["generated_slides_content"] = all_generated_slides_content
-    print(f"--- Stored content for slide {callback_context.state.get('current_slide_index', 0) + 1} ---")
+    logger.debug("--- Stored content for slide %s ---", callback_context.state.get('current_slide_index', 0) + 1)
+
+
+def _user_id(state) -> str:
+    metadata = state.get("metadata")
+    return metadata.get("user_id", "") if isinstance(metadata, dict) else ""
+
+
+def build_slide_instruction(slide_index: int, slide_schema: dict, user_id: str = "") -> str:
+    """根据这一页幻灯片的schema，形成对应类型的prompt；用户上传过资料时，附上检索到的相关内容"""
+    # 这页ppt的类型
+    slide_type = slide_schema.get("type")
+    logger.debug("当前要生成第%s页的ppt， 类型为：%s， 具体内容为：%s", slide_index, slide_type, slide_schema)
+    with tracer.start_as_current_span("ppt.build_instruction", attributes={"slide_index": slide_index, "slide_type": slide_type or ""}):
+        # 根据不同的类型，形成不同的prompt
+        slide_prompt = prompt.prompt_mapper[slide_type]
+        prompt_instruction = prompt.PREFIX_PAGE_PROMPT + slide_prompt.format(input_slide_data=slide_schema)
+        if slide_type in MATERIAL_SLIDE_TYPES:
+            # 本地BM25索引，毫秒级，没有网络请求；检索结果是prompt的一部分，缓存key也会随之变化
+            references = search_materials(user_id, slide_query(slide_schema))
+            if references:
+                prompt_instruction += prompt.MATERIAL_REFERENCE_PROMPT.format(references=format_references(references))
+    logger.debug("第%s页的prompt是：%s", slide_index, prompt_instruction)
+    return prompt_instruction
 
 
 class PPTWriterSubAgent(LlmAgent):
@@ -93,14 +189,17 @@ class PPTWriterSubAgent(LlmAgent):
         # 清空历史记录，防止历史记录进行干扰
         ctx.session.events = []
         if current_slide_index == 0:
-            print(f"正在生成第{current_slide_index}页幻灯片...")
+            logger.debug("正在生成第%s页幻灯片...", current_slide_index)
+        start = time.monotonic()
         # 调用父类逻辑（最终结果）
         async for event in super()._run_async_impl(ctx):
-            print(f"{self.name} 收到事件：{event}")
-            logger.info(f"{self.name} 收到事件：{event}")
+            logger.debug("%s 收到事件：%s", self.name, event)
             yield event
+        outline_json = ctx.session.state.get("outline_json") or []
+        if current_slide_index < len(outline_json):
+            SLIDE_LATENCY.labels(outline_json[current_slide_index].get("type", "unknown")).observe(time.monotonic() - start)
         if current_slide_index == slides_plan_num - 1:
-            print(f"生成第{current_slide_index}页幻灯片完成...")
+            logger.debug("生成第%s页幻灯片完成...", current_slide_index)
             # 退出循环
             yield Event(author=self.name, actions=EventActions(escalate=True))
         # 给current_slide_index加1
@@ -108,20 +207,67 @@ class PPTWriterSubAgent(LlmAgent):
 
     def _get_dynamic_instruction(self, ctx: InvocationContext) -> str:
         """动态整合所有研究发现并生成指令"""
-        # 当前正在生成第几页的ppt
-        current_slide_index: int = ctx.state.get("current_slide_index", 0)
-        # 获取大纲
-        outline_json: list = ctx.state.get("outline_json")
-        # 获取要生成的ppt的这一页的schema大纲
-        current_slide_schema = outline_json[current_slide_index]
-        # 这页ppt的类型
-        current_slide_type = current_slide_schema.get("type")
-        print(f"当前要生成第{current_slide_index}页的ppt， 类型为：{current_slide_type}， 具体内容为：{current_slide_schema}")
-        # 根据不同的类型，形成不同的prompt
-        slide_prompt = prompt.prompt_mapper[current_slide_type]
-        prompt_instruction = prompt.PREFIX_PAGE_PROMPT + slide_prompt.format(input_slide_data=current_slide_schema)
-        print(f"第{current_slide_index}页的prompt是：{prompt_instruction}")
-        return prompt_instruction
+        current_slide = _current_slide.get()
+        if current_slide is not None:
+            # 并发模式，每页在自己的task中构造请求
+            current_slide_index, current_slide_schema = current_slide
+        else:
+            # 当前正在生成第几页的ppt
+            current_slide_index: int = ctx.state.get("current_slide_index", 0)
+            # 获取大纲
+            outline_json: list = ctx.state.get("outline_json")
+            # 获取要生成的ppt的这一页的schema大纲
+            current_slide_schema = outline_json[current_slide_index]
+        return build_slide_instruction(current_slide_index, current_slide_schema, _user_id(ctx.state))
+
+    async def generate_slide(self, ctx: InvocationContext, slide_index: int, slide_schema: dict) -> Tuple[str, EventActions]:
+        """
+        并发模式下生成单页幻灯片：不依赖session中的current_slide_index，用这一页的schema生成instruction。
+        请求与串行模式一样由LlmAgent的request processor构造（generate_content_config、instruction、identity和contents），
+        before/after model callback 与串行模式保持一致，callback写入的state变化记录在返回的EventActions中。
+        :return: (模型输出的文本, 这一页的EventActions)
+        """
+        with tracer.start_as_current_span("ppt.slide", attributes={"slide_index": slide_index, "slide_type": slide_schema.get("type", "")}) as span:
+            start = time.monotonic()
+            llm = self.canonical_model
+            # 串行模式每页开始前清空了历史事件，这里使用没有历史事件的session副本，state仍然是同一个
+            slide_ctx = ctx.model_copy(update={"agent": self, "session": ctx.session.model_copy(update={"events": []})})
+            llm_request = LlmRequest()
+            token = _current_slide.set((slide_index, slide_schema))
+            try:
+                async for _ in self._llm_flow._preprocess_async(slide_ctx, llm_request):
+                    pass
+            finally:
+                _current_slide.reset(token)
+            event_actions = EventActions()
+            callback_context = CallbackContext(slide_ctx, event_actions=event_actions)
+            llm_response: Optional[LlmResponse] = None
+            for callback in self.canonical_before_model_callbacks:
+                callback_response = callback(callback_context=callback_context, llm_request=llm_request)
+                if inspect.isawaitable(callback_response):
+                    callback_response = await callback_response
+                if callback_response:
+                    # callback直接给出了结果，跳过LLM调用
+                    llm_response = callback_response
+                    span.set_attribute("cache_hit", True)
+                    break
+            if llm_response is None:
+                ctx.increment_llm_call_count()
+                with tracer.start_as_current_span("ppt.llm_call", attributes={"provider": PPT_WRITER_AGENT_CONFIG["provider"], "model": llm.model}):
+                    async for response in llm.generate_content_async(llm_request, stream=False):
+                        llm_response = response
+                for callback in self.canonical_after_model_callbacks:
+                    callback_response = callback(callback_context=callback_context, llm_response=llm_response)
+                    if inspect.isawaitable(callback_response):
+                        callback_response = await callback_response
+                    if callback_response:
+                        llm_response = callback_response
+                        break
+            if llm_response is None or not llm_response.content or not llm_response.content.parts:
+                raise RuntimeError(f"第{slide_index}页幻灯片模型没有返回内容")
+            part_texts = [part.text for part in llm_response.content.parts if part.text is not None]
+            SLIDE_LATENCY.labels(slide_schema.get("type", "unknown")).observe(time.monotonic() - start)
+            return "\n".join(part_texts), event_actions
 
 def my_super_before_agent_callback(callback_context: CallbackContext):
     """
@@ -144,3 +290,89 @@ ppt_generator_loop_agent = LoopAgent(
     ],
     before_agent_callback=my_super_before_agent_callback,
 )
+
+
+class PPTParallelGeneratorAgent(BaseAgent):
+    """
+    并发生成每一页幻灯片。每页的prompt只依赖outline_json[i]，所以多页可以同时调用LLM，
+    用信号量限制同时生成的页数，生成结果仍然按页码顺序输出到事件流中（事件author与串行模式相同，均为PPTWriterSubAgent）。
+    """
+    # 同时调用LLM生成的最大页数
+    max_concurrency: int = 5
+    # 每页最多调用几次，都失败时输出这一页的错误记录
+    max_attempts: int = 3
+    # 第一次重试前等待的秒数，之后每次翻倍
+    retry_backoff: float = 1.0
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            name="PPTGeneratorParallelAgent",
+            description="并发生成每一页幻灯片的内容，并按页码顺序输出",
+            sub_agents=[PPTWriterSubAgent()],
+            before_agent_callback=my_super_before_agent_callback,
+            **kwargs
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        writer: PPTWriterSubAgent = self.sub_agents[0]
+        outline_json: list = ctx.session.state.get("outline_json") or []
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def _generate(slide_index: int, slide_schema: dict) -> Tuple[str, EventActions, Optional[str]]:
+            """返回(这一页的输出, EventActions, 错误信息)，重试后仍然失败时输出的是错误记录"""
+            attempts = max(1, self.max_attempts)
+            for attempt in range(1, attempts + 1):
+                try:
+                    async with semaphore:
+                        slide_text, event_actions = await writer.generate_slide(ctx, slide_index, slide_schema)
+                    return slide_text, event_actions, None
+                except Exception as e:
+                    if attempt < attempts:
+                        delay = self.retry_backoff * 2 ** (attempt - 1)
+                        logger.warning(f"第{slide_index}页幻灯片第{attempt}次生成失败，{delay:.1f}秒后重试: {e}")
+                        # 等待时不占用信号量
+                        await asyncio.sleep(delay)
+                        continue
+                    # 单页失败不影响其它页，输出这一页的错误记录，客户端可以只重新生成这一页
+                    logger.error(f"第{slide_index}页幻灯片生成{attempts}次都失败: {e}", exc_info=True)
+                    error_message = f"第{slide_index + 1}页幻灯片生成失败: {e}"
+                    error_record = json.dumps({"status": "error", "message": error_message, "code": SLIDE_ERROR_CODE,
+                                               "slide_error": True}, ensure_ascii=False)
+                    return error_record, EventActions(), error_message
+
+        tasks = [asyncio.create_task(_generate(idx, schema)) for idx, schema in enumerate(outline_json)]
+        generated_slides_content: List[str] = list(ctx.session.state.get("generated_slides_content", []))
+        try:
+            # 按页码顺序等待，先完成的页在内存里等前面的页输出
+            for slide_index, task in enumerate(tasks):
+                slide_text, event_actions, error_message = await task
+                generated_slides_content.append(slide_text)
+                event_actions.state_delta["current_slide_index"] = slide_index + 1
+                if slide_index == len(tasks) - 1:
+                    event_actions.state_delta["generated_slides_content"] = generated_slides_content
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=writer.name,
+                    branch=ctx.branch,
+                    content=types.Content(role="model", parts=[types.Part(text=slide_text)]),
+                    actions=event_actions,
+                    error_code=SLIDE_ERROR_CODE if error_message else None,
+                    error_message=error_message,
+                    custom_metadata={"slide_error": {"index": slide_index, "message": error_message}} if error_message else None,
+                )
+        finally:
+            # 客户端断开等情况下，取消还没有完成的页
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+# --- 5. PPTParallelGeneratorAgent ---
+if PPT_GENERATE_CONFIG.get("mode") == "parallel":
+    ppt_generator_agent = PPTParallelGeneratorAgent(
+        max_concurrency=PPT_GENERATE_CONFIG.get("max_concurrency", 5),
+        max_attempts=PPT_GENERATE_CONFIG.get("max_attempts", 3),
+        retry_backoff=PPT_GENERATE_CONFIG.get("retry_backoff", 1.0),
+    )
+else:
+    ppt_generator_agent = ppt_generator_loop_agent
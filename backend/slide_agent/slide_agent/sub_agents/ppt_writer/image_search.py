@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 14:00
+# @File  : image_search.py
+# @Author:
+# @Desc  : Pexels图片搜索服务，共享httpx连接池，按查询缓存结果(TTL)，相同查询同时只请求一次，支持一次并发搜索整份PPT的配图
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from ...metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+# 搜索结果缓存的有效期（秒）
+IMAGE_SEARCH_CACHE_TTL = float(os.environ.get("IMAGE_SEARCH_CACHE_TTL", "3600"))
+# 最多缓存的查询数量
+IMAGE_SEARCH_CACHE_MAX = int(os.environ.get("IMAGE_SEARCH_CACHE_MAX", "1000"))
+# 同时请求Pexels的数量，Pexels有请求频率限制
+IMAGE_SEARCH_CONCURRENCY = int(os.environ.get("IMAGE_SEARCH_CONCURRENCY", "4"))
+IMAGE_SEARCH_TIMEOUT = float(os.environ.get("IMAGE_SEARCH_TIMEOUT", "10"))
+
+
+def get_simulate_images(query: str, count: int) -> List[Dict[str, Any]]:
+    """
+    获取模拟图片数据（当API不可用时使用）
+    """
+    # 根据查询词选择不同的模拟图片
+    query_lower = query.lower()
+
+    # 预设的图片池，按主题分类
+    image_pools = {
+        "technology": [
+            "https://images.pexels.com/photos/3861969/pexels-photo-3861969.jpeg",
+            "https://images.pexels.com/photos/3861967/pexels-photo-3861967.jpeg",
+            "https://images.pexels.com/photos/3861966/pexels-photo-3861966.jpeg",
+            "https://images.pexels.com/photos/3861965/pexels-photo-3861965.jpeg",
+            "https://images.pexels.com/photos/3861964/pexels-photo-3861964.jpeg",
+        ],
+        "business": [
+            "https://images.pexels.com/photos/3183150/pexels-photo-3183150.jpeg",
+            "https://images.pexels.com/photos/3183153/pexels-photo-3183153.jpeg",
+            "https://images.pexels.com/photos/3183154/pexels-photo-3183154.jpeg",
+            "https://images.pexels.com/photos/3183155/pexels-photo-3183155.jpeg",
+            "https://images.pexels.com/photos/3183156/pexels-photo-3183156.jpeg",
+        ],
+        "nature": [
+            "https://images.pexels.com/photos/3225517/pexels-photo-3225517.jpeg",
+            "https://images.pexels.com/photos/3225518/pexels-photo-3225518.jpeg",
+            "https://images.pexels.com/photos/3225519/pexels-photo-3225519.jpeg",
+            "https://images.pexels.com/photos/3225520/pexels-photo-3225520.jpeg",
+            "https://images.pexels.com/photos/3225521/pexels-photo-3225521.jpeg",
+        ],
+        "abstract": [
+            "https://images.pexels.com/photos/3255761/pexels-photo-3255761.jpeg",
+            "https://images.pexels.com/photos/3255762/pexels-photo-3255762.jpeg",
+            "https://images.pexels.com/photos/3255763/pexels-photo-3255763.jpeg",
+            "https://images.pexels.com/photos/3255764/pexels-photo-3255764.jpeg",
+            "https://images.pexels.com/photos/3255765/pexels-photo-3255765.jpeg",
+        ]
+    }
+
+    # 根据查询词选择最匹配的图片池
+    selected_pool = "abstract"  # 默认
+    for keyword, pool in image_pools.items():
+        if keyword in query_lower:
+            selected_pool = keyword
+            break
+
+    # 从选中的池中随机选择图片
+    pool_images = image_pools[selected_pool]
+    selected_images = random.sample(pool_images, min(count, len(pool_images)))
+
+    # 如果需要的数量超过池中的图片，重复选择
+    while len(selected_images) < count:
+        selected_images.extend(random.sample(pool_images, min(count - len(selected_images), len(pool_images))))
+
+    # 转换为标准格式
+    image_results = []
+    for i, src in enumerate(selected_images[:count]):
+        image_info = {
+            "id": random.randint(100000, 999999) + i,
+            "src": src,
+            "width": 1920,
+            "height": 1080,
+            "alt": f"{query} image {i+1}",
+            "photographer": "Pexels",
+            "url": src
+        }
+        image_results.append(image_info)
+
+    return image_results
+
+
+def _convert_photos(query: str, photos: List[Dict[str, Any]], count: int) -> List[Dict[str, Any]]:
+    """转换为前端需要的格式"""
+    image_results = []
+    for photo in photos[:count]:
+        image_info = {
+            "id": photo.get("id", random.randint(100000, 999999)),
+            "src": photo.get("src", {}).get("large2x", photo.get("src", {}).get("large", "")),
+            "width": photo.get("width", 1920),
+            "height": photo.get("height", 1080),
+            "alt": photo.get("alt", query),
+            "photographer": photo.get("photographer", "Unknown"),
+            "url": photo.get("url", "")
+        }
+        image_results.append(image_info)
+    return image_results
+
+
+@dataclass
+class _LoopClient:
+    """一个事件循环上的httpx客户端和并发控制，httpx的连接绑定在创建它的事件循环上，不能跨事件循环使用"""
+    client: httpx.AsyncClient
+    semaphore: asyncio.Semaphore
+    inflight: Dict[Tuple[str, int], asyncio.Task] = field(default_factory=dict)
+    # 事件循环结束时关闭客户端的task
+    closer: Optional[asyncio.Task] = None
+
+
+class ImageSearchService:
+    """
+    图片搜索服务：
+    1. 同一个事件循环中的请求共享一个httpx连接池，每个事件循环有自己的客户端，事件循环结束时（asyncio.run取消剩余task时）在这个事件循环中关闭
+    2. 按(查询词, 数量)缓存Pexels的结果，有效期内直接返回；模拟数据不缓存，API恢复后可以拿到真实图片
+    3. 相同的查询同时只请求一次，其它调用者等待同一个请求的结果
+    4. search_batch一次并发搜索多个查询，例如整份PPT每页的配图
+    """
+
+    def __init__(self, api_key: Optional[str] = None, cache_ttl: float = IMAGE_SEARCH_CACHE_TTL,
+                 cache_max: int = IMAGE_SEARCH_CACHE_MAX, concurrency: int = IMAGE_SEARCH_CONCURRENCY,
+                 timeout: float = IMAGE_SEARCH_TIMEOUT):
+        self.api_key = api_key
+        self.cache_ttl = cache_ttl
+        self.cache_max = cache_max
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # (查询词, 数量) -> (获取时间, 图片列表)，按最近使用排序
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._clients: Dict[asyncio.AbstractEventLoop, _LoopClient] = {}
+
+    def _get_api_key(self) -> Optional[str]:
+        # 从环境变量获取Pexels API密钥
+        return self.api_key or os.getenv("PEXELS_API_KEY")
+
+    def _get_client(self) -> _LoopClient:
+        """当前事件循环的客户端，没有则创建"""
+        loop = asyncio.get_running_loop()
+        # 没有通过asyncio.run正常结束的事件循环，它的客户端已经无法关闭，只能丢弃
+        for stale in [other for other in self._clients if other.is_closed()]:
+            logger.warning("事件循环已经关闭，丢弃它的图片搜索客户端")
+            del self._clients[stale]
+        state = self._clients.get(loop)
+        if state is None or state.client.is_closed:
+            state = _LoopClient(
+                client=httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency),
+                ),
+                semaphore=asyncio.Semaphore(self.concurrency),
+            )
+            state.closer = loop.create_task(self._close_on_shutdown(loop, state))
+            self._clients[loop] = state
+        return state
+
+    async def _close_on_shutdown(self, loop: asyncio.AbstractEventLoop, state: _LoopClient) -> None:
+        """一直等待，事件循环结束时asyncio.run会取消这个task，此时在事件循环中关闭客户端"""
+        try:
+            await asyncio.Future()
+        finally:
+            if self._clients.get(loop) is state:
+                del self._clients[loop]
+            await state.client.aclose()
+
+    def _cache_get(self, key: Tuple[str, int]) -> Optional[List[Dict[str, Any]]]:
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        fetched_at, images = item
+        if time.monotonic() - fetched_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return images
+
+    def _cache_set(self, key: Tuple[str, int], images: List[Dict[str, Any]]) -> None:
+        self._cache[key] = (time.monotonic(), images)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_max:
+            self._cache.popitem(last=False)
+
+    async def search(self, query: str, count: int = 1) -> List[Dict[str, Any]]:
+        """搜索一个查询的图片，返回count张图片的信息"""
+        api_key = self._get_api_key()
+        if not api_key:
+            # 如果没有API密钥，使用模拟数据
+            return get_simulate_images(query, count)
+        key = (query.strip().lower(), count)
+        images = self._cache_get(key)
+        if images is not None:
+            self.hits += 1
+            CACHE_REQUESTS.labels("image_search", "hit").inc()
+            return [dict(image) for image in images]
+        self.misses += 1
+        CACHE_REQUESTS.labels("image_search", "miss").inc()
+        inflight = self._get_client().inflight
+        task = inflight.get(key)
+        if task is None or task.done():
+            task = asyncio.create_task(self._fetch(key, query, count, api_key))
+            inflight[key] = task
+            task.add_done_callback(lambda t: inflight.pop(key, None) if inflight.get(key) is t else None)
+        try:
+            # shield: 一个调用者被取消时，不影响其它等待同一个请求的调用者
+            images = await asyncio.shield(task)
+        except Exception as e:
+            logger.warning(f"图片搜索出错: {query}, {e}")
+            return get_simulate_images(query, count)
+        if images is None:
+            logger.info(f"未找到关键词 '{query}' 相关的图片，使用模拟数据")
+            return get_simulate_images(query, count)
+        return [dict(image) for image in images]
+
+    async def _fetch(self, key: Tuple[str, int], query: str, count: int, api_key: str) -> Optional[List[Dict[str, Any]]]:
+        state = self._get_client()
+        params = {"query": query, "per_page": min(count, 80), "orientation": "landscape"}
+        async with state.semaphore:
+            logger.info(f"正在搜索图片，关键词: {query}")
+            response = await state.client.get(PEXELS_SEARCH_URL, params=params, headers={"Authorization": api_key})
+        response.raise_for_status()
+        photos = response.json().get("photos", [])
+        if not photos:
+            return None
+        images = _convert_photos(query, photos, count)
+        self._cache_set(key, images)
+        logger.info(f"成功搜索到 {len(images)} 张图片")
+        return images
+
+    async def search_batch(self, queries: List[str], count: int = 1) -> List[List[Dict[str, Any]]]:
+        """并发搜索多个查询，返回的列表和queries一一对应，重复的查询只请求一次"""
+        return list(await asyncio.gather(*(self.search(query, count) for query in queries)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "cached_queries": len(self._cache),
+            "inflight": sum(len(state.inflight) for state in self._clients.values()),
+        }
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的客户端"""
+        state = self._clients.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return
+        if state.closer is not None:
+            state.closer.cancel()
+        await state.client.aclose()
+
+
+# 全局单例
+image_search_service = ImageSearchService()
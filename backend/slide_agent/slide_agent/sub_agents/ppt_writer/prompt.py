@@ -12,6 +12,14 @@ PREFIX_PAGE_PROMPT = """
 """
 
 
+# 用户上传了相关资料时追加在页面prompt之后
+MATERIAL_REFERENCE_PROMPT = """
+# 用户资料：
+下面是从用户上传的资料中检索到的与本页相关的内容，扩写时优先使用其中的事实、数据和表述，不要编造资料中没有的数据：
+{references}
+"""
+
+
 # input_slide_data代表slide的json的模版
 COVER_PAGE_PROMPT="""
 封面页（type: "cover"）
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 19:00
+# @File  : trace_utils.py
+# @Author:
+# @Desc  : 基于OpenTelemetry的链路追踪：通过A2A消息的metadata传递W3C trace context，span导出到本地JSONL文件或OTLP collector
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.trace import Status, StatusCode
+
+logger = logging.getLogger(__name__)
+
+# 导出方式: none（不开启）、file（写入TRACE_FILE）、otlp（发送到OTEL_EXPORTER_OTLP_ENDPOINT）
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+# 采样率，上游已经采样的请求下游一定采样
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "1.0"))
+# A2A消息metadata中保存trace context的key
+TRACE_CONTEXT_KEY = "trace_context"
+
+tracer = trace.get_tracer("aippt")
+
+try:
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+    # 没有安装opentelemetry-sdk时，只能使用不记录任何数据的默认tracer
+    TracerProvider = None
+    SpanExporter = object
+
+
+class JsonlSpanExporter(SpanExporter):
+    """每个span写成一行JSON，用 trace_id 过滤后按 start 排序就可以找到慢的阶段"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence["ReadableSpan"]) -> "SpanExportResult":
+        lines = []
+        for span in spans:
+            parent = span.parent
+            lines.append(json.dumps({
+                "service": span.resource.attributes.get("service.name"),
+                "name": span.name,
+                "trace_id": format(span.context.trace_id, "032x"),
+                "span_id": format(span.context.span_id, "016x"),
+                "parent_id": format(parent.span_id, "016x") if parent else None,
+                "start": span.start_time / 1e9,
+                "duration_ms": round((span.end_time - span.start_time) / 1e6, 3),
+                "status": span.status.status_code.name,
+                "attributes": dict(span.attributes or {}),
+            }, ensure_ascii=False, default=str))
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.warning(f"写入trace文件{self.path}失败: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def setup_tracing(service_name: str, exporter: str = TRACE_EXPORTER) -> None:
+    """服务启动时调用一次，exporter为none时不做任何事情，span几乎没有开销"""
+    if exporter == "none":
+        return
+    if TracerProvider is None:
+        logger.warning("没有安装opentelemetry-sdk，无法开启链路追踪")
+        return
+    if exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("没有安装opentelemetry-exporter-otlp-proto-http，无法导出到collector")
+            return
+        span_exporter = OTLPSpanExporter()
+    else:
+        span_exporter = JsonlSpanExporter(TRACE_FILE)
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"链路追踪已开启，服务名: {service_name}，导出方式: {exporter}")
+
+
+@contextmanager
+def start_span(name: str, context: Optional[otel_context.Context] = None, attributes: Optional[dict] = None):
+    """
+    创建span但不设置为当前span，可以安全地跨越async generator的yield；
+    需要子span时用trace.set_span_in_context(span)作为context传入
+    """
+    span = tracer.start_span(name, context=context, attributes=attributes)
+    try:
+        yield span
+    except BaseException as e:
+        if isinstance(e, Exception):
+            span.record_exception(e)
+            span.set_status(Status(StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        span.end()
+
+
+@contextmanager
+def use_context(context: otel_context.Context):
+    """临时把context设置为当前context，例如在span中创建asyncio task，task会继承这个context；块内不能有yield"""
+    token = otel_context.attach(context)
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
+
+
+def inject_trace_context(metadata: dict, context: Optional[otel_context.Context] = None) -> dict:
+    """把trace context（traceparent等）写入A2A消息的metadata，下游Agent据此继续这条链路"""
+    carrier = {}
+    propagate.inject(carrier, context=context)
+    if carrier:
+        metadata[TRACE_CONTEXT_KEY] = carrier
+    return metadata
+
+
+def extract_trace_context(metadata: Optional[dict]) -> otel_context.Context:
+    """从A2A消息的metadata中恢复上游的trace context"""
+    carrier = (metadata or {}).get(TRACE_CONTEXT_KEY) or {}
+    return propagate.extract(carrier)
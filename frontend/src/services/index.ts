@@ -1,8 +1,24 @@
+import { nanoid } from 'nanoid'
 import axios from './config'
 
 // export const SERVER_URL = 'http://localhost:5000'
 export const SERVER_URL = '/api'
 
+const LOCALSTORAGE_KEY_USER_ID = 'aippt_user_id'
+
+/**
+ * 当前浏览器的用户ID，保存在 localStorage 中
+ * 后端按这个ID区分上传资料的检索索引，不传时不会使用任何上传的资料
+ */
+export const getUserId = (): string => {
+  let userId = localStorage.getItem(LOCALSTORAGE_KEY_USER_ID)
+  if (!userId) {
+    userId = nanoid()
+    localStorage.setItem(LOCALSTORAGE_KEY_USER_ID, userId)
+  }
+  return userId
+}
+
 interface AIPPTOutlinePayload {
   content: string
   language: string
@@ -48,6 +64,7 @@ export default {
         content,
         language,
         model,
+        user_id: getUserId(),
         stream: true,
       }),
     })
@@ -69,6 +86,7 @@ export default {
         language,
         model,
         style,
+        user_id: getUserId(),
         stream: true
       }),
     })
@@ -78,8 +96,9 @@ export default {
     const formData = new FormData()
     formData.append('file', file)
     formData.append('description', description)
+    formData.append('user_id', getUserId())
     
-    const response = await fetch(`${SERVER_URL}/upload_material`, {
+    const response = await fetch(`${SERVER_URL}/api/upload_material`, {
       method: 'POST',
       body: formData
     })
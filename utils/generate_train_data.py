@@ -6,14 +6,18 @@
 # @Contact : github: johnson7788
 # @Desc  : 生成RL的训练数据
 
-# 读取topic_data.jsonl，然后调用接口tools/aippt_outline，生成大纲
-# 解析大纲为json格式，保存到outline_data.jsonl
+# 读取topic_data.jsonl，然后并发调用接口tools/aippt_outline，生成大纲
+# 解析大纲为json格式，追加保存到outline_data.jsonl；再次运行时跳过已经生成的task，从中断的地方继续
 
+import asyncio
 import json
-import httpx
-import requests
-import re
 import os
+import random
+import re
+import time
+
+import click
+import httpx
 
 def parse_markdown_to_json(markdown_text):
     """
@@ -85,82 +89,223 @@ def parse_markdown_to_json(markdown_text):
     slides.append({"type": "end"})
     return slides
 
-def generate_data():
-    # The backend API is expected to be running.
-    # From backend/main_api/main.py, it runs on port 6800.
-    api_url = "http://127.0.0.1:6800/tools/aippt_outline"
-    
-    # Assuming the script is run from the project root directory.
-    input_file = 'topic_data.jsonl'
-    output_file = 'outline_data.jsonl'
+class Progress:
+    """统计处理进度和吞吐量"""
 
-    # Check if backend is running
-    try:
-        requests.get("http://127.0.0.1:6800/docs", timeout=5)
-    except requests.exceptions.ConnectionError:
-        print("Error: The backend service at http://127.0.0.1:6800 seems to be down.")
-        print("Please start the backend server by running 'uvicorn main:app --host 127.0.0.1 --port 6800' in 'backend/main_api/' directory.")
+    def __init__(self, report_every: float):
+        self.start = time.monotonic()
+        self.report_every = report_every
+        self.last_report = self.start
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        self.skipped = 0
+
+    def rate(self) -> float:
+        """每分钟完成的任务数"""
+        elapsed = time.monotonic() - self.start
+        return self.done / elapsed * 60 if elapsed else 0.0
+
+    def maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every:
+            self.last_report = now
+            print(f"已完成 {self.done}，失败 {self.failed}，重试 {self.retries}，跳过 {self.skipped}，"
+                  f"吞吐量 {self.rate():.1f} 个/分钟")
+
+
+def load_finished_tasks(output_file):
+    """读取已经生成的结果，返回其中的task集合，用于断点续跑"""
+    finished = set()
+    if not os.path.exists(output_file):
+        return finished
+    with open(output_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                task = json.loads(line).get("task")
+            except json.JSONDecodeError:
+                # 上次中断时可能写了半行
+                continue
+            if task:
+                finished.add(task)
+    return finished
+
+
+def truncate_partial_line(output_file, block_size=64 * 1024):
+    """上次中断时最后一行可能只写了一半，截断到最后一个换行符，避免续跑时下一条记录接在半行后面"""
+    if not os.path.exists(output_file):
         return
+    with open(output_file, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return
+        # 从文件末尾向前按块查找最后一个换行符
+        pos = end
+        while pos > 0:
+            start = max(0, pos - block_size)
+            f.seek(start)
+            index = f.read(pos - start).rfind(b'\n')
+            if index != -1:
+                pos = start + index + 1
+                break
+            pos = start
+        f.truncate(pos)
+    print(f"Warning: {output_file}最后一行不完整（上次运行被中断），已删除{end - pos}字节")
 
-    processed_count = 0
-    with open(input_file, 'r', encoding='utf-8') as f_in, \
-         open(output_file, 'w', encoding='utf-8') as f_out:
-        lines = f_in.readlines()
-        total_tasks = len(lines)
-        print(f"Found {total_tasks} tasks in {input_file}.")
 
-        for i, line in enumerate(lines):
+async def fetch_outline(client, api_url, task, language, model):
+    """请求一次大纲，返回Markdown文本；HTTP错误、接口返回错误和空大纲都抛出异常，由调用方重试"""
+    request_payload = {
+        "content": task,
+        "language": language,
+        "model": model,
+        "stream": True
+    }
+    async with client.stream("POST", api_url, json=request_payload) as response:
+        response.raise_for_status()
+        chunks = [chunk async for chunk in response.aiter_text()]
+    markdown_outline = "".join(chunks)
+    if not markdown_outline.strip():
+        raise ValueError("大纲为空")
+    if markdown_outline.lstrip().startswith("{"):
+        # 接口出错时返回{"status": "error", "message": ...}
+        try:
+            error = json.loads(markdown_outline)
+        except json.JSONDecodeError:
+            error = None
+        if isinstance(error, dict) and error.get("status") == "error":
+            raise ValueError(error.get("message") or "接口返回错误")
+    return markdown_outline
+
+
+async def process_task(client, api_url, data, language, model, retries, backoff, progress):
+    """生成一个task的大纲，失败时按指数退避重试，全部失败返回None"""
+    task = data["task"]
+    for attempt in range(retries + 1):
+        try:
+            markdown_outline = await fetch_outline(client, api_url, task, language, model)
+            return {
+                "task": task,
+                "difficulty": data.get("difficulty"),
+                "outline_markdown": markdown_outline,
+                "outline_json": parse_markdown_to_json(markdown_outline)
+            }
+        except (httpx.HTTPError, ValueError) as e:
+            # httpx的错误信息后面带有说明链接，只保留第一行
+            e = str(e).splitlines()[0] if str(e) else type(e).__name__
+            if attempt == retries:
+                print(f"Error: task '{task}'重试{retries}次后仍然失败: {e}")
+                return None
+            progress.retries += 1
+            delay = backoff * (2 ** attempt) + random.uniform(0, backoff)
+            print(f"Warning: task '{task}'第{attempt + 1}次请求失败: {e}，{delay:.1f}秒后重试")
+            await asyncio.sleep(delay)
+
+
+def read_tasks(input_file, finished, progress):
+    """逐行读取输入文件，跳过已经完成的task"""
+    with open(input_file, 'r', encoding='utf-8') as f_in:
+        for lineno, line in enumerate(f_in, 1):
+            if not line.strip():
+                continue
             try:
                 data = json.loads(line)
-                task = data.get("task")
-                if not task:
-                    continue
-
-                print(f"Processing task {i+1}/{total_tasks}: {task}")
-
-                # Call the API to get the outline
-                request_payload = {
-                    "content": task,
-                    "language": "Chinese",  # Topics are in Chinese
-                    "model": "default",
-                    "stream": True
-                }
-                # Set a generous timeout as the model can be slow
-                headers = {'content-type': 'application/json'}
-                with httpx.stream("POST", api_url, json=request_payload, headers=headers, timeout=None) as response:
-                    markdown_outline = ""
-                    for chunk in response.iter_text():
-                        markdown_outline += chunk
-                print(f"Outline for task '{task}':\n{markdown_outline}")
-
-                if not markdown_outline or not markdown_outline.strip():
-                    print(f"Warning: Received empty outline for task: {task}")
-                    continue
-
-                # Parse the markdown outline to a structured JSON
-                json_outline = parse_markdown_to_json(markdown_outline)
-                print(f"JSON outline for task '{task}':\n{json.dumps(json_outline, indent=4, ensure_ascii=False)}")
-
-                # Save the result
-                output_record = {
-                    "task": task,
-                    "difficulty": data.get("difficulty"),
-                    "outline_markdown": markdown_outline,
-                    "outline_json": json_outline
-                }
-                f_out.write(json.dumps(output_record, ensure_ascii=False) + '\n')
-                processed_count += 1
-
-            except requests.exceptions.RequestException as e:
-                print(f"Error calling API for task '{data.get('task', 'N/A')}': {e}")
             except json.JSONDecodeError as e:
-                print(f"Error decoding JSON. Line: '{line.strip()}'. Error: {e}")
-            except Exception as e:
-                print(f"An unexpected error occurred for task '{data.get('task', 'N/A')}': {e}")
-    
-    print(f"\nProcessing complete. Successfully generated outlines for {processed_count}/{total_tasks} tasks.")
+                print(f"Error decoding JSON. Line {lineno}: '{line.strip()}'. Error: {e}")
+                continue
+            task = data.get("task")
+            if not task:
+                continue
+            if task in finished:
+                progress.skipped += 1
+                continue
+            finished.add(task)
+            yield data
+
+
+async def generate_data(input_file, output_file, api_url, concurrency, retries, backoff, timeout, language, model,
+                        resume, report_every):
+    base_url = api_url.split("/tools/")[0]
+    # Check if backend is running
+    async with httpx.AsyncClient(timeout=5) as client:
+        try:
+            await client.get(f"{base_url}/docs")
+        except httpx.HTTPError:
+            print(f"Error: The backend service at {base_url} seems to be down.")
+            print("Please start the backend server by running 'uvicorn main:app --host 127.0.0.1 --port 6800' in 'backend/main_api/' directory.")
+            return
+
+    if resume:
+        truncate_partial_line(output_file)
+    finished = load_finished_tasks(output_file) if resume else set()
+    if finished:
+        print(f"{output_file}中已有{len(finished)}个task，跳过这些task")
+    progress = Progress(report_every)
+    # 队列长度有限，输入文件不会一次性读入内存
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    # 大纲生成比较慢，只限制连接时间和两个chunk之间的等待时间
+    client_timeout = httpx.Timeout(connect=10, read=timeout, write=30, pool=None)
+
+    async with httpx.AsyncClient(timeout=client_timeout, limits=limits) as client:
+        with open(output_file, 'a' if resume else 'w', encoding='utf-8') as f_out:
+            async def worker():
+                while True:
+                    data = await queue.get()
+                    if data is None:
+                        return
+                    try:
+                        record = await process_task(client, api_url, data, language, model, retries, backoff,
+                                                    progress)
+                    except Exception as e:
+                        # 其它异常（例如解析大纲出错）只算这个task失败，worker继续处理后面的task，
+                        # 否则worker退出后队列没有人消费，put会一直阻塞
+                        print(f"Error: task '{data['task']}'处理失败: {type(e).__name__}: {e}")
+                        record = None
+                    if record is None:
+                        progress.failed += 1
+                    else:
+                        # 每完成一个就写入，中断后下次从这里继续
+                        f_out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                        f_out.flush()
+                        progress.done += 1
+                    progress.maybe_report()
+
+            workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+            for data in read_tasks(input_file, finished, progress):
+                await queue.put(data)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    elapsed = time.monotonic() - progress.start
+    print(f"\nProcessing complete. 成功 {progress.done}，失败 {progress.failed}，跳过 {progress.skipped}，"
+          f"重试 {progress.retries}，耗时 {elapsed:.1f}秒，吞吐量 {progress.rate():.1f} 个/分钟")
+    if progress.failed:
+        print("失败的task没有写入结果文件，再次运行会重新生成")
     print(f"Results saved to {output_file}")
 
 
+@click.command()
+@click.option('--input-file', default='topic_data.jsonl', help='输入文件，每行一个{"task": ..., "difficulty": ...}')
+@click.option('--output-file', default='outline_data.jsonl', help='输出文件，每行一个task的大纲')
+@click.option('--api-url', default='http://127.0.0.1:6800/tools/aippt_outline', help='大纲接口地址')
+@click.option('--concurrency', default=8, help='同时生成的task数')
+@click.option('--retries', default=3, help='每个task失败后的重试次数')
+@click.option('--backoff', default=2.0, help='第一次重试前等待的秒数，之后每次翻倍')
+@click.option('--timeout', default=300.0, help='等待接口返回数据的超时时间（秒）')
+@click.option('--language', default='Chinese', help='大纲语言')  # Topics are in Chinese
+@click.option('--model', default='default')
+@click.option('--resume/--no-resume', default=True, help='跳过输出文件中已有的task并追加写入；--no-resume时覆盖输出文件')
+@click.option('--report-every', default=30.0, help='每隔多少秒打印一次进度')
+def main(input_file, output_file, api_url, concurrency, retries, backoff, timeout, language, model, resume, report_every):
+    # Assuming the script is run from the utils directory.
+    asyncio.run(generate_data(input_file, output_file, api_url, concurrency, retries, backoff, timeout, language,
+                              model, resume, report_every))
+
+
 if __name__ == '__main__':
-    generate_data()
+    main()